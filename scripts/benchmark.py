@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import clickhouse_connect
+
+import generate_data
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+READ_CHUNK_SIZE = 1024 * 1024
+GENERATE_CHUNK_ROWS = 1000000
+
+# Data generation
+
+def generate_dataset(directory, rows, seed):
+    """Write the sales_transactions table of generate_data with the given number of rows.
+
+    A data set generated earlier with the same size and seed is reused; sales
+    reference a tenth as many customers and products as they have rows,
+    and at least the base size of each.
+    """
+    path = os.path.join(directory, 'sales_transactions.csv')
+    if os.path.exists(path):
+        return path
+
+    sizes = {table: max(base, rows // 10) for table, base in generate_data.BASE_ROWS.items()}
+    options = {
+        'seed': seed,
+        'sizes': {**sizes, 'sales_transactions': rows},
+        'chunk_rows': GENERATE_CHUNK_ROWS,
+        'format': 'csv',
+        'compression': None,
+        'split': False,
+        'output_dir': directory,
+        'skew': 0,
+        'name_pool': 1000,
+        'users': 1000,
+        'pages': 100
+    }
+    os.makedirs(directory, exist_ok=True)
+    # The table is written under a partial name and renamed once complete
+    with ProcessPoolExecutor() as pool:
+        generate_data.write_table(pool, 'sales_transactions', rows, options, window=2 * (os.cpu_count() or 1))
+    return path
+
+# Server
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(timeout=30):
+    """Run the API in a uvicorn subprocess on a free local port and wait for it to answer."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', SERVER_DIR,
+         '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"Server exited with code {process.returncode}")
+        try:
+            request(url, 'GET', '/health')
+            return process, url
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    process.terminate()
+    raise Exception("Server did not start in time")
+
+def request(url, method, path, body=None, headers=None, stream=False):
+    """Send a request to the API; returns the parsed JSON body, or the open response if stream is set."""
+    data = json.dumps(body).encode() if isinstance(body, dict) else body
+    req = urllib.request.Request(url + path, data=data, method=method, headers=dict(headers or {}))
+    if isinstance(body, dict):
+        req.add_header('Content-Type', 'application/json')
+    response = urllib.request.urlopen(req)
+    if stream:
+        return response
+    with response:
+        return json.loads(response.read() or 'null')
+
+def multipart_body(field, path, fields=None):
+    """Build a multipart/form-data body that streams the file instead of loading it into memory."""
+    boundary = uuid.uuid4().hex
+    head = ''.join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        for name, value in (fields or {}).items()
+    )
+    head += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{os.path.basename(path)}"\r\n'
+        f'Content-Type: text/csv\r\n\r\n'
+    )
+    head = head.encode()
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+
+    def chunks():
+        yield head
+        with open(path, 'rb') as source:
+            while chunk := source.read(READ_CHUNK_SIZE):
+                yield chunk
+        yield tail
+
+    headers = {
+        'Content-Type': f'multipart/form-data; boundary={boundary}',
+        'Content-Length': str(len(head) + os.path.getsize(path) + len(tail))
+    }
+    return chunks(), headers
+
+def reset_peak_rss(pid):
+    """Reset the kernel's peak RSS counter of a process, so each phase reports its own peak (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+def peak_rss_mb(pid):
+    """Peak resident set size of a process in MB, or None where /proc is not available."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+# Benchmarks
+
+def summarize(phase, rows, size, latencies, server_pid, **extra):
+    """Throughput and latency percentiles of one phase, from the rows and bytes each run moved."""
+    latencies = np.array(latencies)
+    total = max(float(latencies.sum()), 1e-9)
+    return {
+        'phase': phase,
+        'rows': rows,
+        'bytes': size,
+        'runs': len(latencies),
+        'rows_per_s': rows * len(latencies) / total,
+        'mb_per_s': size * len(latencies) / (1024 * 1024) / total,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1000,
+        'server_peak_rss_mb': peak_rss_mb(server_pid) if server_pid else None,
+        **extra
+    }
+
+def bench_import(args, url, headers, table_names, csv_file, rows, server_pid):
+    size = os.path.getsize(csv_file)
+    latencies = []
+    if server_pid:
+        reset_peak_rss(server_pid)
+    for table in table_names:
+        body, body_headers = multipart_body('file', csv_file)
+        path = f"/import?table_name={table}&mode={args.import_mode}"
+        start = time.perf_counter()
+        result = request(url, 'POST', path, body, {**headers, **body_headers})
+        latencies.append(time.perf_counter() - start)
+        if not result['success'] or result['records_processed'] != rows:
+            raise Exception(f"Import into {table} failed: {result.get('error') or result['message']}")
+    return summarize('import', rows, size, latencies, server_pid, mode=args.import_mode)
+
+def bench_export(args, url, headers, table, columns, rows, output_format, server_pid):
+    body = {'query_config': {'table_name': table, 'columns': columns, 'output_format': output_format}}
+    latencies, first_byte = [], []
+    size = 0
+    if server_pid:
+        reset_peak_rss(server_pid)
+    for _ in range(args.repeat):
+        size = 0
+        start = time.perf_counter()
+        with request(url, 'POST', '/export/stream', body, {**headers, 'Accept-Encoding': 'identity'}, stream=True) as response:
+            while chunk := response.read(READ_CHUNK_SIZE):
+                if not size:
+                    first_byte.append(time.perf_counter() - start)
+                size += len(chunk)
+        latencies.append(time.perf_counter() - start)
+    return summarize(
+        f'export_{output_format}', rows, size, latencies, server_pid,
+        first_byte_p50_ms=float(np.percentile(first_byte, 50)) * 1000 if first_byte else None
+    )
+
+def bench_preview(args, url, headers, table, columns, server_pid, cached):
+    """Time preview requests; uncached requests vary the offset so none is answered from the preview cache."""
+    latencies = []
+    if server_pid:
+        reset_peak_rss(server_pid)
+    for i in range(args.preview_requests):
+        query_config = {'table_name': table, 'columns': columns, 'limit': args.preview_limit}
+        if not cached:
+            query_config['offset'] = i * args.preview_limit
+        start = time.perf_counter()
+        request(url, 'POST', '/preview', {'query_config': query_config}, headers)
+        latencies.append(time.perf_counter() - start)
+    return summarize('preview_cached' if cached else 'preview', args.preview_limit, 0, latencies, server_pid)
+
+def run_scale(args, url, headers, client, rows, server_pid):
+    csv_file = generate_dataset(os.path.join(args.data_dir, f"bench_{rows}_{args.seed}"), rows, args.seed)
+    columns = list(pd.read_csv(csv_file, nrows=0).columns)
+
+    # One fresh table per import run, so repeated imports measure the same work
+    table_names = [f"{args.table_prefix}_{rows}_{run}" for run in range(args.repeat)]
+    for table in table_names:
+        client.command(f"DROP TABLE IF EXISTS {table}")
+
+    results = []
+    try:
+        results.append(bench_import(args, url, headers, table_names, csv_file, rows, server_pid))
+        for output_format in args.formats:
+            results.append(bench_export(args, url, headers, table_names[0], columns, rows, output_format, server_pid))
+        results.append(bench_preview(args, url, headers, table_names[0], columns, server_pid, cached=False))
+        results.append(bench_preview(args, url, headers, table_names[0], columns, server_pid, cached=True))
+    finally:
+        if not args.keep_tables:
+            for table in table_names:
+                client.command(f"DROP TABLE IF EXISTS {table}")
+    for result in results:
+        result['scale'] = rows
+    return results
+
+# Reporting
+
+def format_result(result):
+    rss = result['server_peak_rss_mb']
+    return (
+        f"{result['phase']:<16} {result['scale']:>12,} rows {result['rows_per_s']:>14,.0f} rows/s "
+        f"{result['mb_per_s']:>9.2f} MB/s p50 {result['p50_ms']:>9.1f} ms p99 {result['p99_ms']:>9.1f} ms "
+        f"rss {f'{rss:.0f} MB' if rss is not None else 'n/a':>8}"
+    )
+
+def load_baseline(baseline_file):
+    with open(baseline_file) as source:
+        return {(r['phase'], r['scale']): r for r in json.load(source)['results']}
+
+def compare(results, baseline, baseline_file, max_regression):
+    """Print throughput and p99 changes against an earlier run; returns the regressed phases."""
+    print(f"\nCompared with {baseline_file}")
+    regressions = []
+    for result in results:
+        before = baseline.get((result['phase'], result['scale']))
+        if before is None:
+            continue
+        throughput = result['rows_per_s'] / max(before['rows_per_s'], 1e-9) - 1
+        p99 = result['p99_ms'] / max(before['p99_ms'], 1e-9) - 1
+        flag = ''
+        if throughput < -max_regression:
+            regressions.append(result['phase'])
+            flag = '  REGRESSION'
+        print(f"{result['phase']:<16} {result['scale']:>12,} rows {throughput:>+8.1%} rows/s {p99:>+8.1%} p99{flag}")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the import, export and preview endpoints on generated data.")
+    parser.add_argument('--url', help="URL of a running API server (default: start one locally)")
+    parser.add_argument('--server-pid', type=int, help="PID of the server given by --url, to report its peak RSS")
+    parser.add_argument('--host', default=os.environ.get('CLICKHOUSE_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CLICKHOUSE_PORT', '8123')))
+    parser.add_argument('--username', default=os.environ.get('CLICKHOUSE_USER', 'default'))
+    parser.add_argument('--password', default=os.environ.get('CLICKHOUSE_PASSWORD', ''))
+    parser.add_argument('--database', default=os.environ.get('CLICKHOUSE_DATABASE', 'default'))
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000], help="Data set sizes, e.g. 1000 1000000 100000000")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the generated data sets")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_data'),
+                        help="Where generated data sets are kept between runs")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each import and export")
+    parser.add_argument('--preview-requests', type=int, default=50, help="Requests per preview benchmark")
+    parser.add_argument('--preview-limit', type=int, default=100, help="Rows per preview request")
+    parser.add_argument('--formats', nargs='+', default=['csv', 'parquet'], help="Export formats to benchmark")
+    parser.add_argument('--import-mode', default='direct', choices=['direct', 'buffer', 'async'])
+    parser.add_argument('--table-prefix', default='benchmark')
+    parser.add_argument('--keep-tables', action='store_true', help="Keep the benchmark tables after the run")
+    parser.add_argument('--output', default=f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+                        help="Results file")
+    parser.add_argument('--baseline', help="Earlier results file to compare with")
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help="Throughput drop against the baseline that fails the run (default: 0.1)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+    # Read before the run, as the results may be written over the baseline file
+    baseline = load_baseline(args.baseline) if args.baseline else None
+
+    client = clickhouse_connect.get_client(
+        host=args.host,
+        port=args.port,
+        username=args.username,
+        password=args.password,
+        database=args.database
+    )
+
+    process = None
+    if args.url:
+        url, server_pid = args.url.rstrip('/'), args.server_pid
+    else:
+        process, url = start_server()
+        server_pid = process.pid
+
+    results = []
+    try:
+        session = request(url, 'POST', '/sessions', {
+            'host': args.host,
+            'port': str(args.port),
+            'database': args.database,
+            'username': args.username,
+            'password': args.password
+        })
+        headers = {'X-Session-Token': session['session_token']}
+
+        for rows in args.rows:
+            print(f"Benchmarking {rows:,} rows")
+            for result in run_scale(args, url, headers, client, rows, server_pid):
+                results.append(result)
+                print(format_result(result))
+        request(url, 'DELETE', f"/sessions/{session['session_token']}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    with open(args.output, 'w') as output:
+        json.dump({
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'config': {key: value for key, value in vars(args).items() if key != 'password'},
+            # Peak RSS of this process, which also generated the data sets
+            'client_peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'results': results
+        }, output, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if baseline and compare(results, baseline, args.baseline, args.max_regression):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
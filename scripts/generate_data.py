@@ -1,218 +1,437 @@
-import random
-import string
-import pandas as pd
-from datetime import datetime, timedelta
+import argparse
+import functools
+import glob
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
 from faker import Faker
 
-# Initialize Faker
-fake = Faker()
+# Event times fall in 2023; inventory updates run to a fixed end so runs are reproducible
+START_DATE = np.datetime64('2023-01-01T00:00:00', 's')
+END_DATE = np.datetime64('2024-01-01T00:00:00', 's')
+INVENTORY_END_DATE = np.datetime64('2025-01-01T00:00:00', 's')
+
+# Rows of each table at scale 1, in the order tables are generated
+BASE_ROWS = {
+    'customer_analytics': 500,
+    'website_analytics': 500,
+    'product_inventory': 500,
+    'sales_transactions': 500,
+    'marketing_campaigns': 500,
+    'social_media_metrics': 500
+}
+
+COUNTRIES = pa.array(['US', 'UK', 'CA', 'AU', 'IN'])
+SEGMENTS = pa.array(['new', 'active', 'loyal', 'churned'])
+EMAIL_DOMAINS = pa.array(['example.com', 'example.net', 'example.org'])
+EVENT_TYPES = pa.array(['page_view', 'click', 'purchase', 'add_to_cart'])
+BROWSERS = pa.array(['Chrome', 'Firefox', 'Safari', 'Edge'])
+OPERATING_SYSTEMS = pa.array(['Windows', 'MacOS', 'iOS', 'Android'])
+DEVICE_TYPES = pa.array(['desktop', 'mobile', 'tablet'])
+CATEGORIES = pa.array(['Electronics', 'Clothing', 'Home & Garden', 'Books', 'Sports'])
+# Three subcategories per category, in category order
+SUBCATEGORIES = pa.array([
+    'Smartphones', 'Laptops', 'Headphones',
+    'Men', 'Women', 'Kids',
+    'Furniture', 'Decor', 'Tools',
+    'Fiction', 'Non-Fiction', 'Children',
+    'Footwear', 'Equipment', 'Apparel'
+])
+PAYMENT_METHODS = pa.array(['credit_card', 'paypal', 'bank_transfer'])
+SALES_STATUSES = pa.array(['completed', 'pending', 'cancelled'])
+CHANNELS = pa.array(['Social Media', 'Email', 'Display', 'Search'])
+AUDIENCES = pa.array(['B2C', 'B2B', 'General'])
+CREATIVE_TYPES = pa.array(['Image', 'Video', 'Text'])
+CAMPAIGN_STATUSES = pa.array(['running', 'completed', 'paused'])
+PLATFORMS = pa.array(['Facebook', 'Instagram', 'Twitter', 'LinkedIn', 'TikTok'])
+CONTENT_TYPES = pa.array(['image', 'video', 'text'])
+ENGAGEMENT_TYPES = pa.array(['organic', 'paid'])
+LANGUAGES = pa.array(['en', 'es', 'fr', 'de', 'zh'])
+
+# Salt of the per-product price hash, shared by inventory and sales
+PRICE_SALT = 1
+
+# ASCII hex digits of every byte value, for formatting UUIDs
+HEX_DIGITS = np.frombuffer(''.join(f'{b:02x}' for b in range(256)).encode(), np.uint8).reshape(256, 2)
+UUID_HEX_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
 
 # Helper functions
-def random_date(start, end):
-    return start + timedelta(
-        seconds=random.randint(0, int((end - start).total_seconds()))
+@functools.lru_cache(maxsize=None)
+def text_pools(seed, size):
+    """Draw names, cities and streets from Faker once per process; rows pick from them by index."""
+    fake = Faker()
+    fake.seed_instance(seed)
+    return {
+        'first_names': pa.array([fake.first_name() for _ in range(size)]),
+        'last_names': pa.array([fake.last_name() for _ in range(size)]),
+        'cities': pa.array([fake.city() for _ in range(size)]),
+        'streets': pa.array([fake.street_name() for _ in range(size)]),
+        'states': pa.array([fake.state_abbr() for _ in range(size)])
+    }
+
+def join(*values):
+    """Concatenate string arrays and scalars element-wise."""
+    return pc.binary_join_element_wise(*values, '')
+
+def text(values):
+    return pc.cast(pa.array(values), pa.string())
+
+def prefixed_ids(prefix, ids, width):
+    """Format ids as e.g. P000042."""
+    return join(prefix, pc.utf8_lpad(text(ids), width, '0'))
+
+def choice(rng, values, rows):
+    return values.take(rng.integers(0, len(values), rows))
+
+def skewed_choice(rng, n, skew, rows):
+    """Pick indexes below n; skew 0 is uniform, and higher skews favour low indexes more strongly."""
+    if skew <= 0:
+        return rng.integers(0, n, rows)
+    return np.minimum((n * rng.random(rows) ** (1 + skew)).astype(np.int64), n - 1)
+
+def hash_uniform(ids, seed, salt):
+    """Uniform floats in [0, 1) that depend only on (seed, salt, id), so any chunk can derive them."""
+    with np.errstate(over='ignore'):
+        x = ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64((seed * 1000003 + salt) % 2**64)
+        # splitmix64 finalizer
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) / 2**53
+
+def product_prices(product_indexes, seed):
+    """Price of each product, the same in product_inventory and sales_transactions."""
+    return np.round(10 + 990 * hash_uniform(product_indexes, seed, PRICE_SALT), 2)
+
+def uniform(rng, low, high, rows):
+    return np.round(rng.uniform(low, high, rows), 2)
+
+def random_times(rng, start, end, rows):
+    return start + rng.integers(0, (end - start).astype(np.int64), rows).astype('timedelta64[s]')
+
+def uuids(rng, rows):
+    """Random version 4 UUID strings."""
+    raw = rng.integers(0, 256, (rows, 16), dtype=np.uint8)
+    raw[:, 6] = raw[:, 6] & 0x0F | 0x40
+    raw[:, 8] = raw[:, 8] & 0x3F | 0x80
+    formatted = np.full((rows, 36), ord('-'), np.uint8)
+    formatted[:, UUID_HEX_POSITIONS] = HEX_DIGITS[raw].reshape(rows, 32)
+    return pa.array(formatted.view('S36').ravel()).cast(pa.string())
+
+def addresses(rng, pools, rows):
+    """Two-line street addresses, e.g. "5634 Paul Green Apt. 905\\nEllenhaven, AR 71840"."""
+    apartment = pc.if_else(rng.random(rows) < 0.3, join(' Apt. ', text(rng.integers(1, 1000, rows))), '')
+    street = join(text(rng.integers(1, 100000, rows)), ' ', choice(rng, pools['streets'], rows), apartment)
+    return join(
+        street, '\n', choice(rng, pools['cities'], rows), ', ', choice(rng, pools['states'], rows), ' ',
+        text(rng.integers(10000, 100000, rows))
     )
 
-def generate_customer_data(n=500):
-    data = []
-    start_date = datetime(2023, 1, 1)
-    end_date = datetime(2024, 1, 1)
-    
-    for i in range(1, n + 1):
-        signup_date = random_date(start_date, end_date)
-        last_purchase = random_date(signup_date, end_date)
-        
-        data.append({
-            'customer_id': i,
-            'first_name': fake.first_name(),
-            'last_name': fake.last_name(),
-            'email': fake.email(),
-            'country': random.choice(['US', 'UK', 'CA', 'AU', 'IN']),
-            'signup_date': signup_date.date(),
-            'last_purchase_date': last_purchase.date(),
-            'total_purchases': random.randint(1, 50),
-            'total_spend': round(random.uniform(100, 5000), 2),
-            'average_order_value': round(random.uniform(20, 200), 2),
-            'customer_segment': random.choice(['new', 'active', 'loyal', 'churned']),
-            'churn_risk': round(random.uniform(0, 1), 2)
-        })
-    
-    return pd.DataFrame(data)
-
-def generate_website_data(n=500):
-    data = []
-    start_date = datetime(2023, 1, 1)
-    end_date = datetime(2024, 1, 1)
-    
-    for i in range(n):
-        event_time = random_date(start_date, end_date)
-        data.append({
-            'event_id': str(fake.uuid4()),
-            'user_id': fake.user_name(),
-            'event_type': random.choice(['page_view', 'click', 'purchase', 'add_to_cart']),
-            'event_timestamp': event_time,
-            'page_url': f'/product/{random.randint(1, 100)}',
-            'session_id': str(fake.uuid4()),
-            'browser': random.choice(['Chrome', 'Firefox', 'Safari', 'Edge']),
-            'os': random.choice(['Windows', 'MacOS', 'iOS', 'Android']),
-            'device_type': random.choice(['desktop', 'mobile', 'tablet']),
-            'country': random.choice(['US', 'UK', 'CA', 'AU', 'IN']),
-            'city': fake.city(),
-            'page_views': random.randint(1, 20),
-            'time_spent': round(random.uniform(1, 120), 2),
-            'is_conversion': random.choice([True, False])
-        })
-    
-    return pd.DataFrame(data)
-
-def generate_product_data(n=500):
-    categories = ['Electronics', 'Clothing', 'Home & Garden', 'Books', 'Sports']
-    subcategories = {
-        'Electronics': ['Smartphones', 'Laptops', 'Headphones'],
-        'Clothing': ['Men', 'Women', 'Kids'],
-        'Home & Garden': ['Furniture', 'Decor', 'Tools'],
-        'Books': ['Fiction', 'Non-Fiction', 'Children'],
-        'Sports': ['Footwear', 'Equipment', 'Apparel']
-    }
-    
-    data = []
-    for i in range(n):
-        category = random.choice(categories)
-        subcat = random.choice(subcategories[category])
-        
-        data.append({
-            'product_id': f'P{i:06d}',
-            'product_name': f'{category} {subcat} {i}',
-            'category': category,
-            'subcategory': subcat,
-            'price': round(random.uniform(10, 1000), 2),
-            'stock_quantity': random.randint(0, 100),
-            'last_updated': random_date(datetime(2023, 1, 1), datetime.now()),
-            'supplier_id': f'S{i:04d}',
-            'supplier_name': f'Supplier {i}',
-            'lead_time': random.randint(1, 14),
-            'reorder_point': random.randint(10, 50),
-            'safety_stock': random.randint(5, 20)
-        })
-    
-    return pd.DataFrame(data)
-
-def generate_sales_data(n=500):
-    products = pd.read_csv('product_inventory.csv')
-    customers = pd.read_csv('customer_analytics.csv')
-    
-    data = []
-    start_date = datetime(2023, 1, 1)
-    end_date = datetime(2024, 1, 1)
-    
-    for i in range(n):
-        customer = customers.sample(1).iloc[0]
-        product = products.sample(1).iloc[0]
-        transaction_time = random_date(start_date, end_date)
-        
-        data.append({
-            'transaction_id': f'T{i:06d}',
-            'order_id': f'O{i:06d}',
-            'customer_id': int(customer['customer_id']),
-            'product_id': product['product_id'],
-            'quantity': random.randint(1, 5),
-            'unit_price': product['price'],
-            'total_price': round(product['price'] * random.randint(1, 5), 2),
-            'discount': round(random.uniform(0, 0.3), 2),
-            'tax': round(random.uniform(0.05, 0.2), 2),
-            'transaction_date': transaction_time.date(),
-            'transaction_time': transaction_time,
-            'payment_method': random.choice(['credit_card', 'paypal', 'bank_transfer']),
-            'status': random.choice(['completed', 'pending', 'cancelled']),
-            'shipping_address': fake.address(),
-            'billing_address': fake.address()
-        })
-    
-    return pd.DataFrame(data)
-
-def generate_marketing_data(n=500):
-    data = []
-    start_date = datetime(2023, 1, 1)
-    end_date = datetime(2024, 1, 1)
-    
-    for i in range(n):
-        start = random_date(start_date, end_date)
-        duration = random.randint(7, 30)
-        end = start + timedelta(days=duration)
-        
-        data.append({
-            'campaign_id': f'C{i:06d}',
-            'campaign_name': f'Campaign_{i}',
-            'start_date': start.date(),
-            'end_date': end.date(),
-            'budget': round(random.uniform(1000, 100000), 2),
-            'channel': random.choice(['Social Media', 'Email', 'Display', 'Search']),
-            'target_audience': random.choice(['B2C', 'B2B', 'General']),
-            'creative_type': random.choice(['Image', 'Video', 'Text']),
-            'status': random.choice(['running', 'completed', 'paused']),
-            'impressions': random.randint(1000, 1000000),
-            'clicks': random.randint(100, 10000),
-            'conversions': random.randint(10, 1000),
-            'cost_per_click': round(random.uniform(0.1, 5), 2),
-            'conversion_rate': round(random.uniform(0.01, 0.2), 2)
-        })
-    
-    return pd.DataFrame(data)
-
-def generate_social_data(n=500):
-    platforms = ['Facebook', 'Instagram', 'Twitter', 'LinkedIn', 'TikTok']
-    data = []
-    start_date = datetime(2023, 1, 1)
-    end_date = datetime(2024, 1, 1)
-    
-    for i in range(n):
-        post_time = random_date(start_date, end_date)
-        data.append({
-            'post_id': f'P{i:06d}',
-            'platform': random.choice(platforms),
-            'post_date': post_time.date(),
-            'post_time': post_time,
-            'content_type': random.choice(['image', 'video', 'text']),
-            'engagement_type': random.choice(['organic', 'paid']),
-            'likes': random.randint(0, 10000),
-            'comments': random.randint(0, 1000),
-            'shares': random.randint(0, 5000),
-            'reach': random.randint(1000, 1000000),
-            'impressions': random.randint(1000, 1000000),
-            'clicks': random.randint(0, 10000),
-            'sentiment_score': round(random.uniform(-1, 1), 2),
-            'language': random.choice(['en', 'es', 'fr', 'de', 'zh'])
-        })
-    
-    return pd.DataFrame(data)
+# Table generators: each builds rows [first, first + rows) of its table
+def generate_customer_data(rng, first, rows, options):
+    pools = text_pools(options['seed'], options['name_pool'])
+    first_names = choice(rng, pools['first_names'], rows)
+    last_names = choice(rng, pools['last_names'], rows)
+    signup = random_times(rng, START_DATE, END_DATE, rows)
+    last_purchase = signup + (rng.random(rows) * (END_DATE - signup).astype(np.int64)).astype('timedelta64[s]')
+
+    return pa.table({
+        'customer_id': np.arange(first + 1, first + rows + 1),
+        'first_name': first_names,
+        'last_name': last_names,
+        'email': join(
+            pc.utf8_lower(first_names), pc.utf8_lower(last_names), text(rng.integers(0, 100, rows)),
+            '@', choice(rng, EMAIL_DOMAINS, rows)
+        ),
+        'country': choice(rng, COUNTRIES, rows),
+        'signup_date': signup.astype('datetime64[D]'),
+        'last_purchase_date': last_purchase.astype('datetime64[D]'),
+        'total_purchases': rng.integers(1, 51, rows),
+        'total_spend': uniform(rng, 100, 5000, rows),
+        'average_order_value': uniform(rng, 20, 200, rows),
+        'customer_segment': choice(rng, SEGMENTS, rows),
+        'churn_risk': uniform(rng, 0, 1, rows)
+    })
+
+def generate_website_data(rng, first, rows, options):
+    pools = text_pools(options['seed'], options['name_pool'])
+    users = rng.integers(0, options['users'], rows)
+    pages = skewed_choice(rng, options['pages'], options['skew'], rows) + 1
+
+    return pa.table({
+        'event_id': uuids(rng, rows),
+        'user_id': join(pc.utf8_lower(pools['first_names'].take(users % len(pools['first_names']))), text(users)),
+        'event_type': choice(rng, EVENT_TYPES, rows),
+        'event_timestamp': random_times(rng, START_DATE, END_DATE, rows),
+        'page_url': join('/product/', text(pages)),
+        'session_id': uuids(rng, rows),
+        'browser': choice(rng, BROWSERS, rows),
+        'os': choice(rng, OPERATING_SYSTEMS, rows),
+        'device_type': choice(rng, DEVICE_TYPES, rows),
+        'country': choice(rng, COUNTRIES, rows),
+        'city': choice(rng, pools['cities'], rows),
+        'page_views': rng.integers(1, 21, rows),
+        'time_spent': uniform(rng, 1, 120, rows),
+        'is_conversion': rng.random(rows) < 0.5
+    })
+
+def generate_product_data(rng, first, rows, options):
+    ids = np.arange(first, first + rows)
+    category = rng.integers(0, len(CATEGORIES), rows)
+    category_names = CATEGORIES.take(category)
+    subcategory_names = SUBCATEGORIES.take(category * 3 + rng.integers(0, 3, rows))
+
+    return pa.table({
+        'product_id': prefixed_ids('P', ids, 6),
+        'product_name': pc.binary_join_element_wise(category_names, subcategory_names, text(ids), ' '),
+        'category': category_names,
+        'subcategory': subcategory_names,
+        'price': product_prices(ids, options['seed']),
+        'stock_quantity': rng.integers(0, 101, rows),
+        'last_updated': random_times(rng, START_DATE, INVENTORY_END_DATE, rows),
+        'supplier_id': prefixed_ids('S', ids, 4),
+        'supplier_name': join('Supplier ', text(ids)),
+        'lead_time': rng.integers(1, 15, rows),
+        'reorder_point': rng.integers(10, 51, rows),
+        'safety_stock': rng.integers(5, 21, rows)
+    })
+
+def generate_sales_data(rng, first, rows, options):
+    # Customers and products are picked by index, so every sale references a
+    # generated row and its product's price without reading the other tables
+    pools = text_pools(options['seed'], options['name_pool'])
+    ids = np.arange(first, first + rows)
+    customers = skewed_choice(rng, options['sizes']['customer_analytics'], options['skew'], rows) + 1
+    products = skewed_choice(rng, options['sizes']['product_inventory'], options['skew'], rows)
+    quantity = rng.integers(1, 6, rows)
+    unit_price = product_prices(products, options['seed'])
+    transaction_time = random_times(rng, START_DATE, END_DATE, rows)
+
+    return pa.table({
+        'transaction_id': prefixed_ids('T', ids, 6),
+        'order_id': prefixed_ids('O', ids, 6),
+        'customer_id': customers,
+        'product_id': prefixed_ids('P', products, 6),
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'total_price': np.round(unit_price * quantity, 2),
+        'discount': uniform(rng, 0, 0.3, rows),
+        'tax': uniform(rng, 0.05, 0.2, rows),
+        'transaction_date': transaction_time.astype('datetime64[D]'),
+        'transaction_time': transaction_time,
+        'payment_method': choice(rng, PAYMENT_METHODS, rows),
+        'status': choice(rng, SALES_STATUSES, rows),
+        'shipping_address': addresses(rng, pools, rows),
+        'billing_address': addresses(rng, pools, rows)
+    })
+
+def generate_marketing_data(rng, first, rows, options):
+    ids = np.arange(first, first + rows)
+    start = random_times(rng, START_DATE, END_DATE, rows).astype('datetime64[D]')
+
+    return pa.table({
+        'campaign_id': prefixed_ids('C', ids, 6),
+        'campaign_name': join('Campaign_', text(ids)),
+        'start_date': start,
+        'end_date': start + rng.integers(7, 31, rows).astype('timedelta64[D]'),
+        'budget': uniform(rng, 1000, 100000, rows),
+        'channel': choice(rng, CHANNELS, rows),
+        'target_audience': choice(rng, AUDIENCES, rows),
+        'creative_type': choice(rng, CREATIVE_TYPES, rows),
+        'status': choice(rng, CAMPAIGN_STATUSES, rows),
+        'impressions': rng.integers(1000, 1000001, rows),
+        'clicks': rng.integers(100, 10001, rows),
+        'conversions': rng.integers(10, 1001, rows),
+        'cost_per_click': uniform(rng, 0.1, 5, rows),
+        'conversion_rate': uniform(rng, 0.01, 0.2, rows)
+    })
+
+def generate_social_data(rng, first, rows, options):
+    post_time = random_times(rng, START_DATE, END_DATE, rows)
+
+    return pa.table({
+        'post_id': prefixed_ids('P', np.arange(first, first + rows), 6),
+        'platform': choice(rng, PLATFORMS, rows),
+        'post_date': post_time.astype('datetime64[D]'),
+        'post_time': post_time,
+        'content_type': choice(rng, CONTENT_TYPES, rows),
+        'engagement_type': choice(rng, ENGAGEMENT_TYPES, rows),
+        'likes': rng.integers(0, 10001, rows),
+        'comments': rng.integers(0, 1001, rows),
+        'shares': rng.integers(0, 5001, rows),
+        'reach': rng.integers(1000, 1000001, rows),
+        'impressions': rng.integers(1000, 1000001, rows),
+        'clicks': rng.integers(0, 10001, rows),
+        'sentiment_score': uniform(rng, -1, 1, rows),
+        'language': choice(rng, LANGUAGES, rows)
+    })
+
+GENERATORS = {
+    'customer_analytics': generate_customer_data,
+    'website_analytics': generate_website_data,
+    'product_inventory': generate_product_data,
+    'sales_transactions': generate_sales_data,
+    'marketing_campaigns': generate_marketing_data,
+    'social_media_metrics': generate_social_data
+}
+
+# Chunks
+def generate_chunk(table, index, first, rows, options):
+    """Generate one chunk of a table in a worker process.
+
+    Each chunk has its own seed, so the data only depends on the seed and
+    chunk size, not on the number of workers. Returns CSV bytes or an Arrow
+    table for the parent to append to the table's file, or with split output
+    writes the chunk to its own file and returns its row count.
+    """
+    rng = np.random.default_rng([options['seed'], list(GENERATORS).index(table), index])
+    data = GENERATORS[table](rng, first, rows, options)
+
+    if options['split']:
+        path = os.path.join(options['output_dir'], table, f"part-{index:05d}.{options['format']}")
+        if options['format'] == 'parquet':
+            pq.write_table(data, path, compression=options['compression'])
+        else:
+            pcsv.write_csv(data, path)
+        return rows
+
+    if options['format'] == 'parquet':
+        return data
+    sink = pa.BufferOutputStream()
+    pcsv.write_csv(data, sink, pcsv.WriteOptions(include_header=index == 0))
+    return sink.getvalue().to_pybytes()
+
+def ordered_results(pool, tasks, window):
+    """Run generate_chunk over tasks, yielding results in order with at most window chunks in flight."""
+    if pool is None:
+        for task in tasks:
+            yield generate_chunk(*task)
+        return
+
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(generate_chunk, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def write_table(pool, table, rows, options, window):
+    """Generate a table chunk by chunk; returns the number of bytes written."""
+    chunk_rows = options['chunk_rows']
+    # A table without rows gets one empty chunk, so its file still has a header or schema
+    tasks = [
+        (table, index, first, min(chunk_rows, rows - first), options)
+        for index, first in enumerate(range(0, rows, chunk_rows))
+    ] or [(table, 0, 0, 0, options)]
+
+    if options['split']:
+        directory = os.path.join(options['output_dir'], table)
+        os.makedirs(directory, exist_ok=True)
+        # Parts of an earlier, larger run would otherwise be left behind
+        for path in glob.glob(os.path.join(directory, 'part-*')):
+            os.remove(path)
+        for _ in ordered_results(pool, tasks, window):
+            pass
+        return sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, 'part-*')))
+
+    path = os.path.join(options['output_dir'], f"{table}.{options['format']}")
+    partial = f"{path}.partial"
+    if options['format'] == 'parquet':
+        writer = None
+        for data in ordered_results(pool, tasks, window):
+            if writer is None:
+                writer = pq.ParquetWriter(partial, data.schema, compression=options['compression'])
+            writer.write_table(data)
+        writer.close()
+    else:
+        with open(partial, 'wb') as output:
+            for data in ordered_results(pool, tasks, window):
+                output.write(data)
+    os.replace(partial, path)
+    return os.path.getsize(path)
+
+def parse_rows(values):
+    rows = {}
+    for value in values:
+        table, _, count = value.partition('=')
+        if table not in BASE_ROWS or not count.isdigit():
+            raise argparse.ArgumentTypeError(f"Expected TABLE=ROWS with one of {', '.join(BASE_ROWS)}, got {value}")
+        rows[table] = int(count)
+    return rows
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the sample data sets at any scale with vectorized NumPy chunks.")
+    parser.add_argument('--scale', type=float, default=1, help="Multiplier of every table's base size of 500 rows")
+    parser.add_argument('--rows', nargs='+', default=[], metavar='TABLE=ROWS',
+                        help="Row counts overriding the scale, e.g. sales_transactions=100000000")
+    parser.add_argument('--tables', nargs='+', choices=list(BASE_ROWS), default=list(BASE_ROWS),
+                        help="Tables to write (default: all); sales still reference the sized customers and products")
+    parser.add_argument('--seed', type=int, default=42, help="Seed; the same seed and chunk size give the same data")
+    parser.add_argument('--chunk-rows', type=int, default=1000000, help="Rows generated per chunk")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Generator processes")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--compression', default='snappy', help="Parquet compression codec")
+    parser.add_argument('--split', action='store_true',
+                        help="Write each chunk to its own file under a directory per table, in parallel")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--skew', type=float, default=0,
+                        help="Popularity skew of customers and products in sales and of website pages; 0 is uniform")
+    parser.add_argument('--name-pool', type=int, default=1000,
+                        help="Distinct first names, last names, cities, streets and states to draw from")
+    parser.add_argument('--users', type=int, default=1000, help="Distinct website user ids")
+    parser.add_argument('--pages', type=int, default=100, help="Distinct website product pages")
+    args = parser.parse_args()
+    try:
+        args.rows = parse_rows(args.rows)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if 'sales_transactions' in args.tables and args.rows.get('sales_transactions') != 0:
+        if 0 in (args.rows.get('customer_analytics'), args.rows.get('product_inventory')):
+            parser.error("sales_transactions needs customer_analytics and product_inventory rows to reference")
+    return args
 
 # Generate and save data
 def main():
-    print("Generating customer analytics data...")
-    customer_df = generate_customer_data()
-    customer_df.to_csv('customer_analytics.csv', index=False)
-    
-    print("Generating website analytics data...")
-    website_df = generate_website_data()
-    website_df.to_csv('website_analytics.csv', index=False)
-    
-    print("Generating product inventory data...")
-    product_df = generate_product_data()
-    product_df.to_csv('product_inventory.csv', index=False)
-    
-    print("Generating sales transactions data...")
-    sales_df = generate_sales_data()
-    sales_df.to_csv('sales_transactions.csv', index=False)
-    
-    print("Generating marketing campaigns data...")
-    marketing_df = generate_marketing_data()
-    marketing_df.to_csv('marketing_campaigns.csv', index=False)
-    
-    print("Generating social media metrics data...")
-    social_df = generate_social_data()
-    social_df.to_csv('social_media_metrics.csv', index=False)
-    
+    args = parse_args()
+    sizes = {table: args.rows.get(table, max(int(base * args.scale), 1)) for table, base in BASE_ROWS.items()}
+    options = {
+        'seed': args.seed,
+        'sizes': sizes,
+        'chunk_rows': args.chunk_rows,
+        'format': args.format,
+        'compression': args.compression,
+        'split': args.split,
+        'output_dir': args.output_dir,
+        'skew': args.skew,
+        'name_pool': args.name_pool,
+        'users': args.users,
+        'pages': args.pages
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Two chunks per worker keep every worker busy while the parent writes
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    try:
+        for table in args.tables:
+            print(f"Generating {sizes[table]:,} rows of {table}...")
+            start = time.perf_counter()
+            size = write_table(pool, table, sizes[table], options, window=2 * args.workers)
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            print(f"  {elapsed:.2f}s, {sizes[table] / elapsed:,.0f} rows/s, {size / (1024 * 1024) / elapsed:.1f} MB/s")
+    finally:
+        if pool:
+            pool.shutdown()
+
     print("Data generation complete!")
 
 if __name__ == "__main__":
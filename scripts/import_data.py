@@ -1,39 +1,191 @@
+import argparse
+import glob
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
 import clickhouse_connect
 
-def import_csv_to_clickhouse(table_name, csv_file):
+# Loader threads share one client, so it must not be bound to a server-side session
+clickhouse_connect.common.set_setting('autogenerate_session_id', False)
+
+logger = logging.getLogger(__name__)
+
+def get_client(args):
     # Connect to ClickHouse
-    client = clickhouse_connect.get_client(host='localhost', port=9000, username='default')
-    
-    # Read CSV file
-    df = pd.read_csv(csv_file)
-    
-    # Convert DataFrame to list of dictionaries
-    data = df.to_dict('records')
-    
-    # Get column names and types from the table
-    result = client.query(f"DESCRIBE TABLE {table_name}")
-    columns = [row['name'] for row in result.named_results()]
-    
-    # Insert data
-    client.insert(table_name, data, column_names=columns)
-    
-    print(f"Successfully imported {len(data)} records into {table_name}")
+    return clickhouse_connect.get_client(
+        host=args.host,
+        port=args.port,
+        username=args.username,
+        password=args.password,
+        database=args.database
+    )
 
-if __name__ == "__main__":
-    # List of tables and their CSV files
-    tables = {
-        'customer_analytics': 'customer_analytics.csv',
-        'website_analytics': 'website_analytics.csv',
-        'product_inventory': 'product_inventory.csv',
-        'sales_transactions': 'sales_transactions.csv',
-        'marketing_campaigns': 'marketing_campaigns.csv',
-        'social_media_metrics': 'social_media_metrics.csv'
-    }
-    
-    # Import each table
-    for table, csv_file in tables.items():
+def find_csv_files(paths):
+    """Expand directories and glob patterns into a sorted list of CSV files."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '*.csv')))
+        else:
+            files.update(glob.glob(path))
+    return sorted(files)
+
+def insert_with_retries(client, context, batch, retries, backoff, token=None):
+    """Insert one batch, retrying failed attempts with exponential backoff.
+
+    Every attempt carries the same insert_deduplication_token, so a retry of an
+    insert the server applied despite the error is dropped rather than written
+    twice. ClickHouse only deduplicates inserts into Replicated tables, or
+    MergeTree tables with non_replicated_deduplication_window set; other
+    tables may get a batch twice.
+    """
+    if token:
+        context.settings = {**(context.settings or {}), 'insert_deduplication_token': token}
+    for attempt in range(retries + 1):
         try:
-            import_csv_to_clickhouse(table, csv_file)
+            client.insert_df(df=batch, context=context)
+            return
         except Exception as e:
-            print(f"Error importing {table}: {str(e)}")
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            logger.warning("Insert failed (%s), retrying in %.1fs", e, delay)
+            time.sleep(delay)
+
+def batch_tokens(csv_file, batch_size):
+    """Yield a deduplication token per batch of a file: its name, version and the batch index.
+
+    Loading an unchanged file again with the same batch size reuses the
+    tokens, so rerunning a load that failed partway only adds the batches
+    that are missing.
+    """
+    stat = os.stat(csv_file)
+    prefix = f"{os.path.basename(csv_file)}:{stat.st_size}:{stat.st_mtime_ns}:{batch_size}"
+    index = 0
+    while True:
+        yield f"{prefix}:{index}"
+        index += 1
+
+def date_columns(table_types):
+    """Names of the Date and DateTime columns, which insert_df needs as datetimes rather than strings."""
+    names = []
+    for name, col_type in table_types.items():
+        base_type = re.sub(r'^(LowCardinality|Nullable)\((.*)\)$', r'\2', col_type)
+        base_type = re.sub(r'^(LowCardinality|Nullable)\((.*)\)$', r'\2', base_type)
+        if base_type.startswith(('Date', 'DateTime')):
+            names.append(name)
+    return names
+
+def import_csv_to_clickhouse(client, table_name, csv_file, batch_size=100000, retries=3, backoff=1.0):
+    """Load one CSV file into a table in columnar batches and return its throughput stats."""
+    start = time.perf_counter()
+
+    # Get column names and types from the table once, not per batch
+    result = client.query(f"DESCRIBE TABLE {table_name}")
+    table_types = {row['name']: row['type'] for row in result.named_results()}
+
+    context = None
+    rows = 0
+
+    # Only parse the date columns present in the file
+    csv_columns = list(pd.read_csv(csv_file, nrows=0).columns)
+    parse_dates = [name for name in date_columns(table_types) if name in csv_columns]
+
+    # Read CSV file in batches; insert_df sends each DataFrame column by column
+    with pd.read_csv(csv_file, chunksize=batch_size, parse_dates=parse_dates) as reader:
+        for batch, token in zip(reader, batch_tokens(csv_file, batch_size)):
+            if context is None:
+                column_names = list(batch.columns)
+                context = client.create_insert_context(
+                    table_name,
+                    column_names=column_names,
+                    column_type_names=[table_types[name] for name in column_names]
+                )
+            # Retrying a single batch keeps already inserted batches from being duplicated
+            insert_with_retries(client, context, batch, retries, backoff, token)
+            rows += len(batch)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'table': table_name,
+        'file': csv_file,
+        'rows': rows,
+        'bytes': os.path.getsize(csv_file),
+        'seconds': elapsed
+    }
+
+def format_stats(name, rows, size, seconds):
+    seconds = max(seconds, 1e-9)
+    mb = size / (1024 * 1024)
+    return f"{name:<40} {rows:>12,} rows {mb:>10.2f} MB {seconds:>8.2f}s {rows / seconds:>14,.0f} rows/s {mb / seconds:>9.2f} MB/s"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk load CSV files into ClickHouse tables named after each file.")
+    parser.add_argument('paths', nargs='*', default=['.'], help="CSV files, directories or glob patterns (default: current directory)")
+    parser.add_argument('--host', default=os.environ.get('CLICKHOUSE_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CLICKHOUSE_PORT', '8123')))
+    parser.add_argument('--username', default=os.environ.get('CLICKHOUSE_USER', 'default'))
+    parser.add_argument('--password', default=os.environ.get('CLICKHOUSE_PASSWORD', ''))
+    parser.add_argument('--database', default=os.environ.get('CLICKHOUSE_DATABASE', 'default'))
+    parser.add_argument('--workers', type=int, default=4, help="Files loaded concurrently")
+    parser.add_argument('--batch-size', type=int, default=100000, help="Rows per insert")
+    parser.add_argument('--retries', type=int, default=3, help="Retries per failed insert")
+    parser.add_argument('--retry-backoff', type=float, default=1.0, help="Initial retry delay in seconds")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='  %(message)s')
+    files = find_csv_files(args.paths)
+    if not files:
+        print("No CSV files found")
+        return 1
+
+    client = get_client(args)
+
+    # Each file is loaded into the table named after it, e.g. sales_transactions.csv -> sales_transactions
+    tables = {csv_file: os.path.splitext(os.path.basename(csv_file))[0] for csv_file in files}
+
+    print(f"Importing {len(files)} files with {args.workers} workers")
+    start = time.perf_counter()
+    results = []
+    failures = 0
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(
+                import_csv_to_clickhouse, client, table, csv_file,
+                args.batch_size, args.retries, args.retry_backoff
+            ): table
+            for csv_file, table in tables.items()
+        }
+        for future in as_completed(futures):
+            table = futures[future]
+            try:
+                stats = future.result()
+                results.append(stats)
+                print(f"Successfully imported {stats['rows']} records into {table}")
+            except Exception as e:
+                failures += 1
+                print(f"Error importing {table}: {str(e)}")
+
+    elapsed = time.perf_counter() - start
+
+    print()
+    for stats in sorted(results, key=lambda s: s['table']):
+        print(format_stats(stats['table'], stats['rows'], stats['bytes'], stats['seconds']))
+    print(format_stats(
+        f"TOTAL ({len(results)} files, {failures} failed)",
+        sum(s['rows'] for s in results),
+        sum(s['bytes'] for s in results),
+        elapsed
+    ))
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
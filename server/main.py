@@ -1,17 +1,488 @@
-
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Body
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Body, Query, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
-from typing import List, Dict, Any, Optional
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from typing import List, Dict, Any, Optional, Union
 import clickhouse_connect
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
 import io
+import array
 import csv
+import gzip
+import zlib
+import zstandard
+import os
+import queue
+import threading
+import time
+import hashlib
+import json
+import random
+import re
+import secrets
+import tempfile
+import shutil
+import uuid
+import asyncio
+import contextlib
+import contextvars
+import datetime
+import decimal
+import functools
+import itertools
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
 import jwt
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 app = FastAPI(title="ClickHouse Connector Flow API")
 
+# Rows per block requested from ClickHouse when streaming exports
+EXPORT_BLOCK_SIZE = int(os.environ.get("EXPORT_BLOCK_SIZE", "65536"))
+
+# Schema inference sample: leading rows, plus this many randomly placed blocks
+# of the given size (and the file's tail) for uncompressed uploads
+SCHEMA_SAMPLE_ROWS = int(os.environ.get("SCHEMA_SAMPLE_ROWS", "10000"))
+SCHEMA_SAMPLE_BLOCKS = int(os.environ.get("SCHEMA_SAMPLE_BLOCKS", "32"))
+SCHEMA_SAMPLE_BLOCK_BYTES = int(os.environ.get("SCHEMA_SAMPLE_BLOCK_BYTES", str(256 * 1024)))
+
+# Integer columns get a type that holds the sampled range scaled by this
+# factor, since the sample may not contain the extremes of the file
+INTEGER_RANGE_HEADROOM = float(os.environ.get("INTEGER_RANGE_HEADROOM", "2"))
+
+# Floating-point columns whose sampled values have at most 6 significant digits
+# are inferred as Float32 only when this is set, since Float32 rounds values
+# such as 1234.56 and anything outside the sample may need more digits
+INFER_FLOAT32 = os.environ.get("INFER_FLOAT32", "").lower() in ("1", "true", "yes")
+
+# String columns become LowCardinality(String) when the sample has at most
+# this many distinct values and they make up at most this share of the rows
+LOW_CARDINALITY_MAX_DISTINCT = int(os.environ.get("LOW_CARDINALITY_MAX_DISTINCT", "1000"))
+LOW_CARDINALITY_MAX_RATIO = float(os.environ.get("LOW_CARDINALITY_MAX_RATIO", "0.1"))
+
+# Rows parsed and inserted per batch when importing, and how many parsed
+# batches may wait for insertion at once
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "100000"))
+IMPORT_MAX_IN_FLIGHT = int(os.environ.get("IMPORT_MAX_IN_FLIGHT", "2"))
+
+# Client pool sizing: maximum cached clients, seconds before an idle client is
+# dropped, and seconds between health checks of a cached client
+POOL_MAX_SIZE = int(os.environ.get("POOL_MAX_SIZE", "32"))
+POOL_IDLE_TIMEOUT = float(os.environ.get("POOL_IDLE_TIMEOUT", "300"))
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+# Schema cache: seconds before a cached schema is revalidated against
+# system.tables, and the maximum number of cached entries
+SCHEMA_CACHE_TTL = float(os.environ.get("SCHEMA_CACHE_TTL", "60"))
+SCHEMA_CACHE_MAX_ENTRIES = int(os.environ.get("SCHEMA_CACHE_MAX_ENTRIES", "1024"))
+
+# Preview result cache: memory budget in bytes and seconds an entry is served
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get("PREVIEW_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PREVIEW_CACHE_TTL = float(os.environ.get("PREVIEW_CACHE_TTL", "30"))
+
+# Seconds a session token stays valid after its last use
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+
+# Directory export jobs write their files to, how long finished jobs and
+# their files are kept, and the read size used when serving downloads
+EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "clickhouse-exports"))
+EXPORT_JOB_RETENTION = float(os.environ.get("EXPORT_JOB_RETENTION", "86400"))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Export snapshots: directory completed exports are kept in for identical
+# requests, on the same filesystem as EXPORT_DIR so they can be hard linked,
+# and the disk budget in bytes beyond which the least recently used are evicted
+EXPORT_SNAPSHOT_DIR = os.environ.get("EXPORT_SNAPSHOT_DIR", os.path.join(EXPORT_DIR, "snapshots"))
+EXPORT_SNAPSHOT_MAX_BYTES = int(os.environ.get("EXPORT_SNAPSHOT_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+
+# QueryConfig fields that do not change an export's rows or encoding, left
+# out of snapshot keys. Without an ORDER BY, row order is unspecified anyway
+SNAPSHOT_IGNORED_FIELDS = {
+    "max_execution_time", "max_memory_usage", "reorder_joins", "parallel_workers", "split_columns",
+    "sample_ratio", "prelimit_join", "join_algorithm", "snapshot"
+}
+
+# File the watermarks of incremental sync flows are kept in; set it to
+# persistent storage, since losing it makes every flow start from scratch
+SYNC_STATE_PATH = os.environ.get("SYNC_STATE_PATH", os.path.join(tempfile.gettempdir(), "clickhouse-sync-state.json"))
+
+# How long finished operations stay queryable, and how often progress events are sent
+OPERATION_RETENTION = float(os.environ.get("OPERATION_RETENTION", "3600"))
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "0.5"))
+
+# Client-chosen operation ids become query_id prefixes, so they are restricted
+OPERATION_ID_PATTERN = r"[A-Za-z0-9_]{1,64}"
+
+# Export formats: file extension and media type
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.stream"),
+    "native": (".native", "application/octet-stream"),
+    "rowbinary": (".rowbinary", "application/octet-stream"),
+}
+PARQUET_COMPRESSIONS = {"snappy", "zstd", "gzip", "lz4", "brotli", "none"}
+
+# CSV export quoting styles: the Arrow CSV writer style used for values and
+# the csv module style used for the header. nonnumeric quotes strings, all
+# quotes every value but nulls, and none fails on values that need quotes
+CSV_QUOTING = {
+    "nonnumeric": ("needed", csv.QUOTE_NONNUMERIC),
+    "all": ("all_valid", csv.QUOTE_ALL),
+    "none": ("none", csv.QUOTE_NONE),
+}
+
+# Read formats for CSV exports: dates and times arrive as integers and are
+# converted a column at a time, and UUIDs and IPs arrive as strings
+CSV_QUERY_FORMATS = {"Date*": "int", "UUID": "string", "IPv*": "string"}
+
+# File compression for exports and uploads: file extension and media type
+FILE_COMPRESSIONS = {
+    "gzip": (".gz", "application/gzip"),
+    "zstd": (".zst", "application/zstd"),
+}
+
+# Accepted upload extensions and the compression pandas decodes them with
+UPLOAD_EXTENSIONS = {".csv": None, ".csv.gz": "gzip", ".csv.zst": "zstd"}
+
+# Filter operators and the number of values each takes (None: a list of any length)
+FILTER_OPERATORS = {
+    "=": 1, "!=": 1, "<": 1, "<=": 1, ">": 1, ">=": 1, "like": 1, "not like": 1,
+    "between": 2, "in": None, "not in": None, "is null": 0, "is not null": 0,
+}
+
+# Table, column and index names written into SQL
+IDENTIFIER_PATTERN = r"[A-Za-z_][A-Za-z0-9_]*"
+
+# Column references allowed in filters and ORDER BY: column or table.column
+COLUMN_REFERENCE_PATTERN = rf"{IDENTIFIER_PATTERN}(\.{IDENTIFIER_PATTERN})?"
+
+# join_algorithm values a preview may request
+JOIN_ALGORITHMS = ("default", "auto", "hash", "parallel_hash", "partial_merge", "grace_hash", "full_sorting_merge", "direct")
+
+# Engines an import may create its table with
+TABLE_ENGINES = ("MergeTree", "ReplacingMergeTree")
+
+# Skip index types an import may declare
+SKIP_INDEX_TYPES = ("minmax", "set", "bloom_filter", "ngrambf_v1", "tokenbf_v1")
+
+# Functions a PARTITION BY or skip index expression may call; anything else
+# in them must be a column, number, operator or parenthesis
+LAYOUT_FUNCTIONS = (
+    "toYear", "toYYYYMM", "toYYYYMMDD", "toMonday", "toStartOfWeek", "toStartOfMonth", "toStartOfQuarter",
+    "toStartOfYear", "toDate", "toString", "intDiv", "modulo", "cityHash64", "sipHash64", "lower", "upper",
+    "lowerUTF8", "upperUTF8", "length", "tuple"
+)
+
+# Limits for layouts recommended from the upload sample
+RECOMMENDED_ORDER_BY_COLUMNS = 3
+RECOMMENDED_SKIP_INDEXES = 3
+
+# Upper bound on the range queries a single parallel export runs at once
+EXPORT_MAX_PARALLELISM = int(os.environ.get("EXPORT_MAX_PARALLELISM", "16"))
+
+# Worker threads per operation type. Each type has its own executor so a burst
+# of large imports or exports cannot starve metadata and preview requests.
+# Background export jobs hold a worker for their whole run, so they get their
+# own executor rather than the one serving downloads and export streams
+OPERATION_WORKERS = {
+    "metadata": int(os.environ.get("METADATA_WORKERS", "8")),
+    "preview": int(os.environ.get("PREVIEW_WORKERS", "8")),
+    "export": int(os.environ.get("EXPORT_WORKERS", "4")),
+    "export_jobs": int(os.environ.get("EXPORT_JOB_WORKERS", "2")),
+    "import": int(os.environ.get("IMPORT_WORKERS", "2")),
+    "insert": int(os.environ.get("INSERT_WORKERS", "2")),
+}
+
+# Import modes: direct inserts each upload's batches itself, buffer coalesces
+# uploads for the same table in the server before inserting, and async sends
+# them with ClickHouse's async_insert, which coalesces them server-side
+IMPORT_MODES = ("direct", "buffer", "async")
+
+# A buffered table's rows are flushed as one insert once they reach either
+# limit, or once the oldest of them has waited INSERT_BUFFER_MAX_DELAY seconds
+INSERT_BUFFER_MAX_ROWS = int(os.environ.get("INSERT_BUFFER_MAX_ROWS", "100000"))
+INSERT_BUFFER_MAX_BYTES = int(os.environ.get("INSERT_BUFFER_MAX_BYTES", str(64 * 1024 * 1024)))
+INSERT_BUFFER_MAX_DELAY = float(os.environ.get("INSERT_BUFFER_MAX_DELAY", "1.0"))
+
+# async_insert settings; waiting for the flush means an acknowledged upload is
+# written to a part, not just held in ClickHouse's memory
+ASYNC_INSERT_SETTINGS = {"async_insert": 1, "wait_for_async_insert": 1}
+
+# Upper bounds in seconds of the latency histogram buckets reported by /metrics
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Requests sending this header get their stage breakdown in a Server-Timing header
+TRACE_HEADER = "x-trace"
+
+# Pooled clients are shared between concurrent requests, which ClickHouse
+# rejects for clients bound to a server-side session
+clickhouse_connect.common.set_setting("autogenerate_session_id", False)
+
+# Blocking work executors
+executors = {
+    operation: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{operation}-worker")
+    for operation, workers in OPERATION_WORKERS.items()
+}
+
+async def run_blocking(operation: str, func, *args, **kwargs):
+    """Run a blocking call on the executor for an operation type without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # The context carries the request's trace, so stage timings reach it from the worker
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executors[operation], functools.partial(context.run, func, *args, **kwargs))
+
+async def iterate_blocking(operation: str, iterator):
+    """Consume a blocking iterator on the executor for an operation type, one item at a time."""
+    done = object()
+    try:
+        while True:
+            item = await run_blocking(operation, next, iterator, done)
+            if item is done:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await run_blocking(operation, close)
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    # Buffered uploads are waiting on their inserts, so finish them rather than drop them
+    insert_buffer.flush_all()
+    executors["insert"].shutdown(wait=True)
+    for executor in executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Metrics
+class RequestTrace:
+    """Stage timings of one request, shared with the worker threads it runs on."""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}  # stage -> seconds
+        self._lock = threading.Lock()
+    
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+    
+    def server_timing(self):
+        """Format the stages as a Server-Timing header value, with durations in milliseconds."""
+        with self._lock:
+            stages = list(self.stages.items())
+        stages.append(("total", time.perf_counter() - self.start))
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages)
+
+request_trace = contextvars.ContextVar("request_trace", default=None)
+
+class Metrics:
+    """Prometheus-style counters, gauges and histograms, rendered by /metrics.
+    
+    Stage timings are exclusive: time spent in a stage entered inside
+    another, such as a metadata lookup during an insert, only counts for
+    the inner stage. Stages running on different threads, such as parsing
+    ahead of inserts, overlap, so a request's stages can add up to more
+    than its latency.
+    """
+    
+    DEFINITIONS = {
+        "http_requests_total": ("counter", "HTTP requests by route and status"),
+        "http_request_duration_seconds": ("histogram", "HTTP request latency, including streamed response bodies"),
+        "http_requests_in_flight": ("gauge", "HTTP requests being served"),
+        "stage_duration_seconds": ("histogram", "Time spent in each processing stage"),
+        "operations_in_flight": ("gauge", "Running imports and exports"),
+        "rows_processed_total": ("counter", "Rows imported, exported or previewed"),
+        "bytes_processed_total": ("counter", "Upload bytes read by imports and bytes sent by exports"),
+        "clickhouse_queries_total": ("counter", "ClickHouse queries and inserts that returned a summary"),
+        "clickhouse_read_rows_total": ("counter", "Rows read by ClickHouse, from query summaries"),
+        "clickhouse_read_bytes_total": ("counter", "Bytes read by ClickHouse, from query summaries"),
+        "clickhouse_written_rows_total": ("counter", "Rows written by ClickHouse, from query summaries"),
+        "clickhouse_written_bytes_total": ("counter", "Bytes written by ClickHouse, from query summaries"),
+        "clickhouse_query_duration_seconds": ("histogram", "Server-side query time, from query summaries"),
+    }
+    
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._values = {}  # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter or gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+    
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge."""
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+    
+    def observe(self, name: str, value: float, **labels):
+        """Record a histogram observation."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time a block as a processing stage, for the histograms and the current request's trace."""
+        stack = self._local.__dict__.setdefault("stack", [])
+        now = time.perf_counter()
+        if stack:
+            # Pause the enclosing stage: [name, seconds so far, running since]
+            stack[-1][1] += now - stack[-1][2]
+        entry = [name, 0.0, now]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stack.pop()
+            if stack:
+                stack[-1][2] = now
+            self.record_stage(name, entry[1] + now - entry[2])
+    
+    def timed_iter(self, name: str, iterable):
+        """Yield from an iterable, timing each step as a stage but not the consumer's time between steps."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+    
+    def timed(self, name: str, func):
+        """Wrap a function so each call is timed as a stage."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    
+    def record_request_stage(self, name: str):
+        """Record the time since the current request started as a stage, e.g. receiving its upload."""
+        trace = request_trace.get()
+        if trace is not None:
+            self.record_stage(name, time.perf_counter() - trace.start)
+    
+    def record_stage(self, name: str, seconds: float):
+        self.observe("stage_duration_seconds", seconds, stage=name)
+        trace = request_trace.get()
+        if trace is not None:
+            trace.add(name, seconds)
+    
+    def observe_summary(self, summary: Optional[Dict[str, Any]]):
+        """Count the read and write statistics of a ClickHouse query summary."""
+        if not summary:
+            return
+        self.inc("clickhouse_queries_total")
+        for key in ("read_rows", "read_bytes", "written_rows", "written_bytes"):
+            if summary.get(key):
+                self.inc(f"clickhouse_{key}_total", int(summary[key]))
+        if summary.get("elapsed_ns"):
+            self.observe("clickhouse_query_duration_seconds", int(summary["elapsed_ns"]) / 1e9)
+    
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            values = {key: (value if not isinstance(value, list) else [list(value[0]), value[1], value[2]])
+                      for key, value in self._values.items()}
+        
+        lines = []
+        for name, (kind, description) in self.DEFINITIONS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                if kind != "histogram":
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                    continue
+                counts, total, count = value
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', str(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+    
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+            for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+metrics = Metrics()
+
+class MetricsMiddleware:
+    """Records request counts and latency by route, and returns a request's
+    stage breakdown in a Server-Timing header when it sends TRACE_HEADER.
+    
+    Streamed responses are timed until their last chunk, but their header
+    can only hold the stages completed before the response started.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        trace = RequestTrace()
+        token = request_trace.set(trace)
+        traced = any(name.decode("latin-1").lower() == TRACE_HEADER for name, _ in scope["headers"])
+        status = 500
+        
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if traced:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", trace.server_timing().encode("latin-1"))
+                    ]
+            await send(message)
+        
+        metrics.inc("http_requests_in_flight")
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            metrics.inc("http_requests_in_flight", -1)
+            route = self._route(scope)
+            metrics.inc("http_requests_total", method=scope["method"], route=route, status=str(status))
+            metrics.observe(
+                "http_request_duration_seconds", time.perf_counter() - trace.start,
+                method=scope["method"], route=route
+            )
+            request_trace.reset(token)
+    
+    def _route(self, scope):
+        # Routes are labelled by their path template, so path parameters do not multiply series
+        if self._routes is None:
+            self._routes = {route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -20,6 +491,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 class ColumnSchema(BaseModel):
     name: str
@@ -37,6 +509,7 @@ class ConnectionDetails(BaseModel):
     password: Optional[str] = None
     use_jwt: bool = False
     jwt_token: Optional[str] = None
+    compression: Optional[str] = None  # lz4, zstd, gzip, br or none; client default if unset
 
 class JoinKeyPair(BaseModel):
     first_table_key: str
@@ -46,11 +519,121 @@ class JoinConfig(BaseModel):
     second_table: str
     join_type: str  # INNER, LEFT, RIGHT, FULL
     join_keys: List[JoinKeyPair]
+    # Table that first_table_key belongs to, when a chain joins onto an
+    # earlier joined table rather than the query's table
+    first_table: Optional[str] = None
+    algorithm: Optional[str] = None  # hash, parallel_hash, partial_merge, grace_hash, full_sorting_merge, direct
+
+# A single join or an ordered chain of joins
+JoinChain = Optional[Union[JoinConfig, List[JoinConfig]]]
+
+def join_list(join_config: JoinChain):
+    """Return a join chain as a list."""
+    if join_config is None:
+        return []
+    return [join_config] if isinstance(join_config, JoinConfig) else list(join_config)
+
+class FilterPredicate(BaseModel):
+    column: str  # column or table.column
+    op: str  # =, !=, <, <=, >, >=, like, not like, between, in, not in, is null, is not null
+    value: Optional[Any] = None  # comparisons and like
+    values: Optional[List[Any]] = None  # in/not in lists, and [low, high] for between
 
-class QueryConfig(BaseModel):
+class OrderByColumn(BaseModel):
+    column: str
+    descending: bool = False
+
+class QueryLimits(BaseModel):
+    # Sent as ClickHouse settings with every query of the request
+    max_execution_time: Optional[int] = Field(None, ge=1)  # seconds
+    max_memory_usage: Optional[int] = Field(None, ge=1)  # bytes
+
+class RowSelection(BaseModel):
+    # Compiled into the query's WHERE, ORDER BY and LIMIT/OFFSET, with filter
+    # values sent as bound parameters typed by their columns
+    filters: Optional[List[FilterPredicate]] = None
+    order_by: Optional[List[OrderByColumn]] = None
+    limit: Optional[int] = Field(None, ge=0)
+    offset: Optional[int] = Field(None, ge=0)
+
+class SyncConfig(BaseModel):
+    # Incremental sync: a run moves only the rows whose watermark column is
+    # past the flow's stored watermark, which advances once the run completes
+    flow: str  # client-chosen name the watermark is stored under
+    watermark_column: str  # e.g. transaction_time; rows where it is NULL are never moved
+    id_column: Optional[str] = None  # imports: key rows are upserted by
+    # Exports: each run rereads this far behind the stored watermark, in the
+    # column's units (seconds for DateTime, days for Date), so rows committed
+    # late with an older watermark value are still moved. Rows in the overlap
+    # are exported again and must be deduplicated by id downstream
+    lookback: Optional[int] = Field(None, ge=1)
+
+class SyncState(BaseModel):
+    flow: str
+    direction: str  # import or export
+    connection: str  # host:port/database
+    table_name: str
+    watermark_column: str
+    watermark: Optional[str] = None  # largest value moved so far, as ClickHouse or pandas formats it
+    rows: int = 0  # rows moved by the last run
+    updated_at: Optional[float] = None
+
+class CSVOptions(BaseModel):
+    delimiter: str = Field(",", min_length=1, max_length=1)
+    quoting: str = "nonnumeric"  # one of CSV_QUOTING
+    null_representation: str = ""  # written unquoted for NULL values
+    header: bool = True
+
+class QueryConfig(RowSelection, QueryLimits):
     table_name: str
     columns: List[str]
-    join_config: Optional[JoinConfig] = None
+    join_config: JoinChain = None
+    # Further joins, applied in order after join_config
+    joins: Optional[List[JoinConfig]] = None
+    # Let exports of all-INNER join chains put the largest table on the probe
+    # side and join the rest smallest first, by system.tables row counts
+    reorder_joins: bool = True
+    # Parallel export: number of disjoint hash ranges read concurrently, and
+    # the source table columns hashed to assign rows to ranges (defaults to all)
+    parallel_workers: int = 1
+    split_columns: Optional[List[str]] = None
+    output_format: str = "csv"  # csv, parquet, arrow, native, rowbinary
+    parquet_compression: str = "snappy"  # snappy, zstd, gzip, lz4, brotli, none
+    csv_options: CSVOptions = Field(default_factory=CSVOptions)
+    compression: Optional[str] = None  # gzip or zstd; compresses the exported file
+    # Serve a stored export of the same query while its tables are unchanged,
+    # and keep this export for later requests
+    snapshot: bool = True
+    # Export only the rows added since the flow's last export; runs as a job
+    sync: Optional[SyncConfig] = None
+    # Preview strategies: SAMPLE ratio used when the table has a sampling key,
+    # whether LEFT joins read a limited left side and only the matching
+    # right-side rows, and a join_algorithm setting for the preview query
+    sample_ratio: Optional[float] = None
+    prelimit_join: bool = True
+    join_algorithm: Optional[str] = None
+    
+    def join_chain(self):
+        """Return every join of the query in order."""
+        return join_list(self.join_config) + (self.joins or [])
+
+class SkipIndex(BaseModel):
+    name: str
+    expression: str
+    type: str = "minmax"  # minmax, set(N), bloom_filter, ngrambf_v1(...), tokenbf_v1(...)
+    granularity: int = 4
+
+class TableLayout(BaseModel):
+    # Applied when an import creates its table; fields left unset are
+    # recommended from the upload sample when recommend is true
+    engine: str = "MergeTree"  # MergeTree or ReplacingMergeTree
+    version_column: Optional[str] = None  # ReplacingMergeTree only
+    order_by: Optional[List[str]] = None
+    partition_by: Optional[str] = None
+    codecs: Optional[Dict[str, str]] = None  # column -> codec list, e.g. "Delta, ZSTD(3)"
+    low_cardinality: Optional[List[str]] = None  # String columns stored as LowCardinality
+    skip_indexes: Optional[List[SkipIndex]] = None
+    recommend: bool = True
 
 class ProcessingResult(BaseModel):
     success: bool
@@ -58,202 +641,2168 @@ class ProcessingResult(BaseModel):
     message: str
     download_url: Optional[str] = None
     error: Optional[str] = None
+    job_id: Optional[str] = None
+    table_layout: Optional[TableLayout] = None
+    operation_id: Optional[str] = None
+
+class ExportJob(BaseModel):
+    job_id: str
+    table_name: str
+    output_format: str = "csv"
+    compression: Optional[str] = None
+    status: str  # pending, running, completed, failed, cancelled
+    rows_written: int = 0
+    bytes_written: int = 0
+    created_at: float
+    finished_at: Optional[float] = None
+    download_url: Optional[str] = None
+    snapshot: bool = False  # served from an export snapshot
+    error: Optional[str] = None
+
+class OperationStatus(BaseModel):
+    operation_id: str
+    kind: str  # export, export_stream, import
+    table_name: str
+    status: str  # running, completed, failed, cancelled
+    rows_processed: int = 0
+    bytes_processed: int = 0
+    # From system.processes while the operation's queries run
+    read_rows: int = 0
+    read_bytes: int = 0
+    total_rows_approx: int = 0
+    progress: Optional[float] = None  # read_rows / total_rows_approx
+    memory_usage: int = 0
+    elapsed: float = 0
+    created_at: float
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+# Connection pool
+def create_client(connection_details: ConnectionDetails):
+    """Create a new ClickHouse client from connection details."""
+    compress = connection_details.compression or True
+    if compress == "none":
+        compress = False
+        
+    if connection_details.use_jwt and connection_details.jwt_token:
+        # JWT authentication logic would go here
+        # This is a placeholder implementation
+        headers = {'Authorization': f'Bearer {connection_details.jwt_token}'}
+        return clickhouse_connect.get_client(
+            host=connection_details.host,
+            port=int(connection_details.port),
+            database=connection_details.database,
+            username=connection_details.username,
+            password=connection_details.password if connection_details.password else '',
+            compress=compress,
+            http_headers=headers
+        )
+    
+    # Standard authentication
+    return clickhouse_connect.get_client(
+        host=connection_details.host,
+        port=int(connection_details.port),
+        database=connection_details.database,
+        username=connection_details.username,
+        password=connection_details.password if connection_details.password else '',
+        compress=compress
+    )
+
+class ClientPool:
+    """Process-wide cache of ClickHouse clients keyed by connection identity.
+    
+    get_client checks a client out until it is released. Only clients no
+    request has checked out are evicted; one dropped from the pool while in
+    use, after a failed health check, is closed when its last user releases it.
+    """
+    
+    def __init__(self, max_size: int = POOL_MAX_SIZE, idle_timeout: float = POOL_IDLE_TIMEOUT,
+                 health_check_interval: float = POOL_HEALTH_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._entries = OrderedDict()  # key -> [client, last_used, last_checked]
+        self._leases = {}  # id(client) -> times checked out and not yet released
+        self._retired = {}  # id(client) -> client dropped from the pool while checked out
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.health_check_failures = 0
+    
+    @staticmethod
+    def connection_key(connection_details: ConnectionDetails):
+        """Identify a connection without keeping its credentials in the key."""
+        credentials = f"{connection_details.password or ''}\0{connection_details.use_jwt}\0{connection_details.jwt_token or ''}"
+        return (
+            connection_details.host,
+            connection_details.port,
+            connection_details.database,
+            connection_details.username,
+            hashlib.sha256(credentials.encode("utf-8")).hexdigest(),
+            connection_details.compression
+        )
+    
+    def get_client(self, connection_details: ConnectionDetails):
+        """Check out a cached client for the connection, creating one on a miss.
+        
+        Every client returned must be given back with release.
+        """
+        key = self.connection_key(connection_details)
+        now = time.monotonic()
+        
+        with self._lock:
+            evicted = self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry[1] = now
+                self._lease(entry[0])
+        self._close_all(evicted)
+        
+        if entry is not None:
+            if now - entry[2] < self.health_check_interval or self._is_healthy(entry[0]):
+                entry[2] = now
+                with self._lock:
+                    self.hits += 1
+                return entry[0]
+            
+            with self._lock:
+                self.health_check_failures += 1
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                    self._retired[id(entry[0])] = entry[0]
+            self.release(entry[0])
+            
+        # Create outside the lock so a slow server does not block other connections
+        client = create_client(connection_details)
+        
+        with self._lock:
+            self.misses += 1
+            replaced = self._entries.pop(key, None)
+            if replaced is not None:
+                # Another request created a client for the same key meanwhile
+                self._retired[id(replaced[0])] = replaced[0]
+            self._entries[key] = [client, now, now]
+            self._lease(client)
+            evicted = self._evict_over_size()
+            if replaced is not None and id(replaced[0]) not in self._leases:
+                evicted.append(self._retired.pop(id(replaced[0])))
+        self._close_all(evicted)
+                
+        return client
+    
+    def retain(self, client):
+        """Check out a checked-out client once more, for a user that outlives the request holding it."""
+        with self._lock:
+            self._lease(client)
+    
+    def release(self, client):
+        """Give back a client checked out with get_client or retain."""
+        with self._lock:
+            count = self._leases.get(id(client), 0) - 1
+            if count > 0:
+                self._leases[id(client)] = count
+                return
+            self._leases.pop(id(client), None)
+            retired = self._retired.pop(id(client), None)
+            evicted = self._evict_over_size()
+        if retired is not None:
+            evicted.append(retired)
+        self._close_all(evicted)
+    
+    def stats(self):
+        """Return pool counters."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "checked_out": len(self._leases),
+                "evictions": self.evictions,
+                "health_check_failures": self.health_check_failures
+            }
+    
+    def _lease(self, client):
+        self._leases[id(client)] = self._leases.get(id(client), 0) + 1
+    
+    def _evict_idle(self, now: float):
+        # Entries are kept in least-recently-used order; checked-out clients stay
+        evicted = []
+        for key, (client, last_used, _) in list(self._entries.items()):
+            if now - last_used < self.idle_timeout:
+                break
+            if id(client) not in self._leases:
+                del self._entries[key]
+                self.evictions += 1
+                evicted.append(client)
+        return evicted
+    
+    def _evict_over_size(self):
+        # The pool may exceed max_size while every client in it is checked out
+        evicted = []
+        for key, (client, _, _) in list(self._entries.items()):
+            if len(self._entries) <= self.max_size:
+                break
+            if id(client) not in self._leases:
+                del self._entries[key]
+                self.evictions += 1
+                evicted.append(client)
+        return evicted
+    
+    def _close_all(self, clients):
+        # Closing can block on the network, so it happens outside the lock
+        for client in clients:
+            self._close(client)
+    
+    @staticmethod
+    def _is_healthy(client):
+        try:
+            return client.ping()
+        except Exception:
+            return False
+    
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+class SessionStore:
+    """Maps opaque session tokens to connection details so clients need not resend credentials."""
+    
+    def __init__(self, ttl: float = SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}  # token -> [connection_details, last_used]
+        self._lock = threading.Lock()
+    
+    def create(self, connection_details: ConnectionDetails):
+        """Register connection details and return a new session token."""
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = [connection_details, time.monotonic()]
+        return token
+    
+    def get(self, token: str):
+        """Return the connection details for a token, or None if unknown or expired."""
+        now = time.monotonic()
+        with self._lock:
+            # Drop expired sessions
+            for expired in [t for t, (_, last_used) in self._sessions.items() if now - last_used >= self.ttl]:
+                del self._sessions[expired]
+                
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            session[1] = now
+            return session[0]
+    
+    def delete(self, token: str):
+        """Forget a session token."""
+        with self._lock:
+            return self._sessions.pop(token, None) is not None
+
+# Schema cache
+class SchemaCache:
+    """LRU cache of table metadata with TTL-based revalidation.
+    
+    Keys start with (host, port, database, user). Each entry stores the version it was
+    read at (from system.tables.metadata_modification_time); once the TTL
+    passes, the entry is kept only if the caller reports the same version.
+    """
+    
+    def __init__(self, ttl: float = SCHEMA_CACHE_TTL, max_entries: int = SCHEMA_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> [value, version, stored_at]
+        self._lock = threading.Lock()
+    
+    def get(self, key, current_version=None):
+        """Return the cached value for key, or None.
+        
+        current_version is called to revalidate an expired entry; without it
+        expired entries are treated as misses.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            
+        if time.monotonic() - entry[2] < self.ttl:
+            return entry[0]
+            
+        if current_version is not None and current_version() == entry[1]:
+            entry[2] = time.monotonic()
+            return entry[0]
+            
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        return None
+    
+    def put(self, key, value, version=None):
+        """Store a value read at the given version."""
+        with self._lock:
+            self._entries[key] = [value, version, time.monotonic()]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, host: str, port: str, database: str, table_name: Optional[str] = None):
+        """Drop a table's entry, and every table listing, for a database and every user of it."""
+        with self._lock:
+            for key in list(self._entries):
+                if key[:3] != (host, port, database):
+                    continue
+                # key[3] is the user, key[4] the kind of entry and key[5] its table
+                if key[4] == "tables" or table_name is None or key[5] == table_name:
+                    del self._entries[key]
+
+# Preview cache
+class ResultCache:
+    """LRU cache of query results bounded by an estimated size in bytes, with a per-entry TTL."""
+    
+    def __init__(self, max_bytes: int = PREVIEW_CACHE_MAX_BYTES, ttl: float = PREVIEW_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (rows, size, expires_at, tables)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Return cached rows for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key, rows, tables):
+        """Cache rows read from the given tables; results larger than the whole budget are skipped."""
+        size = len(json.dumps(rows, default=str))
+        if size > self.max_bytes:
+            return
+            
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (rows, size, time.monotonic() + self.ttl, frozenset(tables))
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def invalidate(self, connection_prefix, table_name: str):
+        """Drop entries that read from a table on a connection."""
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if k[0][:3] == connection_prefix and table_name in entry[3]]:
+                self._remove(key)
+    
+    def stats(self):
+        """Return cache counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+    
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._size -= size
+
+# Insert buffer
+class InsertBuffer:
+    """Coalesces small imports for the same table into larger inserts.
+    
+    Each table's pending rows are flushed as one insert, and so as one part,
+    once they reach max_rows or max_bytes or have waited max_delay seconds.
+    Every submitted batch gets a future that resolves once ClickHouse has
+    acknowledged the insert containing it, or fails with that insert's error.
+    """
+    
+    def __init__(self, max_rows: int = INSERT_BUFFER_MAX_ROWS, max_bytes: int = INSERT_BUFFER_MAX_BYTES,
+                 max_delay: float = INSERT_BUFFER_MAX_DELAY):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._pending = {}  # key -> pending insert
+        self._condition = threading.Condition()
+        self._flusher = None
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failed_flushes = 0
+    
+    def submit(self, key, client, table_name: str, column_types: Dict[str, str], df):
+        """Add a DataFrame to the pending insert for key and return its future."""
+        future = Future()
+        ready = None
+        with self._condition:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = {
+                    "table_name": table_name,
+                    "column_types": column_types,
+                    "frames": [],
+                    "futures": [],
+                    "rows": 0,
+                    "bytes": 0,
+                    "deadline": time.monotonic() + self.max_delay
+                }
+                self._pending[key] = pending
+            # The latest client is used, in case the pool has replaced an earlier one;
+            # the buffer holds it checked out until the insert is flushed
+            client_pool.retain(client)
+            replaced = pending.get("client")
+            pending["client"] = client
+            pending["frames"].append(df)
+            pending["futures"].append((future, len(df)))
+            pending["rows"] += len(df)
+            pending["bytes"] += int(df.memory_usage(deep=True).sum())
+            
+            if pending["rows"] >= self.max_rows or pending["bytes"] >= self.max_bytes:
+                ready = self._pending.pop(key)
+            else:
+                self._start_flusher()
+                self._condition.notify()
+                
+        if replaced is not None:
+            client_pool.release(replaced)
+        if ready:
+            executors["insert"].submit(self._flush, ready)
+        return future
+    
+    def flush_all(self):
+        """Insert every pending batch now, on the calling thread."""
+        with self._condition:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for entry in pending:
+            self._flush(entry)
+    
+    def stats(self):
+        """Return buffer counters."""
+        with self._condition:
+            return {
+                "pending_tables": len(self._pending),
+                "pending_rows": sum(entry["rows"] for entry in self._pending.values()),
+                "flushes": self.flushes,
+                "rows_flushed": self.rows_flushed,
+                "failed_flushes": self.failed_flushes
+            }
+    
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run, name="insert-buffer-flusher", daemon=True)
+            self._flusher.start()
+    
+    def _run(self):
+        """Flush pending inserts as their deadlines pass."""
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = [key for key, entry in self._pending.items() if entry["deadline"] <= now]
+                ready = [self._pending.pop(key) for key in due]
+                if not ready:
+                    deadlines = [entry["deadline"] for entry in self._pending.values()]
+                    self._condition.wait(timeout=min(deadlines) - now if deadlines else None)
+                    continue
+            for entry in ready:
+                executors["insert"].submit(self._flush, entry)
+    
+    def _flush(self, entry):
+        try:
+            df = pd.concat(entry["frames"], ignore_index=True)
+            context = entry["client"].create_insert_context(
+                entry["table_name"],
+                column_names=list(entry["column_types"]),
+                column_type_names=list(entry["column_types"].values())
+            )
+            with metrics.stage("insert"):
+                summary = entry["client"].insert_df(df=df, context=context)
+            metrics.observe_summary(summary.summary)
+        except Exception as e:
+            print(f"Error flushing buffered insert into {entry['table_name']}: {str(e)}")
+            with self._condition:
+                self.failed_flushes += 1
+            for future, _ in entry["futures"]:
+                future.set_exception(e)
+            return
+        finally:
+            client_pool.release(entry["client"])
+            
+        with self._condition:
+            self.flushes += 1
+            self.rows_flushed += entry["rows"]
+        for future, rows in entry["futures"]:
+            future.set_result(rows)
+
+client_pool = ClientPool()
+session_store = SessionStore()
+schema_cache = SchemaCache()
+preview_cache = ResultCache()
+insert_buffer = InsertBuffer()
+
+# Compression
+def compressing_writer(output, compression: Optional[str]):
+    """Wrap a binary file object so writes to it are compressed; returns output unchanged if no compression."""
+    if compression is None:
+        return output
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=output, mode="wb")
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().stream_writer(output, closefd=False)
+    raise Exception(f"Unsupported compression: {compression}")
+
+def compress_chunks(chunks, compression: str):
+    """Compress a stream of byte chunks incrementally."""
+    if compression == "gzip":
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        flush = compressor.flush
+    elif compression == "zstd":
+        compressor = zstandard.ZstdCompressor().compressobj()
+        flush = compressor.flush
+    else:
+        raise Exception(f"Unsupported compression: {compression}")
+        
+    try:
+        for chunk in chunks:
+            with metrics.stage("serialize"):
+                data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+def negotiate_encoding(accept_encoding: Optional[str]):
+    """Pick zstd or gzip from an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+        
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+        
+    for coding in ("zstd", "gzip"):
+        if coding in accepted:
+            return coding
+    return None
+
+# CSV serialization
+class CSVSerializer:
+    """Encodes column-oriented result blocks as CSV.
+    
+    Each column becomes an Arrow array in one conversion, with integer-encoded
+    dates and times interpreted by their ClickHouse type, and the rows are
+    formatted by Arrow's CSV writer. Blocks with NULLs and a null
+    representation are formatted with Arrow compute functions instead, since
+    the writer can only leave NULLs empty. Arrays, maps and tuples are written
+    as ClickHouse writes them, e.g. ['a','b'], so they can be read back. Times
+    are written in UTC.
+    """
+    
+    def __init__(self, options: Optional[CSVOptions] = None):
+        self.options = options or CSVOptions()
+        if self.options.quoting not in CSV_QUOTING:
+            raise Exception(f"Unsupported CSV quoting: {self.options.quoting}")
+        self.quoting, self.header_quoting = CSV_QUOTING[self.options.quoting]
+        self.write_options = pcsv.WriteOptions(
+            include_header=False, delimiter=self.options.delimiter, quoting_style=self.quoting
+        )
+    
+    def header(self, column_names: List[str]):
+        """Return the header line, with names quoted the way string values are."""
+        output = io.StringIO()
+        try:
+            csv.writer(
+                output, delimiter=self.options.delimiter, quoting=self.header_quoting, lineterminator="\n"
+            ).writerow(column_names)
+        except csv.Error as e:
+            raise Exception(f"Column names need quoting: {str(e)}")
+        return output.getvalue().encode("utf-8")
+    
+    def encode(self, columns, column_types):
+        """Return the CSV lines of a block given as one sequence per column."""
+        arrays = [self.column_array(column, ch_type) for column, ch_type in zip(columns, column_types)]
+        if not arrays or not len(arrays[0]):
+            return b""
+        if self.options.null_representation and any(array.null_count for array in arrays):
+            return self._encode_with_nulls(arrays)
+        
+        batch = pa.RecordBatch.from_arrays(arrays, names=[str(index) for index in range(len(arrays))])
+        sink = pa.BufferOutputStream()
+        pcsv.write_csv(batch, sink, self.write_options)
+        return sink.getvalue().to_pybytes()
+    
+    @classmethod
+    def column_array(cls, column, ch_type):
+        """Convert a column read with CSV_QUERY_FORMATS to an Arrow array the CSV writer can format."""
+        base_type = ch_type.base_type
+        if base_type in ("Array", "Map", "Tuple"):
+            return pa.array([cls.nested_text(value, ch_type) for value in column], pa.string())
+        if base_type in ("Date", "Date32", "DateTime", "DateTime64"):
+            if isinstance(column, array.array):
+                ticks = pa.array(np.asarray(column).astype(np.int64))
+            else:
+                ticks = pa.array(column, pa.int64())  # Nullable columns arrive as lists
+            if base_type in ("Date", "Date32"):
+                return ticks.cast(pa.int32()).cast(pa.date32())
+            
+            timezone = "UTC" if ch_type.tzinfo else None
+            if base_type == "DateTime":
+                return ticks.cast(pa.timestamp("s", timezone))
+            # DateTime64 ticks are scaled to the next unit Arrow has
+            for unit, scale in (("s", 0), ("ms", 3), ("us", 6), ("ns", 9)):
+                if ch_type.scale <= scale:
+                    return pc.multiply(ticks, 10 ** (scale - ch_type.scale)).cast(pa.timestamp(unit, timezone))
+        
+        try:
+            values = pa.array(np.asarray(column) if isinstance(column, array.array) else column)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            values = None
+        if values is None or pa.types.is_nested(values.type) or pa.types.is_null(values.type):
+            # Values Arrow has no type for are written as Python formats them
+            values = pa.array([None if value is None else str(value) for value in column], pa.string())
+        return values
+    
+    @classmethod
+    def nested_text(cls, value, ch_type):
+        """Format a value of or inside an array, map or tuple as ClickHouse writes it."""
+        if value is None:
+            return "NULL"
+        base_type = ch_type.base_type
+        if base_type == "Array":
+            return "[" + ",".join(cls.nested_text(item, ch_type.element_type) for item in value) + "]"
+        if base_type == "Tuple":
+            items = value.values() if isinstance(value, dict) else value
+            return "(" + ",".join(cls.nested_text(item, t) for item, t in zip(items, ch_type.element_types)) + ")"
+        if base_type == "Map":
+            return "{" + ",".join(
+                f"{cls.nested_text(key, ch_type.key_type)}:{cls.nested_text(item, ch_type.value_type)}"
+                for key, item in value.items()
+            ) + "}"
+        if base_type in ("Date", "Date32", "DateTime", "DateTime64"):
+            value = cls._time_text(value, ch_type)
+        elif isinstance(value, bool):
+            return "true" if value else "false"
+        elif isinstance(value, float):
+            return "nan" if value != value else {float("inf"): "inf", float("-inf"): "-inf"}.get(value, repr(value))
+        elif isinstance(value, (int, decimal.Decimal)):
+            return str(value)
+        elif isinstance(value, bytes):
+            value = value.decode("utf-8", "replace")
+        # Everything else is a quoted string with ClickHouse's escapes
+        text = str(value).replace("\\", "\\\\").replace("'", "\\'")
+        return "'" + text.replace("\n", "\\n").replace("\t", "\\t").replace("\r", "\\r") + "'"
+    
+    @staticmethod
+    def _time_text(value, ch_type):
+        # Dates and times in nested values arrive as ticks under CSV_QUERY_FORMATS
+        if isinstance(value, int):
+            if ch_type.base_type in ("Date", "Date32"):
+                return (datetime.date(1970, 1, 1) + datetime.timedelta(days=value)).isoformat()
+            scale = getattr(ch_type, "scale", 0)
+            seconds, ticks = divmod(value, 10 ** scale)
+            value = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)
+            text = value.strftime("%Y-%m-%d %H:%M:%S")
+            return f"{text}.{ticks:0{scale}d}" if scale else text
+        if isinstance(value, datetime.datetime):
+            if value.tzinfo:
+                value = value.astimezone(datetime.timezone.utc)
+            text = value.strftime("%Y-%m-%d %H:%M:%S")
+            scale = getattr(ch_type, "scale", 0)
+            return f"{text}.{value.microsecond:06d}"[:len(text) + 1 + scale] if scale else text
+        return value.isoformat()
+    
+    def _encode_with_nulls(self, arrays):
+        fields = []
+        for values in arrays:
+            is_text = pa.types.is_string(values.type) or pa.types.is_large_string(values.type)
+            text = values if is_text else pc.cast(values, pa.string())
+            if self.quoting == "all_valid" or (self.quoting == "needed" and is_text):
+                text = pc.binary_join_element_wise("\"", pc.replace_substring(text, "\"", "\"\""), "\"", "")
+            elif self.quoting == "none" and pc.any(pc.match_substring_regex(text, f"[\"\r\n{re.escape(self.options.delimiter)}]")).as_py():
+                raise Exception("CSV values need quoting, which quoting 'none' does not allow")
+            fields.append(pc.fill_null(text, self.options.null_representation))
+        
+        # Join the fields of each row, then end every row with a newline
+        lines = pc.binary_join_element_wise(*fields, self.options.delimiter)
+        lines = pc.binary_join_element_wise(lines, "", "\n")
+        _, offsets, data = lines.buffers()
+        offsets = np.frombuffer(offsets, np.int32, len(lines) + 1, lines.offset * 4)
+        return data[offsets[0]:offsets[-1]].to_pybytes()
 
 # ClickHouse service
+class ChunkSink(io.RawIOBase):
+    """Write-only file that buffers output until drained.
+    
+    tell() reports the total bytes ever written, which writers such as
+    Parquet rely on for offsets, while drain() releases the buffered bytes.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._position
+    
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+# Metadata versions used to revalidate cached schemas
+TABLE_VERSION_QUERY = (
+    "SELECT max(metadata_modification_time) FROM system.tables "
+    "WHERE database = {database:String} AND name = {table:String}"
+)
+DATABASE_VERSION_QUERY = (
+    "SELECT (count(), max(metadata_modification_time)) FROM system.tables "
+    "WHERE database = {database:String}"
+)
+
+# Data versions of tables: their metadata and active parts. Inserts, merges
+# and mutations all replace parts, and new parts get new names
+DATA_VERSION_QUERY = (
+    "SELECT t.name, t.engine, toString(t.metadata_modification_time), p.parts, toString(p.modified), p.checksum "
+    "FROM system.tables AS t LEFT JOIN ("
+    "SELECT table, count() AS parts, max(modification_time) AS modified, "
+    "groupBitXor(cityHash64(name, hash_of_all_files)) AS checksum FROM system.parts "
+    "WHERE active AND database = {database:String} AND has({tables:Array(String)}, table) GROUP BY table"
+    ") AS p ON p.table = t.name "
+    "WHERE t.database = {database:String} AND has({tables:Array(String)}, t.name)"
+)
+
 class ClickHouseService:
     def __init__(self, connection_details: ConnectionDetails):
         self.connection_details = connection_details
         self.client = None
+        # Every query gets a query_id; those of a tracked operation share its id as prefix
+        self.operation_id = None
+        self.cancelled = None
+        self.limits = {}
+        self._query_sequence = itertools.count(1)
     
     def connect(self):
-        """Connect to ClickHouse using the provided details."""
+        """Connect to ClickHouse using the provided details, reusing a pooled client when possible."""
         try:
-            if self.connection_details.use_jwt and self.connection_details.jwt_token:
-                # JWT authentication logic would go here
-                # This is a placeholder implementation
-                headers = {'Authorization': f'Bearer {self.connection_details.jwt_token}'}
-                self.client = clickhouse_connect.get_client(
-                    host=self.connection_details.host,
-                    port=int(self.connection_details.port),
-                    database=self.connection_details.database,
-                    username=self.connection_details.username,
-                    password=self.connection_details.password if self.connection_details.password else '',
-                    http_headers=headers
-                )
-            else:
-                # Standard authentication
-                self.client = clickhouse_connect.get_client(
-                    host=self.connection_details.host,
-                    port=int(self.connection_details.port),
-                    database=self.connection_details.database,
-                    username=self.connection_details.username,
-                    password=self.connection_details.password if self.connection_details.password else ''
-                )
+            with metrics.stage("connect"):
+                self.client = client_pool.get_client(self.connection_details)
             return True
         except Exception as e:
             print(f"Connection error: {str(e)}")
             return False
     
-    def list_tables(self):
-        """List all tables in the database."""
+    def close(self):
+        """Give the pooled client back; the service cannot query after this."""
+        if self.client:
+            client_pool.release(self.client)
+            self.client = None
+    
+    def set_limits(self, limits: QueryLimits):
+        """Send a request's execution time and memory limits with every query."""
+        self.limits = limits.model_dump(include=set(QueryLimits.model_fields), exclude_none=True)
+    
+    def _settings(self, settings: Optional[Dict[str, Any]] = None, tracked: bool = True):
+        """Return query settings with the request's limits and a new query_id.
+        
+        Untracked queries, such as progress checks and KILL QUERY, get an id
+        outside the operation's prefix so they never match the operation.
+        """
+        prefix = self.operation_id if self.operation_id and tracked else uuid.uuid4().hex
+        return {**self.limits, **(settings or {}), "query_id": f"{prefix}-{next(self._query_sequence)}"}
+    
+    def _query(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+               settings: Optional[Dict[str, Any]] = None, stage: str = "metadata"):
+        """Run a query timed as a stage, counting its summary statistics."""
+        with metrics.stage(stage):
+            result = self.client.query(query, parameters=parameters, settings=settings)
+        metrics.observe_summary(result.summary)
+        return result
+    
+    def check_cancelled(self):
+        """Raise if the operation this service runs has been cancelled."""
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise Exception("Operation cancelled")
+    
+    def query_progress(self):
+        """Return progress counters of the operation's running queries from system.processes."""
+        result = self._query(
+            "SELECT sum(read_rows), sum(read_bytes), sum(total_rows_approx), sum(memory_usage), max(elapsed), count() "
+            "FROM system.processes WHERE startsWith(query_id, {prefix:String})",
+            parameters={"prefix": f"{self.operation_id}-"},
+            settings=self._settings(tracked=False)
+        )
+        read_rows, read_bytes, total_rows_approx, memory_usage, elapsed, queries = result.result_rows[0]
+        return {
+            "read_rows": read_rows,
+            "read_bytes": read_bytes,
+            "total_rows_approx": total_rows_approx,
+            "memory_usage": memory_usage,
+            "elapsed": elapsed,
+            "queries": queries
+        }
+    
+    def kill_queries(self):
+        """Kill the operation's running queries."""
+        # operation_id matches OPERATION_ID_PATTERN, so it is safe to quote
+        self.client.command(
+            f"KILL QUERY WHERE startsWith(query_id, '{self.operation_id}-') ASYNC",
+            settings=self._settings(tracked=False)
+        )
+    
+    def list_tables(self, name_filter: Optional[str] = None, offset: int = 0, limit: Optional[int] = None):
+        """List tables in the database with their columns, using a single query."""
         if not self.client:
             raise Exception("Not connected to ClickHouse")
         
-        query = f"SHOW TABLES FROM {self.connection_details.database}"
-        result = self.client.query(query)
-        tables = []
+        cache_key = self._schema_key("tables", name_filter, offset, limit)
+        tables = schema_cache.get(cache_key, self._database_version)
+        if tables is not None:
+            return tables
+        
+        # Select the page of tables first so pagination counts tables, not columns
+        parameters = {"database": self.connection_details.database}
+        table_query = "SELECT name FROM system.tables WHERE database = {database:String}"
         
-        for row in result.named_results():
-            table_name = row['name']
-            columns = self.describe_table(table_name)
-            tables.append(TableSchema(name=table_name, columns=columns))
+        if name_filter:
+            table_query += " AND positionCaseInsensitive(name, {name_filter:String}) > 0"
+            parameters["name_filter"] = name_filter
             
+        if limit is not None or offset:
+            table_query += " ORDER BY name"
+            if limit is not None:
+                table_query += " LIMIT {limit:UInt64}"
+                parameters["limit"] = limit
+            table_query += " OFFSET {offset:UInt64}"
+            parameters["offset"] = offset
+            
+        # The database version rides along so caching costs no extra round-trip
+        query = (
+            f"SELECT table, name, type, ({DATABASE_VERSION_QUERY}) FROM system.columns "
+            f"WHERE database = {{database:String}} AND table IN ({table_query}) "
+            "ORDER BY table, position"
+        )
+        result = self._query(query, parameters, self._settings())
+        
+        # Rows arrive ordered by table, so each table's columns are contiguous
+        tables = []
+        version = None
+        for table_name, column_name, column_type, version in result.result_rows:
+            if not tables or tables[-1].name != table_name:
+                tables.append(TableSchema(name=table_name, columns=[]))
+            tables[-1].columns.append(ColumnSchema(name=column_name, type=column_type))
+            
+        schema_cache.put(cache_key, tables, version)
         return tables
     
     def describe_table(self, table_name: str):
         """Get column information for a specific table."""
         if not self.client:
             raise Exception("Not connected to ClickHouse")
+        
+        cache_key = self._schema_key("table", table_name)
+        columns = schema_cache.get(cache_key, lambda: self._table_version(table_name))
+        if columns is not None:
+            return columns
+            
+        query = (
+            f"SELECT name, type, ({TABLE_VERSION_QUERY}) FROM system.columns "
+            "WHERE database = {database:String} AND table = {table:String} "
+            "ORDER BY position"
+        )
+        result = self._query(
+            query,
+            parameters={"database": self.connection_details.database, "table": table_name},
+            settings=self._settings()
+        )
+        if not result.result_rows:
+            raise Exception(f"Table {table_name} does not exist")
+        
+        columns = []
+        for name, column_type, version in result.result_rows:
+            columns.append(ColumnSchema(name=name, type=column_type))
+            
+        schema_cache.put(cache_key, columns, version)
+        return columns
+    
+    def sampling_key(self, table_name: str):
+        """Return a table's sampling key expression, or an empty string if it has none."""
+        return self._table_key(table_name, "sampling_key")
+    
+    def sorting_key(self, table_name: str):
+        """Return a table's sorting key expression, or an empty string if it has none."""
+        return self._table_key(table_name, "sorting_key")
+    
+    def _table_key(self, table_name: str, key: str):
+        # key is a system.tables column, sampling_key or sorting_key
+        if not self.client:
+            raise Exception("Not connected to ClickHouse")
+            
+        cache_key = self._schema_key(key, table_name)
+        expression = schema_cache.get(cache_key, lambda: self._table_version(table_name))
+        if expression is not None:
+            return expression
+            
+        query = (
+            f"SELECT {key}, ({TABLE_VERSION_QUERY}) FROM system.tables "
+            "WHERE database = {database:String} AND name = {table:String}"
+        )
+        result = self._query(
+            query,
+            parameters={"database": self.connection_details.database, "table": table_name},
+            settings=self._settings()
+        )
+        if not result.result_rows:
+            raise Exception(f"Table {table_name} does not exist")
+            
+        expression, version = result.result_rows[0]
+        schema_cache.put(cache_key, expression, version)
+        return expression
+    
+    def table_exists(self, table_name: str):
+        """Check whether a table exists, using cached metadata when available."""
+        try:
+            self.describe_table(table_name)
+            return True
+        except Exception:
+            return False
+    
+    def _schema_key(self, *parts):
+        # Per user, since users with different grants see different tables
+        details = self.connection_details
+        return (details.host, details.port, details.database, details.username) + parts
+    
+    def _table_version(self, table_name: str):
+        result = self._query(
+            TABLE_VERSION_QUERY,
+            parameters={"database": self.connection_details.database, "table": table_name},
+            settings=self._settings()
+        )
+        return result.result_rows[0][0] if result.result_rows else None
+    
+    def _database_version(self):
+        result = self._query(
+            DATABASE_VERSION_QUERY,
+            parameters={"database": self.connection_details.database},
+            settings=self._settings()
+        )
+        return result.result_rows[0][0] if result.result_rows else None
+    
+    def execute_query(self, query: str):
+        """Execute a SQL query on ClickHouse."""
+        if not self.client:
+            raise Exception("Not connected to ClickHouse")
+            
+        return self._query(query, settings=self._settings(), stage="query")
+    
+    def build_select_query(self, table_name: str, columns: List[str], join_config: JoinChain = None,
+                           limit: Optional[int] = None, where: Optional[str] = None, sample: Optional[float] = None,
+                           order_by: Optional[str] = None, offset: Optional[int] = None):
+        """Build a SELECT statement for a table with optional joins."""
+        column_str = ", ".join(columns) if columns else "*"
+        query = f"SELECT {column_str} FROM {table_name}"
+        if sample is not None:
+            query += f" SAMPLE {sample}"
+        
+        for join in join_list(join_config):
+            # Build JOIN clause
+            first_table = join.first_table or table_name
+            join_clause = f"{join.join_type} JOIN {join.second_table} ON "
+            join_conditions = []
+            
+            for key_pair in join.join_keys:
+                join_conditions.append(
+                    f"{first_table}.{key_pair.first_table_key} = {join.second_table}.{key_pair.second_table_key}"
+                )
+                
+            join_clause += " AND ".join(join_conditions)
+            query += f" {join_clause}"
+            
+        if where:
+            query += f" WHERE {where}"
+            
+        if order_by:
+            query += f" ORDER BY {order_by}"
+            
+        if limit is not None:
+            query += f" LIMIT {limit}"
+            
+        if offset:
+            query += f" OFFSET {offset}"
+            
+        return query
+    
+    def compile_selection(self, table_name: str, join_config: JoinChain,
+                          selection: Optional[RowSelection]):
+        """Compile a row selection's filters and ORDER BY into SQL with bound parameters.
+        
+        Returns (conditions, order_by, parameters, tables), where conditions is a
+        list of WHERE predicates, order_by an ORDER BY list or None, and tables
+        the set of tables the filters read.
+        """
+        conditions = []
+        parameters = {}
+        tables = set()
+        if not selection:
+            return conditions, None, parameters, tables
+            
+        for index, predicate in enumerate(selection.filters or []):
+            column, table, column_type = self._resolve_column(table_name, join_config, predicate.column)
+            tables.add(table)
+            op = predicate.op.strip().lower()
+            if op not in FILTER_OPERATORS:
+                raise Exception(f"Unsupported filter operator: {predicate.op}")
+                
+            arity = FILTER_OPERATORS[op]
+            if arity == 0:
+                conditions.append(f"{column} {op.upper()}")
+                continue
+                
+            values = [predicate.value] if arity == 1 else predicate.values
+            if not values or (arity is not None and len(values) != arity) or any(v is None for v in values):
+                raise Exception(f"Filter on {predicate.column} with {op} needs {arity or 'one or more'} value(s)")
+                
+            # like compares text, so its pattern is always a String
+            value_type = "String" if op.endswith("like") else column_type
+            placeholders = []
+            for position, value in enumerate(values):
+                name = f"filter_{index}_{position}"
+                parameters[name] = value
+                placeholders.append(f"{{{name}:{value_type}}}")
+                
+            if op == "between":
+                conditions.append(f"{column} BETWEEN {placeholders[0]} AND {placeholders[1]}")
+            elif arity is None:
+                conditions.append(f"{column} {op.upper()} ({', '.join(placeholders)})")
+            else:
+                conditions.append(f"{column} {op.upper()} {placeholders[0]}")
+                
+        order_by = None
+        if selection.order_by:
+            order_by = ", ".join(
+                f"{self._resolve_column(table_name, join_config, item.column)[0]}{' DESC' if item.descending else ''}"
+                for item in selection.order_by
+            )
+        return conditions, order_by, parameters, tables
+    
+    def _resolve_column(self, table_name: str, join_config: JoinChain, reference: str):
+        """Validate a column reference and return (reference, table, parameter type)."""
+        if not re.fullmatch(COLUMN_REFERENCE_PATTERN, reference):
+            raise Exception(f"Invalid column reference: {reference}")
+            
+        tables = [table_name] + [join.second_table for join in join_list(join_config)]
+        if "." in reference:
+            table, column = reference.split(".")
+            if table not in tables:
+                raise Exception(f"Unknown table in column reference: {reference}")
+            candidates = [table]
+        else:
+            column = reference
+            candidates = tables
+            
+        for table in candidates:
+            for col in self.describe_table(table):
+                if col.name == column:
+                    # Parameters are bound as the column's plain type
+                    column_type = re.sub(r"^(LowCardinality|Nullable)\((.*)\)$", r"\2", col.type)
+                    column_type = re.sub(r"^(LowCardinality|Nullable)\((.*)\)$", r"\2", column_type)
+                    return reference, table, column_type
+        raise Exception(f"Unknown column: {reference}")
+    
+    def select_query(self, table_name: str, columns: List[str], join_config: JoinChain = None,
+                     selection: Optional[RowSelection] = None, where: Optional[str] = None):
+        """Build a SELECT for a table, joins and row selection; returns (query, parameters).
+        
+        where is an extra predicate ANDed with the selection's filters.
+        """
+        conditions, order_by, parameters, _ = self.compile_selection(table_name, join_config, selection)
+        if where:
+            conditions.append(where)
+        query = self.build_select_query(
+            table_name, columns, join_config,
+            limit=selection.limit if selection else None,
+            where=" AND ".join(f"({c})" for c in conditions) or None,
+            order_by=order_by,
+            offset=selection.offset if selection else None
+        )
+        return query, parameters
+    
+    def table_rows(self, table_names: List[str]):
+        """Return row counts from system.tables; tables without a count, such as views, are omitted."""
+        result = self._query(
+            "SELECT name, total_rows FROM system.tables "
+            "WHERE database = {database:String} AND has({tables:Array(String)}, name) AND total_rows IS NOT NULL",
+            parameters={"database": self.connection_details.database, "tables": table_names},
+            settings=self._settings()
+        )
+        return {name: rows for name, rows in result.result_rows}
+    
+    def data_version(self, table_names: List[str]):
+        """Return a version of the tables' data, or None if any of them cannot be versioned.
+        
+        Only MergeTree tables have parts to version; views, dictionaries and
+        other engines do not. A merge changes the version without changing
+        the data, which only costs a fresh export.
+        """
+        result = self._query(
+            DATA_VERSION_QUERY,
+            parameters={"database": self.connection_details.database, "tables": table_names},
+            settings=self._settings()
+        )
+        versions = {name: rest for name, *rest in result.result_rows}
+        if set(versions) != set(table_names) or any(not v[0].endswith("MergeTree") for v in versions.values()):
+            return None
+        return sorted([name, *version] for name, version in versions.items())
+    
+    def max_value(self, table_name: str, column: str, after: Optional[str] = None):
+        """Return the largest value of a table's column as text, or None if it has none.
+        
+        With after, only values greater than it count.
+        """
+        reference, _, column_type = self._resolve_column(table_name, None, column)
+        query = f"SELECT toString(max({reference})), count({reference}) FROM {table_name}"
+        parameters = {}
+        if after is not None:
+            query += f" WHERE {reference} > {{after:{column_type}}}"
+            parameters["after"] = after
+        result = self._query(query, parameters, self._settings())
+        value, count = result.result_rows[0]
+        return value if count else None
+    
+    def subtract_value(self, table_name: str, column: str, value: str, amount: int):
+        """Return value minus amount, computed as the column's type, as text."""
+        _, _, column_type = self._resolve_column(table_name, None, column)
+        result = self._query(
+            f"SELECT toString({{value:{column_type}}} - {{amount:UInt64}})",
+            {"value": value, "amount": amount},
+            self._settings()
+        )
+        return result.result_rows[0][0]
+    
+    def check_upsert_table(self, table_name: str, id_column: str):
+        """Raise unless inserts into a table upsert by id_column.
+        
+        That needs a ReplacingMergeTree sorted by id_column alone and not
+        partitioned by any other column, since rows are only replaced within
+        a partition and a row whose partition column changes would be kept twice.
+        """
+        result = self._query(
+            "SELECT engine, sorting_key, partition_key FROM system.tables "
+            "WHERE database = {database:String} AND name = {table:String}",
+            parameters={"database": self.connection_details.database, "table": table_name},
+            settings=self._settings()
+        )
+        engine, sorting_key, partition_key = result.result_rows[0] if result.result_rows else ("", "", "")
+        if not engine.endswith("ReplacingMergeTree") or sorting_key.replace(" ", "") != id_column:
+            raise Exception(f"Incremental imports need {table_name} to be a ReplacingMergeTree ordered by {id_column}")
+        
+        mutable = self.partition_columns(partition_key, [col.name for col in self.describe_table(table_name)]) - {id_column}
+        if mutable:
+            raise Exception(
+                f"Incremental imports need {table_name} to be partitioned by {id_column} or not at all, "
+                f"not by {', '.join(sorted(mutable))}"
+            )
+    
+    @staticmethod
+    def partition_columns(partition_by: Optional[str], column_names: List[str]):
+        """Return the columns a partition expression reads."""
+        identifiers = set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", partition_by or ""))
+        return identifiers & set(column_names)
+    
+    def plan_joins(self, table_name: str, join_config: JoinChain):
+        """Order an all-INNER join chain so the smallest tables are on the build side.
+        
+        ClickHouse builds the right-hand table of each join into memory and
+        streams the left through it, so the largest table becomes the FROM table
+        and the others are joined smallest first, each as soon as it connects to
+        the tables already joined. Returns (table_name, joins); chains with outer
+        joins, or whose join keys span several joined tables, are left as given.
+        """
+        joins = join_list(join_config)
+        if len(joins) == 0 or any(join.join_type.strip().upper() != "INNER" for join in joins):
+            return table_name, join_config
+            
+        # Each join is an edge between the table it joins onto and its second table
+        edges = [(join.first_table or table_name, join.second_table, join) for join in joins]
+        # In the order the request names them, so ties and unknown counts keep that order
+        tables = [table_name] + [join.second_table for join in joins]
+        if len(set(tables)) != len(joins) + 1:
+            return table_name, join_config  # A table joined twice, or a cycle
+        rows = self.table_rows(sorted(tables))
+        # Tables without a row count are assumed large, so they are never built
+        size = lambda table: rows.get(table, float("inf"))
+        
+        start = max(tables, key=size)
+        joined = {start}
+        planned = []
+        while edges:
+            candidates = [edge for edge in edges if (edge[0] in joined) != (edge[1] in joined)]
+            if not candidates:
+                return table_name, join_config
+            edge = min(candidates, key=lambda e: size(e[1] if e[0] in joined else e[0]))
+            edges.remove(edge)
+            first, second, join = edge
+            if second in joined:
+                # Build the other side: swap the join's tables and keys
+                first, second = second, first
+                join = join.model_copy(update={
+                    "second_table": second,
+                    "join_keys": [
+                        JoinKeyPair(first_table_key=pair.second_table_key, second_table_key=pair.first_table_key)
+                        for pair in join.join_keys
+                    ]
+                })
+            planned.append(join.model_copy(update={"first_table": first}))
+            joined.add(second)
+        return start, planned
+    
+    def plan_export(self, query_config: QueryConfig):
+        """Return the (table_name, joins) an export of a query config runs with."""
+        # Only with explicit columns, since reordering changes what SELECT * returns,
+        # and without split columns, which are named for the query's own table
+        if query_config.reorder_joins and query_config.columns and not query_config.split_columns:
+            return self.plan_joins(query_config.table_name, query_config.join_chain())
+        return query_config.table_name, query_config.join_chain()
+    
+    def join_settings(self, join_config: JoinChain, default_algorithm: Optional[str] = None):
+        """Return the join_algorithm setting for a chain's per-join algorithms, or None.
+        
+        ClickHouse takes one join_algorithm per query, as a list of algorithms in
+        preference order, and uses the first one each join supports. direct only
+        supports dictionary and key-value right-hand tables, so it goes first and
+        other joins fall through to the next algorithm; that lets e.g. a direct
+        dictionary lookup and a partial_merge join run in the same query. Of the
+        general-purpose algorithms, the first one listed is used for all other joins.
+        """
+        algorithms = [join.algorithm for join in join_list(join_config) if join.algorithm] + [default_algorithm]
+        algorithms = list(dict.fromkeys(a for a in algorithms if a))
+        algorithms.sort(key=lambda a: a != "direct")
+        unsupported = [a for a in algorithms if a not in JOIN_ALGORITHMS]
+        if unsupported:
+            raise Exception(f"Unsupported join algorithm: {', '.join(unsupported)}")
+        if not algorithms or not join_list(join_config):
+            return None
+        return {"join_algorithm": ",".join(algorithms)}
+    
+    def build_preview_query(self, table_name: str, columns: List[str], join_config: JoinChain = None,
+                            limit: int = 100, sample_ratio: Optional[float] = None, prelimit_join: bool = True,
+                            selection: Optional[RowSelection] = None):
+        """Build a preview SELECT that avoids reading or joining whole tables where it can.
+        
+        A SAMPLE clause is added for tables with a sampling key. LEFT joins onto
+        the query's table read a limited left side, and only the right-side rows
+        whose keys occur in it, so the join's hash tables stay small however
+        large the right-hand tables are. INNER joins are not limited, since
+        dropping left rows without a match could leave the preview short. That
+        needs the selection's filters to read only the left table, no ORDER BY
+        or OFFSET, and a sorting key on the left table. Returns (query, parameters).
+        """
+        sample = None
+        if sample_ratio is not None:
+            if not 0 < sample_ratio <= 1:
+                raise Exception("sample_ratio must be in (0, 1]")
+            # Tables without a sampling key are previewed unsampled
+            if self.sampling_key(table_name):
+                sample = sample_ratio
+                
+        conditions, order_by, parameters, filter_tables = self.compile_selection(table_name, join_config, selection)
+        where = " AND ".join(f"({c})" for c in conditions) or None
+        offset = selection.offset if selection else None
+        if selection and selection.limit is not None:
+            limit = min(limit, selection.limit)
+            
+        joins = join_list(join_config)
+        prelimit = (
+            joins and prelimit_join and not order_by and not offset and filter_tables <= {table_name}
+            and all(join.join_type.strip().upper() == "LEFT" for join in joins)
+            and all(join.first_table in (None, table_name) for join in joins)
+        )
+        sorting_key = self.sorting_key(table_name) if prelimit else ""
+        if not sorting_key:
+            query = self.build_select_query(
+                table_name, columns, join_config, limit, where=where, sample=sample, order_by=order_by, offset=offset
+            )
+            return query, parameters
+            
+        # Every LEFT join keeps each left row, so limit left rows give at least
+        # limit preview rows. ClickHouse reads the CTE once per reference, so its
+        # rows are ordered by the sorting key, ties broken by the whole row, for
+        # the FROM table and the right sides' key filters to see the same rows
+        left = self.build_select_query(
+            table_name, [], limit=limit, where=where, sample=sample, order_by=f"{sorting_key}, cityHash64(*)"
+        )
+        query = f"WITH preview_left AS ({left}) SELECT {', '.join(columns) if columns else '*'} FROM preview_left AS {table_name}"
+        for join in joins:
+            left_keys = ", ".join(pair.first_table_key for pair in join.join_keys)
+            right_keys = ", ".join(pair.second_table_key for pair in join.join_keys)
+            right = (
+                f"(SELECT * FROM {join.second_table} "
+                f"WHERE ({right_keys}) IN (SELECT {left_keys} FROM preview_left))"
+            )
+            conditions = " AND ".join(
+                f"{table_name}.{pair.first_table_key} = {join.second_table}.{pair.second_table_key}"
+                for pair in join.join_keys
+            )
+            query += f" {join.join_type.strip().upper()} JOIN {right} AS {join.second_table} ON {conditions}"
+        query += f" LIMIT {limit}"
+        return query, parameters
+    
+    def preview_data(self, table_name: str, columns: List[str], join_config: JoinChain = None, limit: int = 100,
+                     sample_ratio: Optional[float] = None, prelimit_join: bool = True,
+                     join_algorithm: Optional[str] = None, selection: Optional[RowSelection] = None):
+        """Preview data from a table with optional joins."""
+        if not self.client:
+            raise Exception("Not connected to ClickHouse")
+        settings = self.join_settings(join_config, join_algorithm)
+        query, parameters = self.build_preview_query(
+            table_name, columns, join_config, limit, sample_ratio, prelimit_join, selection
+        )
+        result = self._query(query, parameters, self._settings(settings), stage="query")
+        rows = list(result.named_results())
+        
+        tables = [table_name] + [join.second_table for join in join_list(join_config)]
+        preview_cache.put(
+            self._preview_key(table_name, columns, join_config, limit, sample_ratio, prelimit_join, join_algorithm, selection),
+            rows, tables
+        )
+        return rows
+    
+    def cached_preview(self, table_name: str, columns: List[str], join_config: JoinChain = None, limit: int = 100,
+                       sample_ratio: Optional[float] = None, prelimit_join: bool = True,
+                       join_algorithm: Optional[str] = None, selection: Optional[RowSelection] = None):
+        """Return a cached preview without contacting ClickHouse, or None."""
+        return preview_cache.get(
+            self._preview_key(table_name, columns, join_config, limit, sample_ratio, prelimit_join, join_algorithm, selection)
+        )
+    
+    def _preview_key(self, table_name: str, columns: List[str], join_config: JoinChain, limit: int,
+                     sample_ratio, prelimit_join, join_algorithm, selection: Optional[RowSelection]):
+        join_key = tuple(
+            (
+                join.join_type.upper(),
+                join.second_table,
+                tuple((pair.first_table_key, pair.second_table_key) for pair in join.join_keys),
+                join.first_table,
+                join.algorithm
+            )
+            for join in join_list(join_config)
+        )
+        selection_key = selection.model_dump_json(include=set(RowSelection.model_fields)) if selection else None
+        return (
+            ClientPool.connection_key(self.connection_details), table_name, tuple(columns), join_key, limit,
+            sample_ratio, prelimit_join, join_algorithm, selection_key
+        )
+    
+    def export_to_csv(self, table_name: str, columns: List[str], join_config: JoinChain = None,
+                      output=None, progress=None, parallel_workers: int = 1, split_columns: Optional[List[str]] = None,
+                      selection: Optional[RowSelection] = None, csv_options: Optional[CSVOptions] = None):
+        """Export data from ClickHouse to CSV, writing encoded chunks to a binary file object.
+        
+        progress, if given, is called with (rows_written, bytes_written) after each chunk.
+        With parallel_workers > 1 the export is split into disjoint hash ranges
+        that are read concurrently and concatenated in range order.
+        """
+        if parallel_workers > 1:
+            return self._export_to_csv_parallel(
+                table_name, columns, join_config, output, progress,
+                min(parallel_workers, EXPORT_MAX_PARALLELISM), split_columns, selection, csv_options
+            )
+            
+        rows_written = 0
+        bytes_written = 0
+        
+        def count_rows(rows: int):
+            nonlocal rows_written
+            rows_written += rows
+        
+        chunks = self.export_csv_stream(
+            table_name, columns, join_config, on_rows=count_rows, selection=selection, csv_options=csv_options
+        )
+        for chunk in chunks:
+            output.write(chunk)
+            bytes_written += len(chunk)
+            if progress:
+                progress(rows_written, bytes_written)
+                
+        return rows_written
+    
+    def _export_to_csv_parallel(self, table_name: str, columns: List[str], join_config: JoinChain,
+                                output, progress, workers: int, split_columns: Optional[List[str]],
+                                selection: Optional[RowSelection] = None, csv_options: Optional[CSVOptions] = None):
+        # Rows are assigned to ranges by a hash of source table columns. The
+        # predicate is applied after any join, so each joined row, including
+        # unmatched rows of outer joins, falls in exactly one range.
+        if selection and (selection.order_by or selection.limit is not None or selection.offset):
+            raise Exception("Parallel export does not support order_by, limit or offset")
+        if not split_columns:
+            split_columns = [col.name for col in self.describe_table(table_name)]
+        split_expr = f"cityHash64({', '.join(f'{table_name}.{col}' for col in split_columns)}) % {workers}"
+        
+        serializer = CSVSerializer(csv_options)
+        lock = threading.Lock()
+        totals = {"rows": 0, "bytes": 0}
+        failed = threading.Event()  # set once any range fails, stopping the others
+        
+        def export_range(index: int, part):
+            query, parameters = self.select_query(table_name, columns, join_config, selection, where=f"{split_expr} = {index}")
+            with metrics.stage("query"):
+                stream = self.client.query_column_block_stream(
+                    query, parameters=parameters,
+                    settings=self._settings({"max_block_size": EXPORT_BLOCK_SIZE, **(self.join_settings(join_config) or {})}),
+                    query_formats=CSV_QUERY_FORMATS
+                )
+            
+            def count_rows(rows: int):
+                with lock:
+                    totals["rows"] += rows
+            
+            # Every range query returns the same columns; only the first keeps its header
+            for chunk in self._csv_chunks(stream, serializer, count_rows, header=index == 0):
+                self.check_cancelled()
+                if failed.is_set():
+                    raise Exception("Another range of the export failed")
+                part.write(chunk)
+                with lock:
+                    totals["bytes"] += len(chunk)
+                    if progress:
+                        progress(totals["rows"], totals["bytes"])
+        
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        parts = [tempfile.TemporaryFile(dir=EXPORT_DIR) for _ in range(workers)]
+        try:
+            # A dedicated pool: the calling job already holds an export worker. Each
+            # range runs in a copy of the caller's context, keeping its trace
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-range") as pool:
+                futures = [
+                    pool.submit(contextvars.copy_context().run, export_range, index, part)
+                    for index, part in enumerate(parts)
+                ]
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                errors = [future.exception() for future in done if future.exception()]
+                if errors:
+                    # Stop the other ranges, killing their queries like a cancelled export
+                    failed.set()
+                    if self.operation_id:
+                        try:
+                            self.kill_queries()
+                        except Exception as e:
+                            print(f"Error killing export range queries: {str(e)}")
+                    raise errors[0]
+                    
+            for part in parts:
+                part.seek(0)
+                shutil.copyfileobj(part, output, DOWNLOAD_CHUNK_SIZE)
+        finally:
+            for part in parts:
+                part.close()
+                
+        return totals["rows"]
+    
+    def export_to_file(self, table_name: str, columns: List[str], join_config: JoinChain = None,
+                       output=None, progress=None, output_format: str = "csv", parquet_compression: str = "snappy",
+                       parallel_workers: int = 1, split_columns: Optional[List[str]] = None,
+                       selection: Optional[RowSelection] = None, csv_options: Optional[CSVOptions] = None):
+        """Export data from ClickHouse in any supported format to a binary file object."""
+        if output_format == "csv":
+            return self.export_to_csv(
+                table_name, columns, join_config, output, progress,
+                parallel_workers=parallel_workers, split_columns=split_columns, selection=selection,
+                csv_options=csv_options
+            )
+        if parallel_workers > 1:
+            raise Exception("Parallel export is only supported for CSV")
+            
+        rows_written = 0
+        bytes_written = 0
+        
+        def count_rows(rows: int):
+            nonlocal rows_written
+            rows_written += rows
+        
+        chunks = self.export_stream(
+            table_name, columns, join_config, output_format, parquet_compression, on_rows=count_rows,
+            selection=selection
+        )
+        for chunk in chunks:
+            output.write(chunk)
+            bytes_written += len(chunk)
+            if progress:
+                progress(rows_written, bytes_written)
+                
+        return rows_written
+    
+    def export_stream(self, table_name: str, columns: List[str], join_config: JoinChain = None,
+                      output_format: str = "csv", parquet_compression: str = "snappy", on_rows=None,
+                      selection: Optional[RowSelection] = None, csv_options: Optional[CSVOptions] = None):
+        """Export data from ClickHouse as a stream of encoded chunks in the requested format.
+        
+        Parquet and Arrow are built from Arrow record batches fetched with
+        ClickHouse's ArrowStream format; Native and RowBinary pass ClickHouse's
+        own encoding through unchanged, so their rows are not counted.
+        """
+        if output_format not in EXPORT_FORMATS:
+            raise Exception(f"Unsupported output format: {output_format}")
+        if output_format == "csv":
+            return self.export_csv_stream(
+                table_name, columns, join_config, on_rows=on_rows, selection=selection, csv_options=csv_options
+            )
+        if not self.client:
+            raise Exception("Not connected to ClickHouse")
             
-        query = f"DESCRIBE TABLE {table_name}"
-        result = self.client.query(query)
+        query, parameters = self.select_query(table_name, columns, join_config, selection)
+        settings = self._settings({"max_block_size": EXPORT_BLOCK_SIZE, **(self.join_settings(join_config) or {})})
+        
+        if output_format in ("native", "rowbinary"):
+            fmt = "Native" if output_format == "native" else "RowBinaryWithNamesAndTypes"
+            with metrics.stage("query"):
+                raw = self.client.raw_stream(query, parameters=parameters, settings=settings, fmt=fmt)
+            return self._raw_chunks(raw)
+            
+        if output_format == "parquet" and parquet_compression not in PARQUET_COMPRESSIONS:
+            raise Exception(f"Unsupported Parquet compression: {parquet_compression}")
+            
+        with metrics.stage("query"):
+            stream = self.client.query_arrow_stream(query, parameters=parameters, settings=settings)
+        if output_format == "parquet":
+            return self._parquet_chunks(stream, parquet_compression, on_rows)
+        return self._arrow_chunks(stream, on_rows)
+    
+    @staticmethod
+    def _raw_chunks(raw):
+        """Read a raw ClickHouse response in fixed-size chunks."""
+        with raw:
+            while True:
+                with metrics.stage("query"):
+                    chunk = raw.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    
+    @staticmethod
+    def _parquet_chunks(stream, compression: str, on_rows=None):
+        """Encode Arrow record batches as Parquet, one row group per batch."""
+        with stream:
+            sink = ChunkSink()
+            with pq.ParquetWriter(sink, stream.gen.schema, compression=compression) as writer:
+                for batch in metrics.timed_iter("query", stream):
+                    with metrics.stage("serialize"):
+                        writer.write_batch(batch)
+                    if on_rows:
+                        on_rows(batch.num_rows)
+                    yield sink.drain()
+            yield sink.drain()
+    
+    @staticmethod
+    def _arrow_chunks(stream, on_rows=None):
+        """Encode Arrow record batches as an Arrow IPC stream."""
+        with stream:
+            sink = ChunkSink()
+            with pa.ipc.new_stream(sink, stream.gen.schema) as writer:
+                for batch in metrics.timed_iter("query", stream):
+                    with metrics.stage("serialize"):
+                        writer.write_batch(batch)
+                    if on_rows:
+                        on_rows(batch.num_rows)
+                    yield sink.drain()
+            yield sink.drain()
+    
+    def export_csv_stream(self, table_name: str, columns: List[str], join_config: JoinChain = None,
+                          on_rows=None, selection: Optional[RowSelection] = None,
+                          csv_options: Optional[CSVOptions] = None):
+        """Export data from ClickHouse as a stream of CSV chunks, one per result block."""
+        if not self.client:
+            raise Exception("Not connected to ClickHouse")
+            
+        serializer = CSVSerializer(csv_options)
+        query, parameters = self.select_query(table_name, columns, join_config, selection)
+        
+        # The query is sent here so errors surface before the response starts;
+        # blocks are only read from the socket as the generator is consumed
+        with metrics.stage("query"):
+            stream = self.client.query_column_block_stream(
+                query, parameters=parameters,
+                settings=self._settings({"max_block_size": EXPORT_BLOCK_SIZE, **(self.join_settings(join_config) or {})}),
+                query_formats=CSV_QUERY_FORMATS
+            )
+        return self._csv_chunks(stream, serializer, on_rows)
+    
+    @staticmethod
+    def _csv_chunks(stream, serializer: CSVSerializer, on_rows=None, header: bool = True):
+        """Encode a column block stream as CSV, yielding the header first and then one chunk per block.
+        
+        Column names and types come from the result, so SELECT * exports need no column list.
+        """
+        with stream:
+            column_types = stream.source.column_types
+            if header and serializer.options.header:
+                yield serializer.header(stream.source.column_names)
+                
+            for block in metrics.timed_iter("query", stream):
+                with metrics.stage("serialize"):
+                    chunk = serializer.encode(block, column_types)
+                if on_rows:
+                    on_rows(len(block[0]) if block else 0)
+                yield chunk
+    
+    @staticmethod
+    def layout_expression_columns(expression: str):
+        """Return the columns a PARTITION BY or skip index expression reads.
+        
+        Raises ValueError unless the expression only calls LAYOUT_FUNCTIONS on
+        columns and numbers, so it cannot carry other SQL into CREATE TABLE.
+        """
+        columns = set()
+        depth = 0
+        tokens = re.finditer(rf"\s*(?:({IDENTIFIER_PATTERN})\s*(\()?|(\d+(?:\.\d+)?)|([-+*/%,])|(\()|(\))|(\S))", expression)
+        for token in tokens:
+            name, call, _, _, opening, closing, other = token.groups()
+            if other:
+                raise ValueError(f"Unsupported character {other!r} in layout expression: {expression}")
+            if call and name not in LAYOUT_FUNCTIONS:
+                raise ValueError(f"Unsupported function {name} in layout expression: {expression}")
+            if name and not call:
+                columns.add(name)
+            depth += 1 if call or opening else -1 if closing else 0
+            if depth < 0:
+                raise ValueError(f"Unbalanced parentheses in layout expression: {expression}")
+        if depth:
+            raise ValueError(f"Unbalanced parentheses in layout expression: {expression}")
+        return columns
+    
+    @staticmethod
+    def check_layout(layout: TableLayout):
+        """Raise ValueError if a layout's names or expressions are not safe to write into CREATE TABLE."""
+        if layout.partition_by:
+            ClickHouseService.layout_expression_columns(layout.partition_by)
+        for index in layout.skip_indexes or []:
+            if not re.fullmatch(IDENTIFIER_PATTERN, index.name):
+                raise ValueError(f"Invalid skip index name: {index.name}")
+            if not re.fullmatch(rf"{IDENTIFIER_PATTERN}(\([0-9., ]*\))?", index.type):
+                raise ValueError(f"Invalid skip index type: {index.type}")
+            ClickHouseService.layout_expression_columns(index.expression)
+    
+    @staticmethod
+    def create_table_query(table_name: str, columns: List[ColumnSchema], layout: Optional[TableLayout] = None):
+        """Build the CREATE TABLE statement for an imported table with the given layout."""
+        layout = layout or TableLayout()
+        names = [col.name for col in columns]
+        invalid = [name for name in [table_name] + names if not re.fullmatch(IDENTIFIER_PATTERN, name)]
+        if invalid:
+            raise Exception(f"Invalid table or column name(s): {', '.join(invalid)}")
+        ClickHouseService.check_layout(layout)
+        
+        def check_columns(kind: str, referenced):
+            unknown = [name for name in referenced if name not in names]
+            if unknown:
+                raise Exception(f"Unknown {kind} column(s): {', '.join(unknown)}")
+                
+        if layout.engine not in TABLE_ENGINES:
+            raise Exception(f"Unsupported engine: {layout.engine}")
+        if layout.version_column:
+            if layout.engine != "ReplacingMergeTree":
+                raise Exception("version_column requires the ReplacingMergeTree engine")
+            check_columns("version", [layout.version_column])
+        check_columns("ORDER BY", layout.order_by or [])
+        check_columns("codec", list((layout.codecs or {}).keys()))
+        check_columns("LowCardinality", layout.low_cardinality or [])
+        if layout.partition_by:
+            check_columns("PARTITION BY", sorted(ClickHouseService.layout_expression_columns(layout.partition_by)))
+        for index in layout.skip_indexes or []:
+            check_columns("skip index", sorted(ClickHouseService.layout_expression_columns(index.expression)))
+        
+        column_defs = []
+        for col in columns:
+            col_type = col.type
+            if col.name in (layout.low_cardinality or []) and not col_type.startswith("LowCardinality"):
+                if col_type not in ("String", "Nullable(String)"):
+                    raise Exception(f"LowCardinality applies to String columns, not {col.name} {col_type}")
+                col_type = f"LowCardinality({col_type})"
+            column_def = f"{col.name} {col_type}"
+            codec = (layout.codecs or {}).get(col.name)
+            if codec:
+                if not re.fullmatch(r"[A-Za-z0-9_(), ]+", codec):
+                    raise Exception(f"Invalid codec for {col.name}: {codec}")
+                column_def += f" CODEC({codec})"
+            column_defs.append(column_def)
+            
+        for index in layout.skip_indexes or []:
+            if index.type.split("(")[0] not in SKIP_INDEX_TYPES:
+                raise Exception(f"Unsupported skip index type: {index.type}")
+            column_defs.append(f"INDEX {index.name} {index.expression} TYPE {index.type} GRANULARITY {index.granularity}")
+            
+        engine = f"{layout.engine}({layout.version_column or ''})"
+        query = f"CREATE TABLE {table_name} ({', '.join(column_defs)}) ENGINE = {engine}"
+        if layout.partition_by:
+            query += f" PARTITION BY {layout.partition_by}"
+        query += f" ORDER BY ({', '.join(layout.order_by)})" if layout.order_by else " ORDER BY tuple()"
+        return query
+    
+    def _prepare_import(self, table_name: str, csv_data, columns: List[ColumnSchema],
+                        compression: Optional[str] = None, table_layout: Optional[TableLayout] = None):
+        """Create the target table if needed and return its column types and the CSV read options."""
+        if not self.client:
+            raise Exception("Not connected to ClickHouse")
+            
+        # Create table if it doesn't exist
+        if not self.table_exists(table_name):
+            with metrics.stage("metadata"):
+                self.client.command(self.create_table_query(table_name, columns, table_layout), settings=self._settings())
+            schema_cache.invalidate(
+                self.connection_details.host,
+                self.connection_details.port,
+                self.connection_details.database,
+                table_name
+            )
+            
+        # Column types come from the cached schema, so building the insert
+        # context does not DESCRIBE the table again
+        table_types = {col.name: col.type for col in self.describe_table(table_name)}
+        
+        # Parse each column to suit its target type, e.g. dates into datetimes
+        csv_columns = list(pd.read_csv(csv_data, nrows=0, compression=compression).columns)
+        csv_data.seek(0)
+        read_options = CSVService.read_options(table_types, csv_columns)
+        
+        missing = [name for name in csv_columns if name not in table_types]
+        if missing:
+            raise Exception(f"Columns not found in table {table_name}: {', '.join(missing)}")
+        return {name: table_types[name] for name in csv_columns}, read_options
+    
+    def import_from_csv(self, table_name: str, csv_data, columns: List[ColumnSchema],
+                        batch_size: int = IMPORT_BATCH_SIZE, max_in_flight: int = IMPORT_MAX_IN_FLIGHT,
+                        compression: Optional[str] = None, table_layout: Optional[TableLayout] = None,
+                        settings: Optional[Dict[str, Any]] = None, progress=None, batch_filter=None):
+        """Import CSV data into ClickHouse in fixed-size batches, decompressing it on the fly if needed.
+        
+        A missing table is created with table_layout, or as an unsorted MergeTree without one.
+        settings are sent with every insert, e.g. ASYNC_INSERT_SETTINGS. progress, if
+        given, is called with (rows_inserted, upload_bytes_read) after each batch.
+        batch_filter, if given, is called with each parsed batch and returns the rows to insert.
+        """
+        column_types, read_options = self._prepare_import(table_name, csv_data, columns, compression, table_layout)
+        
+        # Parse and insert batch by batch
+        context = self.client.create_insert_context(
+            table_name,
+            column_names=list(column_types),
+            column_type_names=list(column_types.values()),
+            settings=settings
+        )
+        records_processed = 0
+        
+        for batch in CSVService.read_batches(csv_data, batch_size, max_in_flight, compression, read_options):
+            self.check_cancelled()
+            if batch_filter:
+                batch = batch_filter(batch)
+                if batch.empty:
+                    continue
+            context.settings = self._settings(settings)  # A query_id per insert
+            with metrics.stage("insert"):
+                summary = self.client.insert_df(df=batch, context=context)
+            metrics.observe_summary(summary.summary)
+            records_processed += len(batch)
+            if progress:
+                progress(records_processed, csv_data.tell())
+                
+        self._invalidate_preview(table_name)
+        return records_processed
+    
+    def buffer_csv(self, table_name: str, csv_data, columns: List[ColumnSchema],
+                   compression: Optional[str] = None, table_layout: Optional[TableLayout] = None, batch_filter=None):
+        """Parse CSV data and add it to the insert buffer for its table.
+        
+        Returns futures that resolve to each batch's row count once ClickHouse
+        has acknowledged the insert that contains it. batch_filter is as for
+        import_from_csv.
+        """
+        column_types, read_options = self._prepare_import(table_name, csv_data, columns, compression, table_layout)
+        key = (client_pool.connection_key(self.connection_details), table_name, tuple(column_types.items()))
+        
+        futures = []
+        for batch in CSVService.read_batches(csv_data, INSERT_BUFFER_MAX_ROWS, 1, compression, read_options):
+            self.check_cancelled()
+            if batch_filter:
+                batch = batch_filter(batch)
+                if batch.empty:
+                    continue
+            future = insert_buffer.submit(key, self.client, table_name, column_types, batch)
+            future.add_done_callback(lambda _: self._invalidate_preview(table_name))
+            futures.append(future)
+        return futures
+    
+    def _invalidate_preview(self, table_name: str):
+        preview_cache.invalidate(
+            (self.connection_details.host, self.connection_details.port, self.connection_details.database),
+            table_name
+        )
+
+# CSV service
+
+# Value patterns recognised by schema inference, matched against whole values
+INTEGER_PATTERN = r"[+-]?\d+"
+FLOAT_PATTERN = r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?"
+FIXED_POINT_PATTERN = r"[+-]?\d*\.\d+"
+
+# Decimal precisions at the top of each storage size, 4, 8 and 16 bytes
+DECIMAL_PRECISIONS = (9, 18, 38)
+DATE_PATTERN = r"\d{4}-\d{2}-\d{2}"
+DATETIME_PATTERN = r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d{1,9})?"
+UUID_PATTERN = r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+
+# Integer types from narrowest to widest, with their ranges
+UNSIGNED_TYPES = [("UInt8", 0, 2**8 - 1), ("UInt16", 0, 2**16 - 1), ("UInt32", 0, 2**32 - 1), ("UInt64", 0, 2**64 - 1)]
+SIGNED_TYPES = [
+    ("Int8", -2**7, 2**7 - 1), ("Int16", -2**15, 2**15 - 1),
+    ("Int32", -2**31, 2**31 - 1), ("Int64", -2**63, 2**63 - 1)
+]
+
+# ClickHouse Date covers 1970-01-01 to 2149-06-06; Date32 is wider
+DATE_MIN = pd.Timestamp("1970-01-01")
+DATE_MAX = pd.Timestamp("2149-06-06")
+
+# Read every field as a string with only empty fields treated as missing
+STRING_READ_OPTIONS = {"dtype": str, "keep_default_na": False, "na_values": [""]}
+
+class CSVService:
+    @staticmethod
+    def upload_compression(filename: str):
+        """Return (supported, compression) for an uploaded file name."""
+        for extension, compression in UPLOAD_EXTENSIONS.items():
+            if filename.lower().endswith(extension):
+                return True, compression
+        return False, None
+    
+    @staticmethod
+    def read_sample(file, sample_rows: int = SCHEMA_SAMPLE_ROWS, sample_blocks: int = SCHEMA_SAMPLE_BLOCKS,
+                    block_bytes: int = SCHEMA_SAMPLE_BLOCK_BYTES):
+        """Read a bounded sample of an uploaded CSV file as strings, without consuming it.
         
-        columns = []
-        for row in result.named_results():
-            columns.append(ColumnSchema(name=row['name'], type=row['type']))
+        The sample is the leading rows plus rows from randomly placed blocks and
+        the tail of the file, so values far from the head are represented. Blocks
+        are only taken from uncompressed files whose leading rows contain no
+        quoted line breaks, where every line starts a record.
+        """
+        _, compression = CSVService.upload_compression(file.filename)
+        head = pd.read_csv(file.file, nrows=sample_rows, compression=compression, **STRING_READ_OPTIONS)
+        file.file.seek(0)  # Reset file pointer
+        
+        if compression or sample_blocks <= 0 or len(head) < sample_rows:
+            return head
+        if head.apply(lambda col: col.str.contains("\n", regex=False).any()).any():
+            return head
             
-        return columns
+        size = file.file.seek(0, os.SEEK_END)
+        rng = random.Random(size)  # Deterministic for a given file size
+        offsets = sorted(rng.randrange(size) for _ in range(sample_blocks))
+        offsets.append(max(size - block_bytes, 0))
+        
+        samples = [head]
+        for offset in offsets:
+            file.file.seek(offset)
+            data = file.file.read(block_bytes)
+            # Drop the partial first and last lines of the block
+            start = data.find(b"\n") + 1
+            end = data.rfind(b"\n")
+            if start <= 0 or end <= start:
+                continue
+            try:
+                samples.append(pd.read_csv(
+                    io.BytesIO(data[start:end]), header=None, names=list(head.columns), **STRING_READ_OPTIONS
+                ))
+            except (ValueError, pd.errors.ParserError):
+                continue
+                
+        file.file.seek(0)  # Reset file pointer
+        return pd.concat(samples, ignore_index=True)
     
-    def execute_query(self, query: str):
-        """Execute a SQL query on ClickHouse."""
-        if not self.client:
-            raise Exception("Not connected to ClickHouse")
-            
-        return self.client.query(query)
+    @staticmethod
+    def infer_columns(df):
+        """Infer ClickHouse column types from a DataFrame of sampled string values."""
+        return [
+            ColumnSchema(name=col_name, type=CSVService.infer_column_type(df[col_name]))
+            for col_name in df.columns
+        ]
     
-    def preview_data(self, table_name: str, columns: List[str], join_config: Optional[JoinConfig] = None, limit: int = 100):
-        """Preview data from a table with optional joins."""
-        if not self.client:
-            raise Exception("Not connected to ClickHouse")
+    @staticmethod
+    def infer_column_type(values):
+        """Choose the narrowest ClickHouse type that holds every sampled value of a column.
+        
+        Values are strings, with missing values as NaN; any missing value makes the type Nullable.
+        Checks run as Arrow compute kernels over the distinct values only.
+        """
+        present = values.dropna()
+        nullable = len(present) < len(values)
+        
+        def wrap(ch_type: str):
+            return f"Nullable({ch_type})" if nullable else ch_type
+        
+        if present.empty:
+            return "Nullable(String)"
             
-        column_str = ", ".join(columns) if columns else "*"
+        distinct = pc.unique(pc.utf8_trim_whitespace(pa.array(present.to_numpy(), type=pa.string())))
         
-        if join_config:
-            # Build JOIN clause
-            join_clause = f"{join_config.join_type} JOIN {join_config.second_table} ON "
-            join_conditions = []
+        def all_match(pattern: str):
+            return pc.all(pc.match_substring_regex(distinct, f"^(?:{pattern})$")).as_py()
+        
+        if pc.all(pc.is_in(pc.utf8_lower(distinct), value_set=pa.array(["true", "false"]))).as_py():
+            return wrap("Bool")
             
-            for key_pair in join_config.join_keys:
-                join_conditions.append(
-                    f"{table_name}.{key_pair.first_table_key} = {join_config.second_table}.{key_pair.second_table_key}"
-                )
+        if all_match(INTEGER_PATTERN):
+            try:
+                numbers = pc.cast(distinct, pa.int64())
+            except pa.ArrowInvalid:
+                numbers = None  # Beyond Int64; only UInt64 can still hold it
+                if not pc.any(pc.starts_with(distinct, "-")).as_py():
+                    try:
+                        numbers = pc.cast(distinct, pa.uint64())
+                    except pa.ArrowInvalid:
+                        pass
+            if numbers is None:
+                return wrap("String")
+            bounds = pc.min_max(numbers).as_py()
+            low = int(bounds["min"] * INTEGER_RANGE_HEADROOM)
+            high = int(bounds["max"] * INTEGER_RANGE_HEADROOM)
+            candidates = UNSIGNED_TYPES if low >= 0 else SIGNED_TYPES
+            for ch_type, type_min, type_max in candidates:
+                if type_min <= low and high <= type_max:
+                    return wrap(ch_type)
+            # Headroom pushed the range past 64 bits; keep the widest type that fits the sample
+            return wrap(candidates[-1][0])
+            
+        if all_match(FIXED_POINT_PATTERN):
+            # Values written with the same number of decimals, such as prices,
+            # are kept exact, with a digit of headroom for larger values
+            integer_part, _, fraction = zip(*(value.lstrip("+-").partition(".") for value in distinct.to_pylist()))
+            scale = len(fraction[0])
+            needed = max(len(part.lstrip("0")) for part in integer_part) + 1 + scale
+            if all(len(part) == scale for part in fraction) and needed <= DECIMAL_PRECISIONS[-1]:
+                precision = next(p for p in DECIMAL_PRECISIONS if needed <= p)
+                return wrap(f"Decimal({precision}, {scale})")
                 
-            join_clause += " AND ".join(join_conditions)
-            query = f"SELECT {column_str} FROM {table_name} {join_clause} LIMIT {limit}"
-        else:
-            query = f"SELECT {column_str} FROM {table_name} LIMIT {limit}"
+        if all_match(FLOAT_PATTERN):
+            numbers = pc.cast(distinct, pa.float64())
+            if INFER_FLOAT32:
+                # Float32 keeps about 7 significant digits
+                mantissa = pc.replace_substring_regex(distinct, r"[eE][+-]?\d+$", "")
+                digits = pc.utf8_length(pc.utf8_ltrim(pc.replace_substring_regex(mantissa, r"\D", ""), "0"))
+                if pc.max(digits).as_py() <= 6 and pc.max(pc.abs(numbers)).as_py() < 3.4e38:
+                    return wrap("Float32")
+            return wrap("Float64")
             
-        result = self.client.query(query)
-        return result.named_results()
-    
-    def export_to_csv(self, table_name: str, columns: List[str], join_config: Optional[JoinConfig] = None):
-        """Export data from ClickHouse to CSV."""
-        if not self.client:
-            raise Exception("Not connected to ClickHouse")
+        if all_match(DATE_PATTERN):
+            try:
+                dates = pc.strptime(distinct, format="%Y-%m-%d", unit="s")
+            except pa.ArrowInvalid:
+                dates = None
+            if dates is not None:
+                bounds = pc.min_max(dates).as_py()
+                in_range = DATE_MIN <= bounds["min"] and bounds["max"] <= DATE_MAX
+                return wrap("Date" if in_range else "Date32")
+                
+        if all_match(DATETIME_PATTERN):
+            try:
+                pc.strptime(pc.utf8_slice_codeunits(distinct, 0, 19), format="%Y-%m-%d %H:%M:%S", unit="s")
+                parsed = True
+            except pa.ArrowInvalid:
+                try:
+                    pc.strptime(pc.utf8_slice_codeunits(distinct, 0, 19), format="%Y-%m-%dT%H:%M:%S", unit="s")
+                    parsed = True
+                except pa.ArrowInvalid:
+                    parsed = False
+            if parsed:
+                # Fractional digits beyond the 19-character seconds part
+                precision = max(pc.max(pc.utf8_length(distinct)).as_py() - 20, 0)
+                return wrap("DateTime" if precision == 0 else f"DateTime64({precision})")
+                
+        if all_match(UUID_PATTERN):
+            return wrap("UUID")
             
-        column_str = ", ".join(columns) if columns else "*"
+        if len(distinct) <= LOW_CARDINALITY_MAX_DISTINCT and len(distinct) <= len(present) * LOW_CARDINALITY_MAX_RATIO:
+            return f"LowCardinality({wrap('String')})"
+        return wrap("String")
+    
+    @staticmethod
+    def read_options(table_types: Dict[str, str], csv_columns: List[str]):
+        """pandas read_csv options that parse a file's columns to suit the target column types."""
+        dtype = {}
+        parse_dates = []
+        for name in csv_columns:
+            base_type = re.sub(r"^(LowCardinality|Nullable)\((.*)\)$", r"\2", table_types.get(name, ""))
+            base_type = re.sub(r"^(LowCardinality|Nullable)\((.*)\)$", r"\2", base_type)
+            if base_type.startswith(("String", "FixedString", "UUID", "Decimal")):
+                # Keep values such as leading-zero codes as written, and
+                # decimals exact rather than parsed as floats
+                dtype[name] = str
+            elif base_type.startswith(("Date", "DateTime")):
+                parse_dates.append(name)
+        return {"dtype": dtype, "parse_dates": parse_dates}
+    
+    @staticmethod
+    def recommend_layout(sample, columns: List[ColumnSchema], layout: Optional[TableLayout] = None):
+        """Fill the unset fields of a table layout from the sampled column values.
         
-        if join_config:
-            # Build JOIN clause
-            join_clause = f"{join_config.join_type} JOIN {join_config.second_table} ON "
-            join_conditions = []
-            
-            for key_pair in join_config.join_keys:
-                join_conditions.append(
-                    f"{table_name}.{key_pair.first_table_key} = {join_config.second_table}.{key_pair.second_table_key}"
-                )
-                
-            join_clause += " AND ".join(join_conditions)
-            query = f"SELECT {column_str} FROM {table_name} {join_clause}"
-        else:
-            query = f"SELECT {column_str} FROM {table_name}"
+        The sort key puts the lowest-cardinality columns first and then a time
+        column, tables with a date or time column are partitioned by month,
+        time and monotonic integer columns get delta codecs, and high-cardinality
+        identifier columns outside the sort key get bloom filter skip indexes.
+        Nullable columns are never used in keys.
+        """
+        layout = layout.model_copy(deep=True) if layout else TableLayout()
+        if not layout.recommend:
+            return layout
             
-        result = self.client.query(query)
-        data = result.named_results()
+        def base_type(col_type: str):
+            return re.sub(r"^LowCardinality\((.*)\)$", r"\1", col_type)
         
-        # Convert to CSV
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=columns)
-        writer.writeheader()
-        writer.writerows(data)
+        present = {col.name: sample[col.name].dropna() for col in columns}
+        distinct = {name: values.nunique() for name, values in present.items()}
+        keyable = [col for col in columns if "Nullable" not in col.type]
+        time_columns = [col for col in keyable if base_type(col.type).startswith(("DateTime", "Date"))]
+        # Prefer DateTime over Date for sorting within a partition
+        time_columns.sort(key=lambda col: not col.type.startswith("DateTime"))
         
-        return output.getvalue(), len(data)
-    
-    def import_from_csv(self, table_name: str, csv_data, columns: List[ColumnSchema]):
-        """Import CSV data into ClickHouse."""
-        if not self.client:
-            raise Exception("Not connected to ClickHouse")
+        if layout.order_by is None:
+            low_cardinality = [
+                col.name for col in keyable
+                if col.type.startswith("LowCardinality") or col.type == "Bool"
+            ]
+            low_cardinality.sort(key=lambda name: distinct[name])
+            order_by = low_cardinality[:RECOMMENDED_ORDER_BY_COLUMNS - 1]
+            if time_columns:
+                order_by.append(time_columns[0].name)
+            layout.order_by = order_by
             
-        # Check if table exists
-        try:
-            self.describe_table(table_name)
-            table_exists = True
-        except:
-            table_exists = False
+        if layout.partition_by is None and time_columns:
+            column = time_columns[0].name
+            # Stay well under ClickHouse's limit of 100 partitions per insert block
+            months = present[column].str[:7].nunique()
+            layout.partition_by = f"toYYYYMM({column})" if months <= 100 else f"toYear({column})"
             
-        # Create table if it doesn't exist
-        if not table_exists:
-            column_defs = []
+        if layout.codecs is None:
+            codecs = {}
+            for col in keyable:
+                if col.type.startswith("DateTime"):
+                    codecs[col.name] = "DoubleDelta, ZSTD"
+                elif re.fullmatch(r"U?Int\d+", col.type):
+                    if pd.to_numeric(present[col.name]).is_monotonic_increasing:
+                        codecs[col.name] = "Delta, ZSTD"
+            layout.codecs = codecs
+            
+        if layout.skip_indexes is None:
+            skip_indexes = []
             for col in columns:
-                column_defs.append(f"{col.name} {col.type}")
-                
-            create_query = f"CREATE TABLE {table_name} ({', '.join(column_defs)}) ENGINE = MergeTree() ORDER BY tuple()"
-            self.client.command(create_query)
+                values = present[col.name]
+                high_cardinality = len(values) > 0 and distinct[col.name] >= 0.9 * len(values)
+                # Free text such as names and addresses is left unindexed
+                identifier = base_type(col.type) in ("UUID", "Nullable(UUID)") or (
+                    base_type(col.type) in ("String", "Nullable(String)")
+                    and not values.str.contains(r"\s", regex=True).any()
+                )
+                if identifier and high_cardinality and col.name not in layout.order_by:
+                    skip_indexes.append(SkipIndex(name=f"idx_{col.name}", expression=col.name, type="bloom_filter"))
+            layout.skip_indexes = skip_indexes[:RECOMMENDED_SKIP_INDEXES]
             
-        # Parse CSV data
-        df = pd.read_csv(csv_data)
-        
-        # Insert data into ClickHouse
-        records_processed = self.client.insert_df(table_name, df)
-        
-        return records_processed
-
-# CSV service
-class CSVService:
+        return layout
+    
     @staticmethod
     def parse_csv(file):
-        """Parse CSV file and return column types and sample data."""
-        content = file.file.read()
-        file.file.seek(0)  # Reset file pointer
-        
-        # Read CSV into pandas DataFrame
-        df = pd.read_csv(io.BytesIO(content))
-        
-        # Determine column types
-        columns = []
-        for col_name, dtype in df.dtypes.items():
-            ch_type = "String"  # Default type
-            
-            # Map pandas dtypes to ClickHouse types
-            if pd.api.types.is_integer_dtype(dtype):
-                ch_type = "Int32"
-            elif pd.api.types.is_float_dtype(dtype):
-                ch_type = "Float64"
-            elif pd.api.types.is_datetime64_dtype(dtype):
-                ch_type = "DateTime"
-            elif pd.api.types.is_bool_dtype(dtype):
-                ch_type = "UInt8"
-                
-            columns.append(ColumnSchema(name=col_name, type=ch_type))
+        """Parse CSV file and return column types, a recommended table layout and sample data."""
+        # Only a bounded sample is parsed; the full file is read once, at import time
+        sample = CSVService.read_sample(file)
+        columns = CSVService.infer_columns(sample)
+        table_layout = CSVService.recommend_layout(sample, columns)
             
         # Get sample data
-        sample_data = df.head(5).to_dict('records')
+        _, compression = CSVService.upload_compression(file.filename)
+        sample_data = pd.read_csv(file.file, nrows=5, compression=compression).to_dict('records')
+        file.file.seek(0)  # Reset file pointer
         
         return {
             "columns": columns,
+            "table_layout": table_layout,
             "sample_data": sample_data
         }
     
+    @staticmethod
+    def read_batches(csv_data, batch_size: int = IMPORT_BATCH_SIZE, max_in_flight: int = IMPORT_MAX_IN_FLIGHT,
+                     compression: Optional[str] = None, read_options: Optional[Dict[str, Any]] = None):
+        """Yield DataFrames of at most batch_size rows, parsed ahead on a background thread.
+        
+        At most max_in_flight parsed batches are held in memory while waiting to be consumed.
+        read_options are passed through to pandas read_csv.
+        """
+        batches = queue.Queue(maxsize=max_in_flight)
+        stop = threading.Event()
+        done = object()
+        
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce():
+            try:
+                with pd.read_csv(csv_data, chunksize=batch_size, compression=compression, **(read_options or {})) as reader:
+                    for chunk in metrics.timed_iter("parse", reader):
+                        if not put(chunk):
+                            return
+                put(done)
+            except Exception as e:
+                put(e)
+        
+        # Run in the caller's context, so parsing shows in the request's trace
+        producer = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+        producer.start()
+        
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop.set()
+            producer.join()
+    
     @staticmethod
     def validate_schema(csv_columns, clickhouse_columns):
         """Validate that CSV columns match ClickHouse table schema."""
@@ -261,71 +2810,814 @@ class CSVService:
         # For now, just return True for the prototype
         return True
 
+# Operations
+class OperationTracker:
+    """Tracks running imports and exports so they can be polled and cancelled.
+    
+    An operation's id prefixes the query_id of every query its service runs,
+    which is how its queries are found in system.processes and killed.
+    """
+    
+    def __init__(self, retention: float = OPERATION_RETENTION):
+        self.retention = retention
+        self._operations = {}  # operation_id -> (status, service)
+        self._lock = threading.Lock()
+    
+    def start(self, service: ClickHouseService, kind: str, table_name: str, operation_id: Optional[str] = None):
+        """Register an operation run by a service and return its status."""
+        self._prune()
+        operation_id = operation_id or uuid.uuid4().hex
+        if not re.fullmatch(OPERATION_ID_PATTERN, operation_id):
+            raise ValueError("operation_id must be 1-64 letters, digits or underscores")
+            
+        status = OperationStatus(
+            operation_id=operation_id,
+            kind=kind,
+            table_name=table_name,
+            status="running",
+            created_at=time.time()
+        )
+        with self._lock:
+            if operation_id in self._operations:
+                raise ValueError(f"Operation {operation_id} already exists")
+            self._operations[operation_id] = (status, service)
+            
+        service.operation_id = operation_id
+        service.cancelled = threading.Event()
+        return status
+    
+    def get(self, operation_id: str):
+        """Return an operation's status, or None."""
+        with self._lock:
+            entry = self._operations.get(operation_id)
+        return entry[0] if entry else None
+    
+    def update(self, operation_id: str, rows_processed: int, bytes_processed: int):
+        """Record an operation's own progress counters."""
+        status = self.get(operation_id)
+        if status:
+            status.rows_processed = rows_processed
+            status.bytes_processed = bytes_processed
+    
+    def finish(self, operation_id: str, error: Optional[str] = None):
+        """Mark an operation completed, failed or, if it was cancelled, cancelled."""
+        with self._lock:
+            status, service = self._operations[operation_id]
+        if status.finished_at is None:
+            metrics.inc("rows_processed_total", status.rows_processed, operation=status.kind)
+            metrics.inc("bytes_processed_total", status.bytes_processed, operation=status.kind)
+        if service.cancelled.is_set():
+            status.status = "cancelled"
+        else:
+            status.status = "failed" if error else "completed"
+        status.error = error
+        status.finished_at = time.time()
+    
+    def running(self):
+        """Return the number of running operations of each kind."""
+        with self._lock:
+            kinds = [status.kind for status, _ in self._operations.values() if status.status == "running"]
+        return {kind: kinds.count(kind) for kind in ("import", "export", "export_stream")}
+    
+    def refresh(self, operation_id: str):
+        """Return an operation's status with server-side progress of its running queries."""
+        with self._lock:
+            entry = self._operations.get(operation_id)
+        if entry is None:
+            return None
+            
+        status, service = entry
+        if status.status == "running":
+            try:
+                stats = service.query_progress()
+            except Exception as e:
+                print(f"Error reading progress of {operation_id}: {str(e)}")
+                return status
+            # Counters keep their last values between and after queries
+            if stats["queries"]:
+                status.read_rows = stats["read_rows"]
+                status.read_bytes = stats["read_bytes"]
+                status.total_rows_approx = stats["total_rows_approx"]
+                status.memory_usage = stats["memory_usage"]
+                if status.total_rows_approx:
+                    status.progress = min(status.read_rows / status.total_rows_approx, 1.0)
+            status.elapsed = time.time() - status.created_at
+        return status
+    
+    def cancel(self, operation_id: str):
+        """Stop an operation between batches and kill its running queries; returns its status or None."""
+        with self._lock:
+            entry = self._operations.get(operation_id)
+        if entry is None:
+            return None
+            
+        status, service = entry
+        if status.status == "running":
+            service.cancelled.set()
+            service.kill_queries()
+        return status
+    
+    def track_stream(self, operation_id: str, chunks):
+        """Wrap an export's chunk iterator to count bytes, honour cancellation and finish the operation.
+        
+        Closing the stream early, as happens when the client disconnects, kills
+        the operation's queries so abandoned exports stop using the cluster.
+        A body that is never read is cleaned up by end_stream instead.
+        """
+        with self._lock:
+            status, service = self._operations[operation_id]
+        try:
+            for chunk in chunks:
+                service.check_cancelled()
+                status.bytes_processed += len(chunk)
+                yield chunk
+            self.finish(operation_id)
+        except GeneratorExit:
+            self._abandon(operation_id)
+            raise
+        except Exception as e:
+            self.finish(operation_id, str(e))
+            raise
+        finally:
+            self._close_stream(service, chunks)
+    
+    def end_stream(self, operation_id: str, chunks):
+        """Clean up a streamed export once its response is over, whether or not its body was read.
+        
+        Runs after the response, so an operation still running was abandoned,
+        e.g. by a client that disconnected before the first chunk.
+        """
+        with self._lock:
+            status, service = self._operations[operation_id]
+        if status.status == "running":
+            self._abandon(operation_id)
+        self._close_stream(service, chunks)
+    
+    def _abandon(self, operation_id: str):
+        # Kill the queries of a stream nobody is reading and mark it cancelled
+        print(f"Export stream {operation_id} closed early, killing its queries")
+        try:
+            self.cancel(operation_id)
+        except Exception as e:
+            print(f"Error killing queries of {operation_id}: {str(e)}")
+        self.finish(operation_id)
+    
+    @staticmethod
+    def _close_stream(service: ClickHouseService, chunks):
+        close = getattr(chunks, "close", None)
+        try:
+            if close is not None:
+                close()
+        except ValueError:
+            pass  # Still being read on a worker thread, which closes it when it stops
+        service.close()
+    
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for operation_id in [
+                op_id for op_id, (status, _) in self._operations.items()
+                if status.finished_at and status.finished_at < cutoff
+            ]:
+                del self._operations[operation_id]
+
+operations = OperationTracker()
+
+# Incremental sync
+class SyncStore:
+    """Watermarks of incremental sync flows, persisted to a JSON file.
+    
+    A flow moves rows one way between one table and its client, so a run
+    that names a flow with another direction, connection, table or watermark
+    column is refused. A run reads the watermark when it starts and advances
+    it only once it completes, so a failed or cancelled run is repeated in
+    full by the next one, and a flow has at most one run at a time.
+    """
+    
+    def __init__(self, path: str = SYNC_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._running = set()
+        self._flows = self._load()  # flow -> SyncState
+    
+    def begin(self, connection_details: ConnectionDetails, sync: SyncConfig, direction: str, table_name: str):
+        """Start a run of a flow and return its state."""
+        if not re.fullmatch(OPERATION_ID_PATTERN, sync.flow):
+            raise ValueError("Sync flow names must be 1-64 letters, digits or underscores")
+            
+        connection = f"{connection_details.host}:{connection_details.port}/{connection_details.database}"
+        state = SyncState(
+            flow=sync.flow,
+            direction=direction,
+            connection=connection,
+            table_name=table_name,
+            watermark_column=sync.watermark_column
+        )
+        with self._lock:
+            stored = self._flows.get(sync.flow)
+            identity = ("direction", "connection", "table_name", "watermark_column")
+            if stored and stored.model_dump(include=set(identity)) != state.model_dump(include=set(identity)):
+                raise ValueError(
+                    f"Sync flow {sync.flow} is an {stored.direction} of {stored.table_name}.{stored.watermark_column} "
+                    f"on {stored.connection}"
+                )
+            if sync.flow in self._running:
+                raise ValueError(f"Sync flow {sync.flow} is already running")
+            self._running.add(sync.flow)
+        return stored.model_copy() if stored else state
+    
+    def advance(self, state: SyncState, watermark: Optional[str], rows: int):
+        """Store a completed run's watermark and row count."""
+        state = state.model_copy(update={"watermark": watermark, "rows": rows, "updated_at": time.time()})
+        with self._lock:
+            self._flows[state.flow] = state
+            self._save()
+    
+    def release(self, flow: str):
+        """End a run of a flow, whether or not it advanced the watermark."""
+        with self._lock:
+            self._running.discard(flow)
+    
+    def get(self, flow: str):
+        """Return a flow's state, or None."""
+        with self._lock:
+            return self._flows.get(flow)
+    
+    def delete(self, flow: str):
+        """Forget a flow, so its next run moves every row."""
+        with self._lock:
+            if self._flows.pop(flow, None) is None:
+                return False
+            self._save()
+            return True
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return {flow: SyncState(**state) for flow, state in json.load(f).items()}
+        except Exception as e:
+            print(f"Error loading sync state from {self.path}: {str(e)}")
+            return {}
+    
+    def _save(self):
+        # Written to a new file and renamed, so a crash never leaves half a file
+        partial_path = f"{self.path}.part"
+        with open(partial_path, "w") as f:
+            json.dump({flow: state.model_dump() for flow, state in self._flows.items()}, f)
+        os.replace(partial_path, self.path)
+
+class WatermarkFilter:
+    """Keeps the rows of parsed import batches past a watermark, tracking the largest value kept."""
+    
+    def __init__(self, column: str, watermark: Optional[str] = None):
+        self.column = column
+        self.watermark = watermark
+        self.largest = None
+    
+    def __call__(self, batch):
+        if self.column not in batch.columns:
+            raise Exception(f"Watermark column {self.column} not found in the upload")
+        if self.watermark is not None:
+            values = batch[self.column]
+            batch = batch[values.gt(self._parse(values, self.watermark)).fillna(False).astype(bool)]
+            
+        largest = batch[self.column].dropna().max()
+        if pd.notna(largest) and (self.largest is None or largest > self.largest):
+            self.largest = largest
+        return batch
+    
+    def advanced(self):
+        """Return the watermark after the batches seen: the largest value kept, or the old watermark."""
+        return self.watermark if self.largest is None else str(self.largest)
+    
+    @staticmethod
+    def _parse(values, watermark: str):
+        # Watermarks are stored as text; compare them as the column's parsed values
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return pd.Timestamp(watermark)
+        if pd.api.types.is_numeric_dtype(values):
+            return pd.to_numeric(watermark)
+        return watermark
+
+sync_flows = SyncStore()
+
+# Export snapshots
+def link_or_copy(source: str, target: str):
+    """Hard link source at target, copying it where the filesystem cannot link."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class SnapshotStore:
+    """Completed export files kept by content key, bounded by size with LRU eviction.
+    
+    A key covers the connection, the normalized query and the data version of
+    every table the query reads, so a snapshot is only served while those
+    tables are unchanged. Snapshots are hard linked into job files, so evicting
+    one never breaks a download and a pruned job never removes a snapshot.
+    Snapshots left by an earlier run are adopted at start.
+    """
+    
+    def __init__(self, snapshot_dir: str = EXPORT_SNAPSHOT_DIR, max_bytes: int = EXPORT_SNAPSHOT_MAX_BYTES):
+        self.snapshot_dir = snapshot_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (path, size, rows)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._adopt()
+    
+    @staticmethod
+    def key(connection_details: ConnectionDetails, query_config: QueryConfig, data_version):
+        """Return the content key of an export of a query config at a data version."""
+        config = query_config.model_dump(exclude=SNAPSHOT_IGNORED_FIELDS | {"join_config", "joins"})
+        # join_config and joins describe one chain however it is split between them
+        config["joins"] = [
+            {**join.model_dump(), "join_type": join.join_type.strip().upper()}
+            for join in query_config.join_chain()
+        ]
+        payload = json.dumps(
+            [ClientPool.connection_key(connection_details), config, data_version], sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str, target_path: str):
+        """Link the snapshot for key to target_path and return its row count, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            # Pinned by a hard link under the lock, so evicting the snapshot
+            # meanwhile cannot remove the file before it is copied
+            pin_path = f"{entry[0]}.{uuid.uuid4().hex}.part"
+            try:
+                os.link(entry[0], pin_path)
+            except OSError:
+                pin_path = None
+                link_or_copy(entry[0], target_path)
+            # The modification time orders adopted snapshots after a restart
+            os.utime(entry[0])
+            self._entries.move_to_end(key)
+            self.hits += 1
+            
+        if pin_path:
+            try:
+                link_or_copy(pin_path, target_path)
+            finally:
+                os.remove(pin_path)
+        return entry[2]
+    
+    def put(self, key: str, path: str, extension: str, rows: int):
+        """Keep a completed export file as the snapshot for key; files larger than the whole budget are skipped."""
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return
+            
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        snapshot_path = os.path.join(self.snapshot_dir, f"{key}-{rows}{extension}")
+        partial_path = f"{snapshot_path}.{uuid.uuid4().hex}.part"
+        link_or_copy(path, partial_path)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            os.replace(partial_path, snapshot_path)
+            self._entries[key] = (snapshot_path, size, rows)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def stats(self):
+        """Return store counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+    
+    def _remove(self, key: str):
+        path, size, _ = self._entries.pop(key)
+        self._size -= size
+        if os.path.exists(path):
+            os.remove(path)
+    
+    def _adopt(self):
+        # Snapshot files are named <key>-<rows><extension>; partial ones are dropped
+        if not os.path.isdir(self.snapshot_dir):
+            return
+        found = []
+        for name in os.listdir(self.snapshot_dir):
+            match = re.fullmatch(r"([0-9a-f]{64})-(\d+)(\..+)", name)
+            if match is None:
+                continue
+            path = os.path.join(self.snapshot_dir, name)
+            if name.endswith(".part"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, match.group(1), path, stat.st_size, int(match.group(2))))
+            
+        for _, key, path, size, rows in sorted(found):
+            self._entries[key] = (path, size, rows)
+            self._size += size
+        while self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+export_snapshots = SnapshotStore()
+
+# Export jobs
+class ExportJobManager:
+    """Runs exports in the background, writing each to a file under EXPORT_DIR."""
+    
+    def __init__(self, export_dir: str = EXPORT_DIR, retention: float = EXPORT_JOB_RETENTION):
+        self.export_dir = export_dir
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+    
+    def submit(self, service: ClickHouseService, query_config: QueryConfig):
+        """Start an export on the export executor and return its job."""
+        self._prune()
+        os.makedirs(self.export_dir, exist_ok=True)
+        
+        if query_config.output_format not in EXPORT_FORMATS:
+            raise Exception(f"Unsupported output format: {query_config.output_format}")
+        if query_config.compression and query_config.compression not in FILE_COMPRESSIONS:
+            raise Exception(f"Unsupported compression: {query_config.compression}")
+            
+        # The job is tracked as an operation with the same id
+        service.set_limits(query_config)
+        job_id = operations.start(service, "export", query_config.table_name).operation_id
+        job = ExportJob(
+            job_id=job_id,
+            table_name=query_config.table_name,
+            output_format=query_config.output_format,
+            compression=query_config.compression,
+            status="pending",
+            created_at=time.time(),
+            download_url=f"/download/{job_id}"
+        )
+        with self._lock:
+            self._jobs[job_id] = job
+            
+        executors["export_jobs"].submit(self._run, job, service, query_config)
+        return job
+    
+    def get(self, job_id: str):
+        """Return a job by id, or None."""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def file_path(self, job: ExportJob):
+        """Path of the finished export file for a job."""
+        return os.path.join(self.export_dir, f"{job.job_id}{self.file_extension(job)}")
+    
+    @staticmethod
+    def file_extension(job: ExportJob):
+        """File extension for a job's output format and compression."""
+        extension, _ = EXPORT_FORMATS[job.output_format]
+        if job.compression:
+            extension += FILE_COMPRESSIONS[job.compression][0]
+        return extension
+    
+    @staticmethod
+    def media_type(job: ExportJob):
+        """Media type of a job's export file."""
+        if job.compression:
+            return FILE_COMPRESSIONS[job.compression][1]
+        return EXPORT_FORMATS[job.output_format][1]
+    
+    def _run(self, job: ExportJob, service: ClickHouseService, query_config: QueryConfig):
+        path = self.file_path(job)
+        partial_path = f"{path}.part"
+        job.status = "running"
+        
+        def progress(rows_written: int, bytes_written: int):
+            job.rows_written = rows_written
+            job.bytes_written = bytes_written
+            operations.update(job.job_id, rows_written, bytes_written)
+            # Raising here stops the export after the chunk just written
+            service.check_cancelled()
+        
+        sync_state = None
+        try:
+            if query_config.sync:
+                sync_state = sync_flows.begin(
+                    service.connection_details, query_config.sync, "export", query_config.table_name
+                )
+                query_config, watermark = self._sync_window(service, query_config, sync_state.watermark)
+            snapshot_key = self._snapshot_key(service, query_config)
+            rows = export_snapshots.get(snapshot_key, path) if snapshot_key else None
+            if rows is not None:
+                job.snapshot = True
+                progress(rows, os.path.getsize(path))
+            else:
+                self._export(service, query_config, partial_path, job.compression, progress)
+                # Only completed exports are visible under the download path
+                os.replace(partial_path, path)
+                if snapshot_key:
+                    self._keep_snapshot(snapshot_key, job, path)
+            if sync_state:
+                sync_flows.advance(sync_state, watermark, job.rows_written)
+            job.status = "completed"
+            operations.finish(job.job_id)
+        except Exception as e:
+            job.error = str(e)
+            operations.finish(job.job_id, job.error)
+            job.status = operations.get(job.job_id).status
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        finally:
+            if sync_state:
+                sync_flows.release(sync_state.flow)
+            service.close()
+            job.finished_at = time.time()
+    
+    @staticmethod
+    def _export(service: ClickHouseService, query_config: QueryConfig, path: str, compression: Optional[str], progress):
+        table_name, joins = service.plan_export(query_config)
+        with open(path, "wb") as raw_output, compressing_writer(raw_output, compression) as output:
+            service.export_to_file(
+                table_name,
+                query_config.columns,
+                joins,
+                output=output,
+                progress=progress,
+                output_format=query_config.output_format,
+                parquet_compression=query_config.parquet_compression,
+                parallel_workers=query_config.parallel_workers,
+                split_columns=query_config.split_columns,
+                selection=query_config,
+                csv_options=query_config.csv_options
+            )
+    
+    @staticmethod
+    def _sync_window(service: ClickHouseService, query_config: QueryConfig, watermark: Optional[str]):
+        """Restrict an incremental export to the rows past the watermark; returns (query_config, new watermark).
+        
+        The window ends at the largest watermark value present when the export
+        starts, so rows arriving during the export are left for the next run.
+        It starts sync.lookback behind the watermark; without a lookback, rows
+        committed after a run with a watermark value at or below the one that
+        run stored are never exported.
+        """
+        if query_config.limit is not None or query_config.offset:
+            raise Exception("Incremental exports cannot use limit or offset")
+        column = query_config.sync.watermark_column
+        lower = watermark
+        if lower is not None and query_config.sync.lookback:
+            lower = service.subtract_value(query_config.table_name, column, lower, query_config.sync.lookback)
+        upper = service.max_value(query_config.table_name, column, lower)
+        if upper is None:
+            return query_config.model_copy(update={"limit": 0}), watermark
+            
+        # Qualified, since joined tables may have a column of the same name
+        reference = column if "." in column else f"{query_config.table_name}.{column}"
+        filters = list(query_config.filters or []) + [FilterPredicate(column=reference, op="<=", value=upper)]
+        if lower is not None:
+            filters.append(FilterPredicate(column=reference, op=">", value=lower))
+        return query_config.model_copy(update={"filters": filters}), upper
+    
+    @staticmethod
+    def _snapshot_key(service: ClickHouseService, query_config: QueryConfig):
+        # None for exports that skip snapshots or read tables without a data version
+        if not query_config.snapshot:
+            return None
+        tables = [query_config.table_name] + [join.second_table for join in query_config.join_chain()]
+        data_version = service.data_version(tables)
+        if data_version is None:
+            return None
+        return SnapshotStore.key(service.connection_details, query_config, data_version)
+    
+    def _keep_snapshot(self, snapshot_key: str, job: ExportJob, path: str):
+        # A snapshot that cannot be kept must not fail the export it came from
+        try:
+            export_snapshots.put(snapshot_key, path, self.file_extension(job), job.rows_written)
+        except Exception as e:
+            print(f"Error keeping export snapshot of {job.table_name}: {str(e)}")
+    
+    def _prune(self):
+        # Drop finished jobs, and their files, once they are past retention
+        now = time.time()
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.finished_at is not None and now - job.finished_at > self.retention
+            ]
+            for job in expired:
+                del self._jobs[job.job_id]
+                
+        for job in expired:
+            if os.path.exists(self.file_path(job)):
+                os.remove(self.file_path(job))
+
+export_jobs = ExportJobManager()
+
+def parse_range_header(range_header: str, file_size: int):
+    """Parse a single-range HTTP Range header into inclusive (start, end) offsets.
+    
+    Returns None if the header is not a single byte range; raises ValueError if
+    the range cannot be satisfied.
+    """
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return None
+        
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(file_size - int(end_str), 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+        
+    if start >= file_size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, file_size - 1)
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """Yield the bytes of a file between inclusive offsets."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
 # API endpoints
+def resolve_connection(connection_details: Optional[ConnectionDetails], session_token: Optional[str]):
+    """Resolve connection details from the request body or an X-Session-Token header."""
+    if session_token:
+        details = session_store.get(session_token)
+        if details is None:
+            raise HTTPException(status_code=401, detail="Unknown or expired session token")
+        return details
+    
+    if connection_details is None:
+        raise HTTPException(status_code=400, detail="Connection details or session token required")
+    return connection_details
+
 @app.post("/connect", response_model=bool)
 async def connect(connection_details: ConnectionDetails):
     """Connect to a ClickHouse server."""
+    service = ClickHouseService(connection_details)
     try:
-        service = ClickHouseService(connection_details)
-        success = service.connect()
+        success = await run_blocking("metadata", service.connect)
         return success
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Connection error: {str(e)}")
+    finally:
+        service.close()
+
+@app.post("/sessions", response_model=Dict[str, str])
+async def create_session(connection_details: ConnectionDetails):
+    """Connect to a ClickHouse server and return a token usable in place of the connection details."""
+    service = ClickHouseService(connection_details)
+    if not await run_blocking("metadata", service.connect):
+        raise HTTPException(status_code=400, detail="Failed to connect to ClickHouse")
+    service.close()
+        
+    return {"session_token": session_store.create(connection_details)}
+
+@app.delete("/sessions/{session_token}", response_model=bool)
+async def delete_session(session_token: str):
+    """Invalidate a session token."""
+    return session_store.delete(session_token)
+
+@app.get("/pool/stats", response_model=Dict[str, Any])
+async def pool_stats():
+    """Report client pool size and reuse counters."""
+    return client_pool.stats()
+
+@app.get("/preview/cache/stats", response_model=Dict[str, Any])
+async def preview_cache_stats():
+    """Report preview cache size, hits, misses and evictions."""
+    return preview_cache.stats()
+
+@app.get("/export/snapshots/stats", response_model=Dict[str, Any])
+async def export_snapshot_stats():
+    """Report export snapshot disk usage, hits, misses and evictions."""
+    return export_snapshots.stats()
+
+@app.get("/import/buffer/stats", response_model=Dict[str, Any])
+async def insert_buffer_stats():
+    """Report rows waiting in the insert buffer and flush counters."""
+    return insert_buffer.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Report request, stage, throughput and ClickHouse metrics in the Prometheus text format."""
+    for kind, running in operations.running().items():
+        metrics.set("operations_in_flight", running, kind=kind)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/tables", response_model=List[TableSchema])
-async def list_tables(connection_details: ConnectionDetails = Body(...)):
-    """List all tables in the database."""
+async def list_tables(
+    connection_details: Optional[ConnectionDetails] = Body(None),
+    x_session_token: Optional[str] = Header(None),
+    name_filter: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1)
+):
+    """List tables in the database, optionally filtered by name and paginated."""
+    connection_details = resolve_connection(connection_details, x_session_token)
+    
+    service = ClickHouseService(connection_details)
     try:
-        service = ClickHouseService(connection_details)
-        if not service.connect():
+        if not await run_blocking("metadata", service.connect):
             raise HTTPException(status_code=400, detail="Failed to connect to ClickHouse")
             
-        tables = service.list_tables()
+        tables = await run_blocking("metadata", service.list_tables, name_filter=name_filter, offset=offset, limit=limit)
         return tables
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing tables: {str(e)}")
+    finally:
+        service.close()
 
 @app.post("/preview", response_model=List[Dict[str, Any]])
-async def preview_data(query_config: QueryConfig, connection_details: ConnectionDetails = Body(...)):
+async def preview_data(
+    query_config: QueryConfig,
+    connection_details: Optional[ConnectionDetails] = Body(None),
+    x_session_token: Optional[str] = Header(None)
+):
     """Preview data from ClickHouse."""
+    connection_details = resolve_connection(connection_details, x_session_token)
+    
+    service = ClickHouseService(connection_details)
     try:
-        service = ClickHouseService(connection_details)
-        if not service.connect():
+        # Cache hits are answered without touching the pool or ClickHouse
+        strategy = {
+            "sample_ratio": query_config.sample_ratio,
+            "prelimit_join": query_config.prelimit_join,
+            "join_algorithm": query_config.join_algorithm,
+            "selection": query_config
+        }
+        data = service.cached_preview(query_config.table_name, query_config.columns, query_config.join_chain(), **strategy)
+        if data is not None:
+            metrics.inc("rows_processed_total", len(data), operation="preview")
+            return data
+            
+        if not await run_blocking("metadata", service.connect):
             raise HTTPException(status_code=400, detail="Failed to connect to ClickHouse")
             
-        data = service.preview_data(
+        data = await run_blocking(
+            "preview",
+            service.preview_data,
             query_config.table_name, 
             query_config.columns, 
-            query_config.join_config
+            query_config.join_chain(),
+            **strategy
         )
+        metrics.inc("rows_processed_total", len(data), operation="preview")
         return data
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error previewing data: {str(e)}")
+    finally:
+        service.close()
 
 @app.post("/export", response_model=ProcessingResult)
-async def export_to_csv(query_config: QueryConfig, connection_details: ConnectionDetails = Body(...)):
+async def export_to_csv(
+    query_config: QueryConfig,
+    connection_details: Optional[ConnectionDetails] = Body(None),
+    x_session_token: Optional[str] = Header(None)
+):
     """Export data from ClickHouse to CSV."""
+    connection_details = resolve_connection(connection_details, x_session_token)
+    
+    service = ClickHouseService(connection_details)
     try:
-        service = ClickHouseService(connection_details)
-        if not service.connect():
+        if not await run_blocking("metadata", service.connect):
             raise HTTPException(status_code=400, detail="Failed to connect to ClickHouse")
             
-        csv_data, record_count = service.export_to_csv(
-            query_config.table_name, 
-            query_config.columns, 
-            query_config.join_config
-        )
-        
-        # In a real implementation, the CSV would be saved to a file or object storage
-        # and a download URL would be returned. For the prototype, we'll return a success response.
+        job = export_jobs.submit(service, query_config)
         
         return ProcessingResult(
             success=True,
-            records_processed=record_count,
-            message=f"Successfully exported {record_count} records from {query_config.table_name}",
-            download_url="/download/export.csv"  # This would be a real URL in production
+            records_processed=0,
+            message=f"Export of {query_config.table_name} submitted as job {job.job_id}",
+            download_url=job.download_url,
+            job_id=job.job_id
         )
     except Exception as e:
+        # A submitted job gives the client back when it finishes
+        service.close()
         return ProcessingResult(
             success=False,
             records_processed=0,
@@ -333,15 +3625,163 @@ async def export_to_csv(query_config: QueryConfig, connection_details: Connectio
             error=str(e)
         )
 
+@app.get("/export/jobs/{job_id}", response_model=ExportJob)
+async def export_job_status(job_id: str):
+    """Report the status and progress of an export job."""
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+@app.get("/download/{job_id}")
+async def download_export(
+    job_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None)
+):
+    """Download the file of a completed export job, honouring HTTP Range requests."""
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Export job is {job.status}")
+        
+    path = export_jobs.file_path(job)
+    extension = export_jobs.file_extension(job)
+    media_type = export_jobs.media_type(job)
+    file_size = os.path.getsize(path)
+    etag = f'"{job_id}-{file_size}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{job.table_name}{extension}"'
+    }
+    
+    byte_range = None
+    # A stale If-Range validator means the client must restart from scratch
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range_header(range_header, file_size)
+        except ValueError:
+            raise HTTPException(
+                status_code=416,
+                detail="Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{file_size}"}
+            )
+            
+    if byte_range is None:
+        start, end, status_code = 0, file_size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    return StreamingResponse(
+        iterate_blocking("export", iter_file_range(path, start, end)),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers
+    )
+
+@app.post("/export/stream")
+async def export_csv_stream(
+    query_config: QueryConfig,
+    connection_details: Optional[ConnectionDetails] = Body(None),
+    x_session_token: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    operation_id: Optional[str] = Query(None)
+):
+    """Stream data from ClickHouse as a download without buffering the result set.
+    
+    The export is tracked as an operation, whose id is returned in the
+    X-Operation-Id header unless the client chose it with operation_id.
+    """
+    if query_config.sync:
+        raise HTTPException(status_code=400, detail="Incremental exports run as jobs through /export")
+    connection_details = resolve_connection(connection_details, x_session_token)
+    
+    service = ClickHouseService(connection_details)
+    try:
+        if not await run_blocking("metadata", service.connect):
+            raise HTTPException(status_code=400, detail="Failed to connect to ClickHouse")
+            
+        service.set_limits(query_config)
+        operation = operations.start(service, "export_stream", query_config.table_name, operation_id)
+    except ValueError as e:
+        service.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        service.close()
+        raise
+    except Exception as e:
+        service.close()
+        raise HTTPException(status_code=500, detail=f"Error exporting data: {str(e)}")
+        
+    def count_rows(rows: int):
+        operation.rows_processed += rows
+        
+    try:
+        table_name, joins = await run_blocking("metadata", service.plan_export, query_config)
+        chunks = await run_blocking(
+            "export",
+            service.export_stream,
+            table_name, 
+            query_config.columns, 
+            joins,
+            query_config.output_format,
+            query_config.parquet_compression,
+            on_rows=count_rows,
+            selection=query_config,
+            csv_options=query_config.csv_options
+        )
+    except Exception as e:
+        operations.finish(operation.operation_id, str(e))
+        service.close()
+        raise HTTPException(status_code=500, detail=f"Error exporting data: {str(e)}")
+    # Runs after the response even if its body is never read
+    cleanup = BackgroundTask(operations.end_stream, operation.operation_id, chunks)
+    chunks = operations.track_stream(operation.operation_id, chunks)
+    
+    extension, media_type = EXPORT_FORMATS[query_config.output_format]
+    headers = {}
+    
+    if query_config.compression:
+        # A compressed file was asked for, e.g. sales.csv.gz
+        if query_config.compression not in FILE_COMPRESSIONS:
+            operations.finish(operation.operation_id, f"Unsupported compression: {query_config.compression}")
+            service.close()
+            raise HTTPException(status_code=400, detail=f"Unsupported compression: {query_config.compression}")
+        suffix, media_type = FILE_COMPRESSIONS[query_config.compression]
+        extension += suffix
+        chunks = compress_chunks(chunks, query_config.compression)
+    elif query_config.output_format != "parquet":
+        # Otherwise compress in transit if the client accepts it; Parquet is already compressed
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            headers["Vary"] = "Accept-Encoding"
+            chunks = compress_chunks(chunks, encoding)
+            
+    headers["Content-Disposition"] = f'attachment; filename="{query_config.table_name}{extension}"'
+    headers["X-Operation-Id"] = operation.operation_id
+    return StreamingResponse(
+        iterate_blocking("export", chunks),
+        media_type=media_type,
+        headers=headers,
+        background=cleanup
+    )
+
 @app.post("/parse-csv", response_model=Dict[str, Any])
 async def parse_csv(file: UploadFile = File(...)):
     """Parse a CSV file and return column information and sample data."""
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Only CSV files are supported")
+    if not CSVService.upload_compression(file.filename)[0]:
+        raise HTTPException(status_code=400, detail="Only .csv, .csv.gz and .csv.zst files are supported")
         
     try:
+        metrics.record_request_stage("upload")
         csv_service = CSVService()
-        result = csv_service.parse_csv(file)
+        result = await run_blocking("preview", metrics.timed("parse", csv_service.parse_csv), file)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error parsing CSV: {str(e)}")
@@ -350,39 +3790,200 @@ async def parse_csv(file: UploadFile = File(...)):
 async def import_csv(
     table_name: str, 
     file: UploadFile = File(...),
-    connection_details: ConnectionDetails = Body(...)
+    connection_details: Optional[ConnectionDetails] = Body(None),
+    x_session_token: Optional[str] = Header(None),
+    batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1),
+    max_in_flight: int = Query(IMPORT_MAX_IN_FLIGHT, ge=1),
+    mode: str = Query("direct"),
+    table_layout: Optional[str] = Form(None),
+    operation_id: Optional[str] = Query(None),
+    max_execution_time: Optional[int] = Query(None, ge=1),
+    max_memory_usage: Optional[int] = Query(None, ge=1),
+    sync_flow: Optional[str] = Query(None),
+    watermark_column: Optional[str] = Query(None),
+    id_column: Optional[str] = Query(None)
 ):
-    """Import CSV data into ClickHouse."""
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Only CSV files are supported")
+    """Import CSV data into ClickHouse.
+    
+    table_layout is a JSON TableLayout applied if the table has to be created.
+    mode is one of IMPORT_MODES; in every mode the response is sent only after
+    ClickHouse has acknowledged the inserts holding the upload's rows. The
+    import is tracked as an operation; choosing its operation_id lets the
+    client poll or cancel it while the request is running.
+    
+    sync_flow makes the import incremental: only rows whose watermark_column
+    is past the flow's watermark are inserted, into a ReplacingMergeTree
+    sorted by id_column and versioned by watermark_column, so a re-sent row
+    replaces the earlier version of its id once ClickHouse merges the parts.
+    """
+    supported, compression = CSVService.upload_compression(file.filename)
+    if not supported:
+        raise HTTPException(status_code=400, detail="Only .csv, .csv.gz and .csv.zst files are supported")
+    if mode not in IMPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported import mode: {mode}")
+    connection_details = resolve_connection(connection_details, x_session_token)
+    try:
+        layout = TableLayout.model_validate_json(table_layout) if table_layout else None
+        if layout:
+            ClickHouseService.check_layout(layout)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid table layout: {str(e)}")
+    sync = None
+    if sync_flow:
+        if not watermark_column or not id_column:
+            raise HTTPException(status_code=400, detail="Incremental imports need watermark_column and id_column")
+        sync = SyncConfig(flow=sync_flow, watermark_column=watermark_column, id_column=id_column)
         
+    sync_state = None
+    batch_filter = None
+    operation = None  # set once this request owns operation_id
+    ch_service = None
     try:
-        # Parse CSV to get columns
+        # Infer columns from a bounded sample of the upload
+        metrics.record_request_stage("upload")
         csv_service = CSVService()
-        parse_result = csv_service.parse_csv(file)
-        columns = parse_result["columns"]
+        sample = await run_blocking("import", metrics.timed("parse", csv_service.read_sample), file)
+        columns = await run_blocking("import", metrics.timed("parse", csv_service.infer_columns), sample)
         
         # Connect to ClickHouse
         ch_service = ClickHouseService(connection_details)
-        if not ch_service.connect():
+        if not await run_blocking("metadata", ch_service.connect):
             raise HTTPException(status_code=400, detail="Failed to connect to ClickHouse")
+        ch_service.set_limits(QueryLimits(max_execution_time=max_execution_time, max_memory_usage=max_memory_usage))
+        operation = operations.start(ch_service, "import", table_name, operation_id)
+        operation_id = operation.operation_id
+        if sync:
+            sync_state = sync_flows.begin(connection_details, sync, "import", table_name)
+            batch_filter = WatermarkFilter(watermark_column, sync_state.watermark)
+            
+        # Lay out a new table by the request, recommending what it leaves unset
+        created = not await run_blocking("metadata", ch_service.table_exists, table_name)
+        if sync and created:
+            layout = (layout or TableLayout()).model_copy(
+                update={"engine": "ReplacingMergeTree", "order_by": [id_column], "version_column": watermark_column}
+            )
+            requested_partition = layout.partition_by
+        elif sync:
+            await run_blocking("metadata", ch_service.check_upsert_table, table_name, id_column)
+        if created:
+            layout = await run_blocking("import", metrics.timed("parse", csv_service.recommend_layout), sample, columns, layout)
+        if sync and created:
+            # Rows are only replaced within a partition, so a sync table is never
+            # partitioned by a column that can change, such as the watermark
+            mutable = ch_service.partition_columns(layout.partition_by, [col.name for col in columns]) - {id_column}
+            if mutable and requested_partition:
+                raise Exception(f"Incremental imports cannot partition by {', '.join(sorted(mutable))}")
+            if mutable:
+                layout = layout.model_copy(update={"partition_by": None})
         
         # Import data
         file.file.seek(0)  # Reset file pointer
-        records_processed = ch_service.import_from_csv(table_name, file.file, columns)
-        
+        if mode == "buffer":
+            # Wait for the buffered inserts without holding an import worker
+            futures = await run_blocking(
+                "import",
+                ch_service.buffer_csv,
+                table_name,
+                file.file,
+                columns,
+                compression=compression,
+                table_layout=layout,
+                batch_filter=batch_filter
+            )
+            records_processed = sum(await asyncio.gather(*(asyncio.wrap_future(f) for f in futures)))
+        else:
+            records_processed = await run_blocking(
+                "import",
+                ch_service.import_from_csv,
+                table_name, 
+                file.file, 
+                columns, 
+                batch_size=batch_size, 
+                max_in_flight=max_in_flight,
+                compression=compression,
+                table_layout=layout,
+                settings=ASYNC_INSERT_SETTINGS if mode == "async" else None,
+                progress=functools.partial(operations.update, operation_id),
+                batch_filter=batch_filter
+            )
+            
+        if sync_state:
+            sync_flows.advance(sync_state, batch_filter.advanced(), records_processed)
+        operations.update(operation_id, records_processed, operation.bytes_processed)
+        operations.finish(operation_id)
         return ProcessingResult(
             success=True,
             records_processed=records_processed,
-            message=f"Successfully imported {records_processed} records to {table_name}"
+            message=f"Successfully imported {records_processed} records to {table_name}",
+            table_layout=layout if created else None,
+            operation_id=operation_id
         )
     except Exception as e:
+        # A rejected operation_id may belong to another request's import
+        if operation:
+            operations.finish(operation.operation_id, str(e))
         return ProcessingResult(
             success=False,
             records_processed=0,
             message="Import failed",
-            error=str(e)
+            error=str(e),
+            operation_id=operation_id
         )
+    finally:
+        if sync_state:
+            sync_flows.release(sync_state.flow)
+        if ch_service:
+            ch_service.close()
+
+@app.get("/sync/flows/{flow}", response_model=SyncState)
+async def sync_flow_state(flow: str):
+    """Report an incremental sync flow's watermark and last run."""
+    state = sync_flows.get(flow)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Sync flow not found")
+    return state
+
+@app.delete("/sync/flows/{flow}", response_model=bool)
+async def reset_sync_flow(flow: str):
+    """Forget a sync flow's watermark, so its next run moves every row."""
+    return sync_flows.delete(flow)
+
+@app.get("/operations/{operation_id}", response_model=OperationStatus)
+async def operation_status(operation_id: str):
+    """Poll an import's or export's progress."""
+    status = await run_blocking("metadata", operations.refresh, operation_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    return status
+
+@app.get("/operations/{operation_id}/events")
+async def operation_events(operation_id: str):
+    """Stream an operation's progress as server-sent events until it finishes."""
+    if operations.get(operation_id) is None:
+        raise HTTPException(status_code=404, detail="Operation not found")
+        
+    async def events():
+        while True:
+            status = await run_blocking("metadata", operations.refresh, operation_id)
+            if status is None:
+                break
+            yield f"event: progress\ndata: {status.model_dump_json()}\n\n"
+            if status.status != "running":
+                break
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/operations/{operation_id}/cancel", response_model=OperationStatus)
+async def cancel_operation(operation_id: str):
+    """Cancel an import or export and kill its running ClickHouse queries."""
+    try:
+        status = await run_blocking("metadata", operations.cancel, operation_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error cancelling operation: {str(e)}")
+    if status is None:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    return status
 
 # For development purposes - a simple health check endpoint
 @app.get("/health")
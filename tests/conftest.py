@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+# The server reads its directories from the environment at import time
+os.environ.setdefault("EXPORT_DIR", tempfile.mkdtemp(prefix="clickhouse-exports-"))
+os.environ.setdefault("SYNC_STATE_PATH", os.path.join(os.environ["EXPORT_DIR"], "sync-state.json"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "server"))
+
+import clickhouse_connect
+from clickhouse_connect.datatypes.registry import get_from_name
+
+CONNECTION = {"host": "localhost", "port": "8123", "database": "default", "username": "default", "password": ""}
+
+class FakeResult:
+    def __init__(self, names, rows):
+        self.column_names = names
+        self.result_rows = rows
+        self.summary = {}
+    
+    def named_results(self):
+        return [dict(zip(self.column_names, row)) for row in self.result_rows]
+
+class FakeStream:
+    def __init__(self, names, types, blocks):
+        self.source = types_namespace(column_names=names, column_types=types)
+        self.blocks = blocks
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        pass
+    
+    def __iter__(self):
+        return iter(self.blocks)
+
+def types_namespace(**kwargs):
+    return types.SimpleNamespace(close=lambda: None, **kwargs)
+
+class FakeClient:
+    """Stands in for a clickhouse-connect client, answering queries by substring."""
+    
+    def __init__(self, routes, rows):
+        self.routes = routes  # (substring, column names, rows or a function of the query and parameters)
+        self.rows = rows  # (column names, type names, rows) returned by exports
+        self.queries = []
+        self.inserted = []
+    
+    def query(self, query, parameters=None, settings=None, **kwargs):
+        self.queries.append(query)
+        for substring, names, rows in self.routes:
+            if substring in query:
+                return FakeResult(names, rows(query, parameters) if callable(rows) else rows)
+        return FakeResult([], [])
+    
+    def query_column_block_stream(self, query, parameters=None, settings=None, **kwargs):
+        self.queries.append(query)
+        names, type_names, rows = self.rows
+        columns = [list(column) for column in zip(*rows)]
+        return FakeStream(names, [get_from_name(name) for name in type_names], [columns])
+    
+    def command(self, query, parameters=None, settings=None, **kwargs):
+        self.queries.append(query)
+    
+    def create_insert_context(self, table_name, column_names=None, column_type_names=None, settings=None, **kwargs):
+        return types_namespace(table=table_name, column_names=column_names, settings=settings)
+    
+    def insert_df(self, df=None, context=None, **kwargs):
+        self.inserted.append(df)
+        return types_namespace(summary={"written_rows": str(len(df))})
+    
+    def ping(self):
+        return True
+    
+    def close(self):
+        pass
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    import main
+    
+    client = FakeClient([], ([], [], []))
+    monkeypatch.setattr(clickhouse_connect, "get_client", lambda **kwargs: client)
+    main.client_pool.__init__()
+    main.schema_cache.__init__()
+    main.preview_cache.__init__()
+    return client
+
+@pytest.fixture
+def api(fake_client):
+    from fastapi.testclient import TestClient
+    import main
+    
+    return TestClient(main.app)
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import benchmark
+
+def test_dataset_is_the_generated_sales_table(tmp_path):
+    directory = str(tmp_path / "bench_1000_7")
+    
+    path = benchmark.generate_dataset(directory, 1000, 7)
+    first = os.path.getmtime(path)
+    
+    df = pd.read_csv(path)
+    assert len(df) == 1000
+    assert list(df.columns)[:3] == ["transaction_id", "order_id", "customer_id"]
+    # An existing data set is reused
+    assert benchmark.generate_dataset(directory, 1000, 7) == path
+    assert os.path.getmtime(path) == first
+
+def test_summary_throughput_and_percentiles():
+    summary = benchmark.summarize("import", 1000, 2 * 1024 * 1024, [0.5, 1.5], None)
+    
+    assert summary["rows_per_s"] == 1000
+    assert summary["mb_per_s"] == 2
+    assert summary["p50_ms"] == 1000
+    assert summary["server_peak_rss_mb"] is None
+
+def test_throughput_drops_past_the_threshold_are_regressions():
+    baseline = {("import", 1000): {"rows_per_s": 100, "p99_ms": 10}, ("preview", 1000): {"rows_per_s": 100, "p99_ms": 10}}
+    results = [
+        {"phase": "import", "scale": 1000, "rows_per_s": 85, "p99_ms": 12},
+        {"phase": "preview", "scale": 1000, "rows_per_s": 95, "p99_ms": 10},
+        {"phase": "export_csv", "scale": 1000, "rows_per_s": 1, "p99_ms": 10}
+    ]
+    
+    assert benchmark.compare(results, baseline, "baseline.json", 0.1) == ["import"]
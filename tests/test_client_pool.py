@@ -0,0 +1,54 @@
+from conftest import CONNECTION
+
+import main
+
+class PooledClient:
+    def __init__(self):
+        self.closed = False
+    
+    def ping(self):
+        return True
+    
+    def close(self):
+        self.closed = True
+
+def details(database):
+    return main.ConnectionDetails(**{**CONNECTION, "database": database})
+
+def test_pool_only_evicts_clients_that_are_not_checked_out(monkeypatch):
+    monkeypatch.setattr(main, "create_client", lambda connection_details: PooledClient())
+    pool = main.ClientPool(max_size=1, idle_timeout=3600)
+    
+    first = pool.get_client(details("first"))
+    second = pool.get_client(details("second"))
+    
+    # Over max_size, but both are in use
+    assert not first.closed and not second.closed
+    assert pool.stats()["size"] == 2
+    
+    pool.release(first)
+    assert first.closed
+    assert pool.stats()["size"] == 1
+    assert pool.get_client(details("second")) is second
+
+def test_pool_closes_unhealthy_client_once_returned(monkeypatch):
+    monkeypatch.setattr(main, "create_client", lambda connection_details: PooledClient())
+    pool = main.ClientPool(health_check_interval=0)
+    
+    in_use = pool.get_client(details("first"))
+    monkeypatch.setattr(in_use, "ping", lambda: False)
+    replacement = pool.get_client(details("first"))
+    
+    assert replacement is not in_use
+    assert not in_use.closed
+    pool.release(in_use)
+    assert in_use.closed
+    assert not replacement.closed
+
+def test_requests_give_their_client_back(api, fake_client):
+    session = api.post("/sessions", json=CONNECTION).json()["session_token"]
+    api.post("/connect", json=CONNECTION)
+    api.post("/tables", headers={"X-Session-Token": session})
+    api.post("/import?table_name=orders", files={"file": ("orders.csv", b"id\n1\n")}, headers={"X-Session-Token": session})
+    
+    assert main.client_pool.stats()["checked_out"] == 0
@@ -0,0 +1,46 @@
+import io
+import types
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import main
+
+class ArrowStream:
+    """Stands in for a clickhouse-connect Arrow batch stream."""
+    
+    def __init__(self, batches):
+        self.gen = types.SimpleNamespace(schema=batches[0].schema)
+        self.batches = batches
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        pass
+    
+    def __iter__(self):
+        return iter(self.batches)
+
+def batches():
+    return [
+        pa.RecordBatch.from_pydict({"id": pa.array([1, 2], pa.uint32()), "name": ["a", "b"]}),
+        pa.RecordBatch.from_pydict({"id": pa.array([3], pa.uint32()), "name": ["c"]})
+    ]
+
+def test_parquet_export_writes_a_row_group_per_batch():
+    counted = []
+    
+    data = b"".join(main.ClickHouseService._parquet_chunks(ArrowStream(batches()), "zstd", on_rows=counted.append))
+    
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.read().to_pydict() == {"id": [1, 2, 3], "name": ["a", "b", "c"]}
+    assert counted == [2, 1]
+
+def test_arrow_export_is_an_ipc_stream():
+    data = b"".join(main.ClickHouseService._arrow_chunks(ArrowStream(batches())))
+    
+    table = pa.ipc.open_stream(data).read_all()
+    assert table.schema.field("id").type == pa.uint32()
+    assert table.to_pydict() == {"id": [1, 2, 3], "name": ["a", "b", "c"]}
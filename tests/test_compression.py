@@ -0,0 +1,57 @@
+import gzip
+
+import pytest
+import zstandard
+
+from conftest import CONNECTION
+
+import main
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("gzip, deflate", "gzip"),
+    ("gzip, zstd", "zstd"),
+    ("zstd;q=0, gzip", "gzip"),
+    ("br", None)
+])
+def test_encoding_negotiation(header, expected):
+    assert main.negotiate_encoding(header) == expected
+
+def test_compressed_chunks_round_trip():
+    chunks = [b"id\n", b"1\n" * 1000, b"2\n"]
+    
+    assert gzip.decompress(b"".join(main.compress_chunks(iter(chunks), "gzip"))) == b"".join(chunks)
+    zstd = b"".join(main.compress_chunks(iter(chunks), "zstd"))
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(zstd) == b"".join(chunks)
+
+@pytest.mark.parametrize("filename, compression", [
+    ("orders.csv", None),
+    ("orders.CSV.GZ", "gzip"),
+    ("orders.csv.zst", "zstd")
+])
+def test_upload_compression(filename, compression):
+    assert main.CSVService.upload_compression(filename) == (True, compression)
+
+def test_export_is_compressed_in_transit(api, fake_client):
+    fake_client.rows = (["id"], ["UInt32"], [(1,), (2,)])
+    
+    response = api.post(
+        "/export/stream",
+        json={"query_config": {"table_name": "orders", "columns": ["id"]}, "connection_details": CONNECTION},
+        headers={"Accept-Encoding": "gzip"}
+    )
+    
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == '"id"\n1\n2\n'
+
+def test_compressed_export_file(api, fake_client):
+    fake_client.rows = (["id"], ["UInt32"], [(1,), (2,)])
+    
+    response = api.post(
+        "/export/stream",
+        json={"query_config": {"table_name": "orders", "columns": ["id"], "compression": "gzip"}, "connection_details": CONNECTION}
+    )
+    
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-disposition"] == 'attachment; filename="orders.csv.gz"'
+    assert gzip.decompress(response.content) == b'"id"\n1\n2\n'
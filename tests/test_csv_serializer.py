@@ -0,0 +1,45 @@
+import ast
+import csv
+import io
+
+from clickhouse_connect.datatypes.registry import get_from_name
+
+import main
+
+def encode(columns, type_names):
+    serializer = main.CSVSerializer()
+    return serializer.encode(columns, [get_from_name(name) for name in type_names]).decode("utf-8")
+
+def read_back(text):
+    # ClickHouse literals without NULL, booleans or dates read as Python literals
+    return ast.literal_eval(text)
+
+def test_nested_values_are_written_as_clickhouse_writes_them():
+    columns = [
+        [["a", "b"], ["it's", "back\\slash"]],
+        [["x", None], []],
+        [{"k": 1}, {}],
+        [("a", 1), ("b", 2)],
+        [[19358], [0]],
+        [[1672531200], [0]],
+        [[[1.5, float("nan")]], [[]]]
+    ]
+    type_names = [
+        "Array(String)", "Array(Nullable(String))", "Map(String, UInt8)", "Tuple(String, UInt8)",
+        "Array(Date)", "Array(DateTime)", "Array(Array(Float64))"
+    ]
+    
+    rows = list(csv.reader(io.StringIO(encode(columns, type_names))))
+    
+    assert rows == [
+        ["['a','b']", "['x',NULL]", "{'k':1}", "('a',1)", "['2023-01-01']", "['2023-01-01 00:00:00']", "[[1.5,nan]]"],
+        ["['it\\'s','back\\\\slash']", "[]", "{}", "('b',2)", "['1970-01-01']", "['1970-01-01 00:00:00']", "[[]]"]
+    ]
+
+def test_nested_values_round_trip():
+    columns = [[["a", "it's", "back\\slash", "line\nbreak"]], [{"k": 1, "j": 2}], [("a", (1, ["b"]))]]
+    type_names = ["Array(String)", "Map(String, UInt8)", "Tuple(String, Tuple(UInt8, Array(String)))"]
+    
+    row = next(csv.reader(io.StringIO(encode(columns, type_names))))
+    
+    assert [read_back(text) for text in row] == [columns[0][0], columns[1][0], columns[2][0]]
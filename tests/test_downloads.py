@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+import main
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-3", (0, 3)),
+    ("bytes=4-", (4, 9)),
+    ("bytes=-3", (7, 9)),
+    ("bytes=8-100", (8, 9)),
+    ("bytes=0-1,4-5", None),
+    ("items=0-3", None)
+])
+def test_range_headers(header, expected):
+    assert main.parse_range_header(header, 10) == expected
+
+def test_unsatisfiable_range():
+    with pytest.raises(ValueError):
+        main.parse_range_header("bytes=10-", 10)
+
+def completed_job(job_id):
+    job = main.ExportJob(
+        job_id=job_id,
+        table_name="orders",
+        output_format="csv",
+        status="completed",
+        created_at=time.time(),
+        download_url=f"/download/{job_id}"
+    )
+    main.export_jobs._jobs[job_id] = job
+    with open(main.export_jobs.file_path(job), "wb") as f:
+        f.write(b"0123456789")
+    return job
+
+def test_download_resumes_from_a_range(api):
+    completed_job("resumable")
+    
+    full = api.get("/download/resumable")
+    partial = api.get("/download/resumable", headers={"Range": "bytes=6-", "If-Range": full.headers["etag"]})
+    
+    assert full.status_code == 200 and full.content == b"0123456789"
+    assert partial.status_code == 206
+    assert partial.content == b"6789"
+    assert partial.headers["content-range"] == "bytes 6-9/10"
+
+def test_stale_validator_restarts_the_download(api):
+    completed_job("restarted")
+    
+    response = api.get("/download/restarted", headers={"Range": "bytes=6-", "If-Range": '"restarted-3"'})
+    
+    assert response.status_code == 200
+    assert response.content == b"0123456789"
+
+def test_unsatisfiable_download_range(api):
+    completed_job("past_end")
+    
+    response = api.get("/download/past_end", headers={"Range": "bytes=20-"})
+    
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10"
@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+import main
+
+def test_blocking_calls_run_on_the_operation_executor_with_the_request_context():
+    trace = main.RequestTrace()
+    
+    async def call():
+        main.request_trace.set(trace)
+        return await main.run_blocking("export", lambda: (threading.current_thread().name, main.request_trace.get()))
+    
+    thread_name, worker_trace = asyncio.run(call())
+    
+    assert thread_name.startswith("export-worker")
+    assert worker_trace is trace
+
+def test_blocking_iterators_are_closed_on_the_executor():
+    closed = []
+    
+    def chunks():
+        try:
+            yield b"a"
+            yield b"b"
+        finally:
+            closed.append(threading.current_thread().name)
+    
+    async def read_first():
+        stream = main.iterate_blocking("export", chunks())
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+    
+    assert asyncio.run(read_first()) == b"a"
+    assert len(closed) == 1 and closed[0].startswith("export-worker")
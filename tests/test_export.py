@@ -0,0 +1,72 @@
+import io
+import os
+import shutil
+import threading
+
+import pytest
+from clickhouse_connect.datatypes.registry import get_from_name
+
+from conftest import CONNECTION, FakeStream
+
+import main
+
+def test_cancelled_parallel_export_stops_every_range(fake_client):
+    service = main.ClickHouseService(main.ConnectionDetails(**CONNECTION))
+    service.connect()
+    service.operation_id = "parallel_export"
+    service.cancelled = threading.Event()
+    killed = threading.Event()
+    traces = []
+    
+    def blocks(first):
+        # Range 0 cancels the export after its first block; the others run until
+        # killed, or for five seconds if nothing kills them
+        yield [[1]]
+        if first:
+            service.cancelled.set()
+        for _ in range(500):
+            if killed.wait(0.01):
+                break
+            yield [[2]]
+    
+    def query_column_block_stream(query, parameters=None, settings=None, **kwargs):
+        traces.append(main.request_trace.get())
+        return FakeStream(["id"], [get_from_name("Int64")], blocks("% 3 = 0" in query))
+    
+    def command(query, parameters=None, settings=None, **kwargs):
+        if query.startswith("KILL QUERY WHERE startsWith(query_id, 'parallel_export-')"):
+            killed.set()
+    
+    fake_client.routes.append(("FROM system.columns", ["name", "type", "version"], [("id", "Int64", 1)]))
+    fake_client.query_column_block_stream = query_column_block_stream
+    fake_client.command = command
+    trace = main.RequestTrace()
+    token = main.request_trace.set(trace)
+    try:
+        with pytest.raises(Exception, match="Operation cancelled"):
+            service.export_to_csv("events", ["id"], output=io.BytesIO(), parallel_workers=3)
+    finally:
+        main.request_trace.reset(token)
+        
+    assert killed.is_set()
+    assert traces == [trace] * 3
+    assert "query" in trace.stages
+
+def test_snapshot_is_copied_outside_the_store_lock(tmp_path, monkeypatch):
+    store = main.SnapshotStore(str(tmp_path / "snapshots"), max_bytes=1000)
+    export = tmp_path / "export.csv"
+    export.write_text("id\n1\n")
+    key = "a" * 64
+    store.put(key, str(export), ".csv", 1)
+    
+    def copy(source, target):
+        # Other snapshot calls proceed, and may evict this snapshot, during the copy
+        assert not store._lock.locked()
+        with store._lock:
+            store._remove(key)
+        shutil.copyfile(source, target)
+    monkeypatch.setattr(main, "link_or_copy", copy)
+    
+    assert store.get(key, str(tmp_path / "job.csv")) == 1
+    assert (tmp_path / "job.csv").read_text() == "id\n1\n"
+    assert os.listdir(tmp_path / "snapshots") == []
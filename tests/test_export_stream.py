@@ -0,0 +1,24 @@
+from conftest import CONNECTION
+
+import main
+
+ROWS = (["id", "name"], ["UInt32", "String"], [(1, "a"), (2, "b,c")])
+
+def export(api, headers=None, **query_config):
+    return api.post(
+        "/export/stream",
+        json={"query_config": {"table_name": "orders", "columns": ["id", "name"], **query_config}, "connection_details": CONNECTION},
+        headers={"Accept-Encoding": "identity", **(headers or {})}
+    )
+
+def test_export_streams_every_block_as_csv(api, fake_client):
+    fake_client.rows = ROWS
+    
+    response = export(api)
+    
+    assert response.status_code == 200
+    assert response.text == '"id","name"\n1,"a"\n2,"b,c"\n'
+    assert response.headers["content-disposition"] == 'attachment; filename="orders.csv"'
+    operation = main.operations.get(response.headers["x-operation-id"])
+    assert operation.status == "completed"
+    assert operation.rows_processed == 2
@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import CONNECTION
+
+import main
+
+COLUMNS = {
+    "orders": [("id", "UInt32"), ("status", "LowCardinality(String)"), ("total", "Nullable(Decimal(18, 2))")],
+    "customers": [("id", "UInt32"), ("country", "String")]
+}
+
+@pytest.fixture
+def service(fake_client):
+    def columns(query, parameters):
+        return [(name, column_type, (1, 1)) for name, column_type in COLUMNS.get(parameters["table"], [])]
+    fake_client.routes.append(("SELECT name, type", ["name", "type", "version"], columns))
+    service = main.ClickHouseService(main.ConnectionDetails(**CONNECTION))
+    service.connect()
+    return service
+
+JOIN = main.JoinConfig(join_type="INNER", second_table="customers", join_keys=[main.JoinKeyPair(first_table_key="id", second_table_key="id")])
+
+def test_filters_become_typed_parameters(service):
+    selection = main.RowSelection(
+        filters=[
+            main.FilterPredicate(column="status", op="in", values=["paid", "sent"]),
+            main.FilterPredicate(column="total", op="between", values=["10", "20.5"]),
+            main.FilterPredicate(column="customers.country", op="like", value="U%"),
+            main.FilterPredicate(column="orders.id", op="is not null")
+        ],
+        order_by=[main.OrderByColumn(column="total", descending=True)],
+        limit=10,
+        offset=20
+    )
+    
+    query, parameters = service.select_query("orders", ["orders.id", "total"], JOIN, selection)
+    
+    assert query == (
+        "SELECT orders.id, total FROM orders INNER JOIN customers ON orders.id = customers.id "
+        "WHERE (status IN ({filter_0_0:String}, {filter_0_1:String})) "
+        "AND (total BETWEEN {filter_1_0:Decimal(18, 2)} AND {filter_1_1:Decimal(18, 2)}) "
+        "AND (customers.country LIKE {filter_2_0:String}) AND (orders.id IS NOT NULL) "
+        "ORDER BY total DESC LIMIT 10 OFFSET 20"
+    )
+    assert parameters == {"filter_0_0": "paid", "filter_0_1": "sent", "filter_1_0": "10", "filter_1_1": "20.5", "filter_2_0": "U%"}
+
+@pytest.mark.parametrize("predicate, error", [
+    (main.FilterPredicate(column="id; DROP TABLE orders", op="=", value=1), "Invalid column reference"),
+    (main.FilterPredicate(column="missing", op="=", value=1), "Unknown column"),
+    (main.FilterPredicate(column="users.id", op="=", value=1), "Unknown table"),
+    (main.FilterPredicate(column="id", op="regexp", value="1"), "Unsupported filter operator"),
+    (main.FilterPredicate(column="id", op="between", values=[1]), "needs 2 value")
+])
+def test_invalid_filters_are_rejected(service, predicate, error):
+    with pytest.raises(Exception, match=error):
+        service.select_query("orders", ["id"], JOIN, main.RowSelection(filters=[predicate]))
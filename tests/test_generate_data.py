@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import generate_data
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_zero_row_table_is_written_empty(tmp_path, output_format):
+    options = {
+        "seed": 42,
+        "sizes": {table: 10 for table in generate_data.BASE_ROWS},
+        "chunk_rows": 5,
+        "format": output_format,
+        "compression": "snappy",
+        "split": False,
+        "output_dir": str(tmp_path),
+        "skew": 0,
+        "name_pool": 10,
+        "users": 10,
+        "pages": 10
+    }
+    
+    generate_data.write_table(None, "marketing_campaigns", 0, options, window=1)
+    
+    path = tmp_path / f"marketing_campaigns.{output_format}"
+    if output_format == "csv":
+        assert path.read_text().startswith('"campaign_id","campaign_name"')
+        assert path.read_text().count("\n") == 1
+    else:
+        table = pq.read_table(path)
+        assert table.num_rows == 0
+        assert table.column_names[:2] == ["campaign_id", "campaign_name"]
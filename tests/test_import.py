@@ -0,0 +1,27 @@
+import io
+
+import pytest
+
+import main
+
+def test_batches_are_bounded_and_cover_every_row():
+    data = io.BytesIO(b"id\n" + b"".join(f"{i}\n".encode() for i in range(10)))
+    
+    batches = list(main.CSVService.read_batches(data, batch_size=4, max_in_flight=1))
+    
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert [value for batch in batches for value in batch["id"]] == list(range(10))
+
+def test_stopping_early_ends_the_parser():
+    data = io.BytesIO(b"id\n" + b"".join(f"{i}\n".encode() for i in range(1000)))
+    batches = main.CSVService.read_batches(data, batch_size=1, max_in_flight=1)
+    
+    assert len(next(batches)) == 1
+    # Closing joins the parsing thread, which would otherwise block on the full queue
+    batches.close()
+
+def test_parse_errors_reach_the_consumer():
+    batches = main.CSVService.read_batches(io.BytesIO(b"id,name\n1,a\n2,\"b\n"), batch_size=1)
+    
+    with pytest.raises(Exception, match="EOF inside string"):
+        list(batches)
@@ -0,0 +1,63 @@
+import os
+import sys
+import types
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import import_data
+
+class FakeClient:
+    def __init__(self, table_types, failures=0):
+        self.table_types = table_types
+        self.failures = failures
+        self.batches = []
+        self.tokens = []
+    
+    def query(self, query):
+        rows = [{"name": name, "type": col_type} for name, col_type in self.table_types.items()]
+        return types.SimpleNamespace(named_results=lambda: rows)
+    
+    def create_insert_context(self, table_name, column_names=None, column_type_names=None):
+        return types.SimpleNamespace(table=table_name, column_names=column_names, settings=None)
+    
+    def insert_df(self, df=None, context=None):
+        self.tokens.append(context.settings["insert_deduplication_token"])
+        if self.failures:
+            self.failures -= 1
+            raise Exception("Connection reset")
+        self.batches.append(df)
+
+def test_date_columns_are_parsed(tmp_path):
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text("id,day,seen_at,note\n1,2023-03-03,2023-03-03 10:00:00,a\n2,2023-09-13,2023-09-28 11:30:00,b\n")
+    client = FakeClient({
+        "id": "UInt32",
+        "day": "Date",
+        "seen_at": "Nullable(DateTime)",
+        "note": "LowCardinality(String)"
+    })
+    
+    stats = import_data.import_csv_to_clickhouse(client, "events", str(csv_file), batch_size=1)
+    
+    assert stats["rows"] == 2
+    assert len(client.batches) == 2
+    for batch in client.batches:
+        assert pd.api.types.is_datetime64_any_dtype(batch["day"])
+        assert pd.api.types.is_datetime64_any_dtype(batch["seen_at"])
+        assert not pd.api.types.is_datetime64_any_dtype(batch["note"])
+    assert client.batches[1]["seen_at"].iloc[0] == pd.Timestamp("2023-09-28 11:30:00")
+
+def test_retries_reuse_the_batch_token(tmp_path):
+    csv_file = tmp_path / "events.csv"
+    csv_file.write_text("id,note\n1,a\n2,b\n")
+    client = FakeClient({"id": "UInt32", "note": "String"}, failures=1)
+    
+    import_data.import_csv_to_clickhouse(client, "events", str(csv_file), batch_size=1, backoff=0)
+    
+    assert len(client.batches) == 2
+    assert len(client.tokens) == 3
+    assert client.tokens[0] == client.tokens[1]
+    assert client.tokens[1] != client.tokens[2]
+    assert client.tokens[0].startswith("events.csv:")
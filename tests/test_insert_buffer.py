@@ -0,0 +1,62 @@
+import pandas as pd
+
+from conftest import CONNECTION
+
+import main
+
+COLUMN_TYPES = {"id": "UInt32"}
+
+def frame(*ids):
+    return pd.DataFrame({"id": list(ids)})
+
+def test_small_imports_are_coalesced_into_one_insert(fake_client):
+    buffer = main.InsertBuffer(max_rows=4, max_delay=60)
+    
+    first = buffer.submit("orders", fake_client, "orders", COLUMN_TYPES, frame(1, 2))
+    second = buffer.submit("orders", fake_client, "orders", COLUMN_TYPES, frame(3, 4))
+    
+    assert (first.result(timeout=5), second.result(timeout=5)) == (2, 2)
+    assert [list(df["id"]) for df in fake_client.inserted] == [[1, 2, 3, 4]]
+    assert buffer.stats()["flushes"] == 1
+    assert main.client_pool.stats()["checked_out"] == 0
+
+def test_pending_rows_are_flushed_after_the_delay(fake_client):
+    buffer = main.InsertBuffer(max_rows=100, max_delay=0.05)
+    
+    future = buffer.submit("orders", fake_client, "orders", COLUMN_TYPES, frame(1))
+    
+    assert future.result(timeout=5) == 1
+    assert [list(df["id"]) for df in fake_client.inserted] == [[1]]
+
+def test_failed_flush_fails_every_batch(fake_client):
+    def insert_df(df=None, context=None, **kwargs):
+        raise Exception("Too many parts")
+    fake_client.insert_df = insert_df
+    buffer = main.InsertBuffer(max_rows=2, max_delay=60)
+    
+    futures = [buffer.submit("orders", fake_client, "orders", COLUMN_TYPES, frame(i)) for i in (1, 2)]
+    
+    for future in futures:
+        assert str(future.exception(timeout=5)) == "Too many parts"
+    assert buffer.stats()["failed_flushes"] == 1
+
+def test_async_mode_sends_every_insert_with_async_insert(api, fake_client):
+    fake_client.routes.append(("SELECT name, type", ["name", "type", "version"], [("id", "UInt32", (1, 1))]))
+    settings = []
+    insert_df = fake_client.insert_df
+    
+    def record_settings(df=None, context=None, **kwargs):
+        settings.append(context.settings)
+        return insert_df(df=df, context=context)
+    fake_client.insert_df = record_settings
+    session = api.post("/sessions", json=CONNECTION).json()["session_token"]
+    
+    result = api.post(
+        "/import?table_name=orders&mode=async&batch_size=1",
+        files={"file": ("orders.csv", b"id\n1\n2\n")},
+        headers={"X-Session-Token": session}
+    ).json()
+    
+    assert result["success"] and result["records_processed"] == 2
+    assert len(settings) == 2
+    assert all(s["async_insert"] == 1 and s["wait_for_async_insert"] == 1 for s in settings)
@@ -0,0 +1,81 @@
+import time
+
+from conftest import CONNECTION
+
+JOIN_CHAIN = [
+    {
+        "second_table": "customers",
+        "join_type": "INNER",
+        "join_keys": [{"first_table_key": "customer_id", "second_table_key": "customer_id"}]
+    },
+    {
+        "second_table": "products",
+        "join_type": "INNER",
+        "join_keys": [{"first_table_key": "product_id", "second_table_key": "product_id"}]
+    }
+]
+
+def query_config(**fields):
+    return {"table_name": "sales", "columns": ["sales.id", "customers.name", "products.name"], "join_config": JOIN_CHAIN, **fields}
+
+def test_preview_two_join_chain(api, fake_client):
+    fake_client.routes.append(("SELECT sales.id", ["id", "customer", "product"], [(1, "Ann", "Lamp")]))
+    
+    response = api.post("/preview", json={"query_config": query_config(), "connection_details": CONNECTION})
+    
+    assert response.status_code == 200, response.text
+    assert response.json() == [{"id": 1, "customer": "Ann", "product": "Lamp"}]
+    query = fake_client.queries[-1]
+    # INNER joins can drop left rows, so the left side is not limited
+    assert "INNER JOIN customers ON sales.customer_id = customers.customer_id" in query
+    assert "INNER JOIN products ON sales.product_id = products.product_id" in query
+    assert "preview_left" not in query
+
+def test_left_join_preview_reads_one_limited_left_side(api, fake_client):
+    fake_client.routes.append(("SELECT sorting_key", ["sorting_key", "version"], [("id", 1)]))
+    fake_client.routes.append(("preview_left", ["id", "customer", "product"], [(1, "Ann", "Lamp")]))
+    chain = [{**join, "join_type": "LEFT"} for join in JOIN_CHAIN]
+    
+    response = api.post("/preview", json={"query_config": query_config(join_config=chain), "connection_details": CONNECTION})
+    
+    assert response.status_code == 200, response.text
+    query = fake_client.queries[-1]
+    assert query.startswith(
+        "WITH preview_left AS (SELECT * FROM sales ORDER BY id, cityHash64(*) LIMIT 100) "
+        "SELECT sales.id, customers.name, products.name FROM preview_left AS sales "
+    )
+    assert query.count("FROM sales") == 1
+    assert "LEFT JOIN (SELECT * FROM customers WHERE (customer_id) IN (SELECT customer_id FROM preview_left)) AS customers" in query
+    assert "LEFT JOIN (SELECT * FROM products WHERE (product_id) IN (SELECT product_id FROM preview_left)) AS products" in query
+    assert query.endswith(" LIMIT 100")
+
+def test_export_two_join_chain(api, fake_client):
+    fake_client.rows = (["id", "customer", "product"], ["Int64", "String", "String"], [(1, "Ann", "Lamp")])
+    
+    response = api.post("/export", json={"query_config": query_config(reorder_joins=False), "connection_details": CONNECTION})
+    job_id = response.json()["job_id"]
+    assert job_id, response.json()
+    for _ in range(100):
+        job = api.get(f"/export/jobs/{job_id}").json()
+        if job["status"] not in ("pending", "running"):
+            break
+        time.sleep(0.02)
+        
+    assert job["status"] == "completed", job
+    assert api.get(job["download_url"]).text == '"id","customer","product"\n1,"Ann","Lamp"\n'
+    query = fake_client.queries[-1]
+    assert "INNER JOIN customers ON sales.customer_id = customers.customer_id" in query
+    assert "INNER JOIN products ON sales.product_id = products.product_id" in query
+
+def test_plan_joins_keeps_request_order_without_row_counts(fake_client):
+    import main
+    from conftest import CONNECTION as details
+    
+    service = main.ClickHouseService(main.ConnectionDetails(**details))
+    service.connect()
+    joins = [main.JoinConfig(**join) for join in JOIN_CHAIN]
+    
+    for _ in range(5):
+        table_name, planned = service.plan_joins("sales", joins)
+        assert table_name == "sales"
+        assert [join.second_table for join in planned] == ["customers", "products"]
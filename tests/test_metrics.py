@@ -0,0 +1,47 @@
+import time
+
+from conftest import CONNECTION
+
+import main
+
+def test_histograms_and_labels_render_in_prometheus_format():
+    metrics = main.Metrics(buckets=(0.1, 1))
+    metrics.inc("rows_processed_total", 5, operation="import")
+    metrics.observe("stage_duration_seconds", 0.5, stage="parse")
+    metrics.observe("stage_duration_seconds", 2, stage="parse")
+    
+    text = metrics.render()
+    
+    assert 'rows_processed_total{operation="import"} 5' in text
+    assert 'stage_duration_seconds_bucket{stage="parse",le="0.1"} 0' in text
+    assert 'stage_duration_seconds_bucket{stage="parse",le="1"} 1' in text
+    assert 'stage_duration_seconds_bucket{stage="parse",le="+Inf"} 2' in text
+    assert 'stage_duration_seconds_sum{stage="parse"} 2.5' in text
+    assert "# TYPE stage_duration_seconds histogram" in text
+
+def test_nested_stages_are_timed_exclusively():
+    metrics = main.Metrics()
+    trace = main.RequestTrace()
+    token = main.request_trace.set(trace)
+    try:
+        with metrics.stage("insert"):
+            with metrics.stage("metadata"):
+                time.sleep(0.05)
+    finally:
+        main.request_trace.reset(token)
+    
+    assert trace.stages["metadata"] >= 0.05
+    assert trace.stages["insert"] < 0.05
+
+def test_requests_are_counted_by_route_template(api):
+    api.get("/operations/unknown")
+    
+    text = api.get("/metrics").text
+    
+    assert 'http_requests_total{method="GET",route="/operations/{operation_id}",status="404"}' in text
+
+def test_trace_header_returns_server_timing(api, fake_client):
+    response = api.post("/connect", json=CONNECTION, headers={"X-Trace": "1"})
+    
+    assert response.headers["server-timing"].startswith("connect;dur=")
+    assert "total;dur=" in response.headers["server-timing"]
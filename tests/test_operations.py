@@ -0,0 +1,57 @@
+from conftest import CONNECTION
+
+import main
+
+def test_duplicate_operation_id_leaves_the_running_import_alone(api, fake_client):
+    service = main.ClickHouseService(main.ConnectionDetails(**CONNECTION))
+    main.operations.start(service, "import", "orders", "orders_load")
+    session = api.post("/sessions", json=CONNECTION).json()["session_token"]
+    
+    result = api.post(
+        "/import?table_name=orders&operation_id=orders_load",
+        files={"file": ("orders.csv", b"id\n1\n")},
+        headers={"X-Session-Token": session}
+    ).json()
+    
+    assert not result["success"]
+    assert "already exists" in result["error"]
+    assert main.operations.get("orders_load").status == "running"
+    main.operations.finish("orders_load")
+
+def start_stream(operation_id):
+    service = main.ClickHouseService(main.ConnectionDetails(**CONNECTION))
+    service.connect()
+    operation = main.operations.start(service, "export_stream", "orders", operation_id)
+    closed = []
+    
+    def chunks():
+        try:
+            yield b"a\n"
+            yield b"b\n"
+        finally:
+            closed.append(True)
+    return operation, chunks(), closed
+
+def test_unread_export_stream_is_cancelled_after_the_response(fake_client):
+    operation, chunks, _ = start_stream("unread_stream")
+    main.operations.track_stream(operation.operation_id, chunks)
+    
+    main.operations.end_stream(operation.operation_id, chunks)
+    
+    assert operation.status == "cancelled"
+    assert fake_client.queries[-1].startswith("KILL QUERY WHERE startsWith(query_id, 'unread_stream-')")
+    assert main.client_pool.stats()["checked_out"] == 0
+
+def test_export_stream_closed_early_is_cancelled(fake_client):
+    operation, chunks, closed = start_stream("closed_stream")
+    tracked = main.operations.track_stream(operation.operation_id, chunks)
+    
+    assert next(tracked) == b"a\n"
+    tracked.close()
+    
+    assert operation.status == "cancelled"
+    assert closed == [True]
+    assert fake_client.queries[-1].startswith("KILL QUERY WHERE startsWith(query_id, 'closed_stream-')")
+    main.operations.end_stream(operation.operation_id, chunks)
+    assert operation.status == "cancelled"
+    assert main.client_pool.stats()["checked_out"] == 0
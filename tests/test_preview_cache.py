@@ -0,0 +1,46 @@
+import json
+
+import main
+
+def rows(value):
+    return [{"id": 1, "name": value}]
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    size = len(json.dumps(rows("a")))
+    cache = main.ResultCache(max_bytes=2 * size)
+    cache.put("first", rows("a"), ["orders"])
+    cache.put("second", rows("b"), ["orders"])
+    assert cache.get("first") == rows("a")
+    
+    cache.put("third", rows("c"), ["orders"])
+    
+    assert cache.get("second") is None
+    assert cache.get("first") == rows("a")
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size_bytes"] == 2 * size
+
+def test_results_larger_than_the_budget_are_not_cached():
+    cache = main.ResultCache(max_bytes=10)
+    
+    cache.put("large", rows("x" * 100), ["orders"])
+    
+    assert cache.get("large") is None
+    assert cache.stats()["entries"] == 0
+
+def test_expired_entries_are_misses():
+    cache = main.ResultCache(ttl=0)
+    cache.put("expired", rows("a"), ["orders"])
+    
+    assert cache.get("expired") is None
+    assert cache.stats()["misses"] == 1
+
+def test_invalidation_drops_entries_reading_the_table():
+    cache = main.ResultCache()
+    connection = ("localhost", "8123", "default")
+    cache.put((connection + ("default",), "orders"), rows("a"), ["orders", "customers"])
+    cache.put((connection + ("default",), "products"), rows("b"), ["products"])
+    
+    cache.invalidate(connection, "customers")
+    
+    assert cache.get((connection + ("default",), "orders")) is None
+    assert cache.get((connection + ("default",), "products")) == rows("b")
@@ -0,0 +1,27 @@
+from conftest import CONNECTION
+
+import main
+
+def service(username):
+    service = main.ClickHouseService(main.ConnectionDetails(**{**CONNECTION, "username": username}))
+    service.connect()
+    return service
+
+def test_table_listings_are_cached_per_user(fake_client):
+    fake_client.routes.append(("SELECT table, name, type", ["table", "name", "type", "version"], [("orders", "id", "UInt32", (1, 1))]))
+    
+    assert [table.name for table in service("analyst").list_tables()] == ["orders"]
+    fake_client.routes[0] = ("SELECT table, name, type", ["table", "name", "type", "version"], [])
+    
+    # Another user with other grants reads the listing from ClickHouse
+    assert service("guest").list_tables() == []
+    assert [table.name for table in service("analyst").list_tables()] == ["orders"]
+
+def test_invalidation_covers_every_user(fake_client):
+    for username in ("analyst", "guest"):
+        main.schema_cache.put(service(username)._schema_key("table", "orders"), ["cached"], 1)
+        
+    main.schema_cache.invalidate("localhost", "8123", "default", "orders")
+    
+    assert main.schema_cache.get(service("analyst")._schema_key("table", "orders")) is None
+    assert main.schema_cache.get(service("guest")._schema_key("table", "orders")) is None
@@ -0,0 +1,35 @@
+import io
+
+import pandas as pd
+import pytest
+
+import main
+
+def infer(*values):
+    return main.CSVService.infer_column_type(pd.Series(values, dtype=object))
+
+@pytest.mark.parametrize("values, expected", [
+    (("1234.56", "0.07", "-19.99"), "Decimal(9, 2)"),
+    (("1234567890123.5", "1.0"), "Decimal(18, 1)"),
+    (("1.5", None), "Nullable(Decimal(9, 1))"),
+    (("1.5", "2.25"), "Float64"),
+    (("1.5e3", "2.5"), "Float64"),
+    (("12", "-3"), "Int8"),
+    (("2023-01-31",), "Date"),
+    (("abc", "1.5"), "String"),
+])
+def test_infer_column_type(values, expected):
+    assert infer(*values) == expected
+
+def test_float32_is_opt_in(monkeypatch):
+    assert infer("1.5", "2.25") == "Float64"
+    monkeypatch.setattr(main, "INFER_FLOAT32", True)
+    assert infer("1.5", "2.25") == "Float32"
+
+def test_decimal_columns_are_read_exactly():
+    options = main.CSVService.read_options({"price": "Nullable(Decimal(9, 2))"}, ["price"])
+    
+    df = pd.read_csv(io.StringIO("price\n1234.56\n\n0.07\n"), skip_blank_lines=False, **options)
+    
+    assert df["price"].tolist()[0] == "1234.56"
+    assert df["price"].tolist()[2] == "0.07"
@@ -0,0 +1,68 @@
+from conftest import CONNECTION
+
+import main
+
+UPLOAD = b"id,updated_at,amount\n1,2023-01-31 10:00:00,5\n2,2023-02-01 11:00:00,6\n"
+COLUMNS = [("id", "UInt32"), ("updated_at", "DateTime"), ("amount", "UInt8")]
+
+def table_columns(created):
+    def rows(query, parameters):
+        return [(name, col_type, 1) for name, col_type in COLUMNS] if created() else []
+    return rows
+
+def import_upload(api, flow):
+    session = api.post("/sessions", json=CONNECTION).json()["session_token"]
+    return api.post(
+        f"/import?table_name=orders&sync_flow={flow}&watermark_column=updated_at&id_column=id",
+        files={"file": ("orders.csv", UPLOAD)},
+        headers={"X-Session-Token": session}
+    ).json()
+
+def test_sync_table_is_not_partitioned_by_the_watermark(api, fake_client):
+    created = lambda: any(query.startswith("CREATE TABLE") for query in fake_client.queries)
+    fake_client.routes.append(("FROM system.columns", ["name", "type", "version"], table_columns(created)))
+    
+    result = import_upload(api, "orders_new")
+    
+    assert result["success"], result
+    create = next(query for query in fake_client.queries if query.startswith("CREATE TABLE"))
+    assert "ENGINE = ReplacingMergeTree(updated_at)" in create
+    assert "ORDER BY (id)" in create
+    assert "PARTITION BY" not in create
+    assert result["table_layout"]["partition_by"] is None
+
+def test_sync_rejects_table_partitioned_by_a_mutable_column(api, fake_client):
+    fake_client.routes.append(("FROM system.columns", ["name", "type", "version"], table_columns(lambda: True)))
+    fake_client.routes.append(
+        ("partition_key FROM system.tables", ["engine", "sorting_key", "partition_key"],
+         [("ReplacingMergeTree", "id", "toYYYYMM(updated_at)")])
+    )
+    
+    result = import_upload(api, "orders_existing")
+    
+    assert not result["success"]
+    assert "partitioned by id or not at all, not by updated_at" in result["error"]
+    assert fake_client.inserted == []
+    assert main.sync_flows.get("orders_existing") is None
+
+def test_sync_export_window_rereads_the_lookback(fake_client):
+    from conftest import CONNECTION as details
+    
+    fake_client.routes += [
+        ("FROM system.columns", ["name", "type", "version"], table_columns(lambda: True)),
+        ("SELECT toString({value:DateTime} - {amount:UInt64})", ["value"], [("2023-02-01 09:00:00",)]),
+        ("toString(max(", ["max", "count"], [("2023-02-01 11:00:00", 3)])
+    ]
+    service = main.ClickHouseService(main.ConnectionDetails(**details))
+    service.connect()
+    sync = {"flow": "orders_out", "watermark_column": "updated_at"}
+    
+    for lookback, lower in ((None, "2023-02-01 10:00:00"), (3600, "2023-02-01 09:00:00")):
+        config = main.QueryConfig(table_name="orders", columns=["id"], sync={**sync, "lookback": lookback})
+        windowed, watermark = main.ExportJobManager._sync_window(service, config, "2023-02-01 10:00:00")
+        
+        assert watermark == "2023-02-01 11:00:00"
+        assert [(f.column, f.op, f.value) for f in windowed.filters] == [
+            ("orders.updated_at", "<=", "2023-02-01 11:00:00"),
+            ("orders.updated_at", ">", lower)
+        ]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from conftest import CONNECTION
+
+import main
+
+COLUMNS = [main.ColumnSchema(name="id", type="UInt32"), main.ColumnSchema(name="ts", type="DateTime")]
+
+def create(**layout):
+    return main.ClickHouseService.create_table_query("events", COLUMNS, main.TableLayout(**layout))
+
+def test_create_table_query_writes_the_layout():
+    query = create(
+        order_by=["id"], partition_by="toYYYYMM(ts)",
+        skip_indexes=[{"name": "idx_id", "expression": "intDiv(id, 10)", "type": "set(100)"}]
+    )
+    
+    assert query == (
+        "CREATE TABLE events (id UInt32, ts DateTime, INDEX idx_id intDiv(id, 10) TYPE set(100) GRANULARITY 4) "
+        "ENGINE = MergeTree() PARTITION BY toYYYYMM(ts) ORDER BY (id)"
+    )
+
+@pytest.mark.parametrize("layout, error", [
+    ({"partition_by": "toYYYYMM(ts)) SETTINGS storage_policy = 'x'"}, "Unbalanced parentheses"),
+    ({"partition_by": "ts; DROP TABLE users"}, "Unsupported character ';'"),
+    ({"partition_by": "file('/etc/passwd')"}, "Unsupported function file"),
+    ({"partition_by": "toYYYYMM(created)"}, "Unknown PARTITION BY column"),
+    ({"skip_indexes": [{"name": "idx ts", "expression": "ts"}]}, "Invalid skip index name"),
+    ({"skip_indexes": [{"name": "idx", "expression": "ts) TYPE minmax, INDEX x (id"}]}, "Unbalanced parentheses"),
+    ({"skip_indexes": [{"name": "idx", "expression": "ts", "type": "minmax GRANULARITY 1) --"}]}, "Invalid skip index type"),
+])
+def test_create_table_query_rejects_unsafe_layouts(layout, error):
+    with pytest.raises(Exception, match=error):
+        create(**layout)
+
+def test_create_table_query_rejects_unsafe_column_names():
+    columns = COLUMNS + [main.ColumnSchema(name="x String) ENGINE = Log --", type="String")]
+    with pytest.raises(Exception, match="Invalid table or column name"):
+        main.ClickHouseService.create_table_query("events", columns)
+
+def test_import_rejects_unsafe_layout_with_400(api, fake_client):
+    session = api.post("/sessions", json=CONNECTION).json()["session_token"]
+    
+    response = api.post(
+        "/import?table_name=events",
+        files={"file": ("events.csv", b"id,ts\n1,2023-01-01 00:00:00\n")},
+        data={"table_layout": json.dumps({"partition_by": "ts; DROP TABLE users"})},
+        headers={"X-Session-Token": session}
+    )
+    
+    assert response.status_code == 400
+    assert "Unsupported character" in response.json()["detail"]
+    assert not any(query.startswith("CREATE TABLE") for query in fake_client.queries)
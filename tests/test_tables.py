@@ -0,0 +1,24 @@
+from conftest import CONNECTION
+
+COLUMNS = [
+    ("customers", "id", "UInt32", (1, 1)),
+    ("customers", "name", "String", (1, 1)),
+    ("orders", "id", "UInt32", (1, 1)),
+    ("orders", "customer_id", "UInt32", (1, 1)),
+    ("orders", "total", "Float64", (1, 1))
+]
+
+def test_tables_and_columns_come_from_one_query(api, fake_client):
+    seen = []
+    
+    def rows(query, parameters):
+        seen.append(parameters)
+        return COLUMNS
+    fake_client.routes.append(("FROM system.columns", ["table", "name", "type", "version"], rows))
+    
+    tables = api.post("/tables?name_filter=o&offset=2&limit=2", json=CONNECTION).json()
+    
+    assert [(table["name"], len(table["columns"])) for table in tables] == [("customers", 2), ("orders", 3)]
+    assert [query for query in fake_client.queries if "DESCRIBE" in query] == []
+    assert len([query for query in fake_client.queries if "system.columns" in query]) == 1
+    assert seen == [{"database": "default", "name_filter": "o", "limit": 2, "offset": 2}]